@@ -0,0 +1,77 @@
+"""
+Compare the tree walking interpreter and the bytecode VM on the same programs, JIT disabled, parsing excluded
+
+Usage: python -m benchmarks.interpreters --repeat 5
+"""
+import argparse
+from pathlib import Path
+import time
+
+from src import bytecode, interpreter
+from src.interpreter import build_builtin_env, interpret_module
+from src.lark_parser import initialize_parser
+
+FIBO = """
+fibo: fn(u64)u64 = fn(n:u64)u64:
+    n: Mut(u64) = n
+    res: Mut(u64) = 0
+    if n == 0:
+        res = 0
+    else:
+        if n <= 2:
+            res = 1
+        else:
+            n = n - 2
+            a: Mut(u64) = 1
+            res = 1
+            while n != 0:
+                tmp: u64 = a
+                a = res
+                res = tmp + res
+                n = n - 1
+    res
+
+i: Mut(u64) = 0
+while i < {iterations}:
+    fibo(80)
+    i = i + 1
+"""
+
+CALLS = """
+inc: fn(u64) u64 = fn(x: u64) u64: x + 1
+i: Mut(u64) = 0
+while i < {iterations}:
+    i = inc(i)
+"""
+
+PROGRAMS = {"fibo(80) loop": (FIBO, 100), "calls": (CALLS, 10_000)}
+
+
+def best_time(run, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent.parent / "src" / "grammar.lark")
+    args = arg_parser.parse_args()
+
+    interpreter.JIT_COMPILE = False
+    # the VM does not memoize by default, both run every call
+    interpreter.MEMOIZE = False
+    parser, _ = initialize_parser(args.grammar_definition)
+    vm = bytecode.VM()
+
+    print(f"{'program':>15} {'tree walker (ms)':>17} {'bytecode VM (ms)':>17} {'speedup':>8}")
+    for name, (source, iterations) in PROGRAMS.items():
+        module = parser.parse(source.format(iterations=iterations))
+        module_code = bytecode.compile_module(module)
+        tree_walker = best_time(lambda: interpret_module(module, build_builtin_env()), args.repeat)
+        vm_time = best_time(lambda: vm.run(module_code, build_builtin_env()), args.repeat)
+        print(f"{name:>15} {tree_walker * 1000:>17.1f} {vm_time * 1000:>17.1f} {tree_walker / vm_time:>7.1f}x")
@@ -0,0 +1,62 @@
+"""
+Measure the throughput of a jitted function called on arrays: one call from python per element, and the
+batched calls of `JITFunctionCall.batch`, in millions of elements per second
+
+Usage: python -m benchmarks.jit_batch --elements 1000000
+"""
+import argparse
+import array
+from pathlib import Path
+import tempfile
+import time
+
+from src import interpreter
+from src.compile import JITEngine
+from src.interpreter import build_builtin_env, interpret_module
+from src.lark_parser import initialize_parser
+
+FUNCTIONS = {
+    "inc": "inc: fn(u64) u64 = fn(x: u64) u64: x + 1",
+    "add3": "add3: fn(u64, u64, u64) u64 = fn(a: u64, b: u64, c: u64) u64: a + b + c",
+    # the function of examples/fibo.jil, a loop of arithmetic and comparisons
+    "fibo": (Path(__file__).absolute().parent.parent / "examples" / "fibo.jil").read_text().partition("\n\nprint")[0],
+}
+
+
+def throughput(run, elements) -> float:
+    """Millions of elements per second"""
+    t = time.perf_counter_ns()
+    run()
+    return elements / (time.perf_counter_ns() - t) * 1e3
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--elements", type=int, default=1_000_000)
+    arg_parser.add_argument("--jit-backend", choices=JITEngine.backends, default="native")
+    arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent.parent / "src" / "grammar.lark")
+    args = arg_parser.parse_args()
+
+    # only the explicitly compiled functions are jitted
+    interpreter.JIT_COMPILE = False
+    # the interpreted timings run every call, and memoized functions calling themselves are not compiled
+    interpreter.MEMOIZE = False
+    parser, _ = initialize_parser(args.grammar_definition)
+    # small values, fibo loops on them
+    values = array.array("Q", (i % 90 for i in range(args.elements)))
+
+    print(f"{'function':>10} {'per call (M/s)':>15} {'batch (M/s)':>12} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as compilation_dir:
+        engine = JITEngine(compilation_dir=compilation_dir, backend=args.jit_backend)
+        for name, source in FUNCTIONS.items():
+            func = interpret_module(parser.parse(f"{source}\n"), build_builtin_env()).get(name)
+            engine.compile_function(func)
+            jit_call = func.jit_function_call
+            arrays = [values] * len(func.arguments)
+            out = array.array("Q", bytes(8 * args.elements))
+            # compiles the loop of the batch outside of the measure
+            jit_call.batch(*(arg_values[:1] for arg_values in arrays), out=out[:1])
+
+            per_call = throughput(lambda: [jit_call(*element) for element in zip(*arrays)], args.elements)
+            batch = throughput(lambda: jit_call.batch(*arrays, out=out), args.elements)
+            print(f"{name:>10} {per_call:>15.2f} {batch:>12.1f} {batch / per_call:>7.0f}x")
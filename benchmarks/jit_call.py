@@ -0,0 +1,71 @@
+"""
+Measure the overhead of calling a tiny jitted function from the interpreter, in ns per call, and the
+speedup of a recursive function whose calls stay in the jitted code
+
+Usage: python -m benchmarks.jit_call
+"""
+import argparse
+from pathlib import Path
+import tempfile
+import time
+
+from src import interpreter
+from src.compile import JITEngine
+from src.interpreter import build_builtin_env, interpret_func_call, interpret_module
+from src.lark_parser import initialize_parser
+
+# source, arguments and number of calls timed, fewer for the slow interpreted calls
+FUNCTIONS = {
+    "inc": ("inc: fn(u64) u64 = fn(x: u64) u64: x + 1", (41,), 10_000),
+    "add3": ("add3: fn(u64, u64, u64) u64 = fn(a: u64, b: u64, c: u64) u64: a + b + c", (1, 2, 3), 10_000),
+    # the function of examples/fibo.jil, a loop of arithmetic and comparisons
+    "fibo": ((Path(__file__).absolute().parent.parent / "examples" / "fibo.jil").read_text().partition("\n\nprint")[0], (80,), 1_000),
+    # recursive calls, direct native calls in the jitted code, about 100 ms per interpreted call
+    "fib_rec": (
+        "fib_rec: fn(u64) u64 = fn(n: u64) u64:\n"
+        "    res: Mut(u64) = n\n"
+        "    if n > 1:\n"
+        "        res = fib_rec(n - 1) + fib_rec(n - 2)\n"
+        "    res",
+        (15,),
+        20,
+    ),
+}
+
+
+def time_per_call(func, args, calls):
+    t = time.perf_counter_ns()
+    for _ in range(calls):
+        func(*args)
+    return (time.perf_counter_ns() - t) / calls
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--calls", type=int, help="calls timed for each function, overrides the count of each function")
+    arg_parser.add_argument("--jit-backend", choices=JITEngine.backends, default="native")
+    arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent.parent / "src" / "grammar.lark")
+    args = arg_parser.parse_args()
+
+    # only the explicitly compiled functions are jitted
+    interpreter.JIT_COMPILE = False
+    # the interpreted timings run every call, and memoized functions calling themselves are not compiled
+    interpreter.MEMOIZE = False
+    parser, _ = initialize_parser(args.grammar_definition)
+    env = build_builtin_env()
+
+    print(f"{'function':>10} {'interpreted (ns)':>17} {'jitted (ns)':>12} {'raw ctypes (ns)':>16}")
+    with tempfile.TemporaryDirectory() as compilation_dir:
+        engine = JITEngine(compilation_dir=compilation_dir, backend=args.jit_backend)
+        for name, (source, call_args, calls) in FUNCTIONS.items():
+            calls = args.calls or calls
+            module = parser.parse(f"{source}\n")
+            func = interpret_module(module, env).get(name)
+            # before compiling, the recursive calls would go to the jitted code
+            interpreted = time_per_call(lambda *a: interpret_func_call(func, a, func.closure, force_intepret=True), call_args, calls)
+            engine.compile_function(func)
+
+            jitted = time_per_call(func.jit_function_call, call_args, calls)
+            # lower bound: the ctypes call alone, without any conversion
+            raw = time_per_call(func.jit_function_call._compiled_func, call_args, calls)
+            print(f"{name:>10} {interpreted:>17.0f} {jitted:>12.0f} {raw:>16.0f}")
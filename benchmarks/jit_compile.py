@@ -0,0 +1,55 @@
+"""
+Measure the JIT compilation latency as the number of compiled functions grows
+
+Usage: python -m benchmarks.jit_compile --counts 1 10 100 1000
+"""
+import argparse
+from pathlib import Path
+import tempfile
+import time
+
+from src.compile import JITEngine
+from src.interpreter import build_builtin_env, interpret_module
+from src.lark_parser import initialize_parser
+
+FUNC_SOURCE = """
+f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:
+    c: Mut(u64) = a
+    while c < b:
+        c = c + {step}
+    c
+"""
+
+
+def parse_function(parser, env, step):
+    # functions need to be different, otherwise they are compiled once and reused from the cache
+    module = parser.parse(FUNC_SOURCE.format(step=step))
+    return interpret_module(module, env).get("f")
+
+
+def bench(count, parser, backend):
+    env = build_builtin_env()
+    funcs = [parse_function(parser, env, step) for step in range(1, count + 1)]
+    with tempfile.TemporaryDirectory() as compilation_dir:
+        engine = JITEngine(compilation_dir=compilation_dir, backend=backend)
+        timings = []
+        for func in funcs:
+            t = time.perf_counter_ns()
+            engine.compile_function(func)
+            timings.append(time.perf_counter_ns() - t)
+    return timings
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 100, 1000])
+    arg_parser.add_argument("--jit-backend", choices=JITEngine.backends, default="native")
+    arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent.parent / "src" / "grammar.lark")
+    args = arg_parser.parse_args()
+
+    parser, _ = initialize_parser(args.grammar_definition)
+
+    print(f"{'functions':>10} {'total (ms)':>12} {'mean (ms)':>10} {'last (ms)':>10}")
+    for count in args.counts:
+        timings = bench(count, parser, args.jit_backend)
+        print(f"{count:>10} {sum(timings) / 1e6:>12.1f} {sum(timings) / len(timings) / 1e6:>10.2f} {timings[-1] / 1e6:>10.2f}")
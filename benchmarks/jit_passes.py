@@ -0,0 +1,72 @@
+"""
+Measure what each optimization pass brings to the jitted code, in ns per call of the compiled function
+
+Each function is compiled without optimization, with each pass alone, and with all the passes.
+
+Usage: python -m benchmarks.jit_passes
+"""
+import argparse
+from pathlib import Path
+import tempfile
+import time
+
+from src import interpreter
+from src.compile import JITEngine
+from src.interpreter import build_builtin_env, interpret_module
+from src.lark_parser import initialize_parser
+from src.optimizer import DEFAULT_PASSES, PASSES
+
+FUNCTIONS = {
+    # the function of examples/fibo.jil, a loop of arithmetic and comparisons
+    "fibo": ((Path(__file__).absolute().parent.parent / "examples" / "fibo.jil").read_text().partition("\n\nprint")[0], (10_000,)),
+    # an invariant product, a multiplication of the loop counter and constants to fold
+    "sum_scaled": (
+        "sum_scaled: fn(u64, u64, u64) u64 = fn(n: u64, a: u64, b: u64) u64:\n"
+        "    i: Mut(u64) = 0\n"
+        "    s: Mut(u64) = 0\n"
+        "    step: u64 = 2 - 1\n"
+        "    while i < n:\n"
+        "        s = s + i * 8 + a * b\n"
+        "        i = i + step\n"
+        "    s",
+        (10_000, 3, 5),
+    ),
+}
+
+
+def time_per_call(func, args, calls, repeat=5):
+    """Best of `repeat` runs, the passes change the timings less than the noise of a single run"""
+    timings = []
+    for _ in range(repeat):
+        t = time.perf_counter_ns()
+        for _ in range(calls):
+            func(*args)
+        timings.append((time.perf_counter_ns() - t) / calls)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--calls", type=int, default=1_000)
+    arg_parser.add_argument("--jit-backend", choices=JITEngine.backends, default="native")
+    arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent.parent / "src" / "grammar.lark")
+    args = arg_parser.parse_args()
+
+    # only the explicitly compiled functions are jitted
+    interpreter.JIT_COMPILE = False
+    # the interpreted timings run every call, and memoized functions calling themselves are not compiled
+    interpreter.MEMOIZE = False
+    parser, _ = initialize_parser(args.grammar_definition)
+    configurations = {"none": (), **{name: (name,) for name in PASSES}, "all": DEFAULT_PASSES}
+
+    print(f"{'passes':>34} " + " ".join(f"{name + ' (ns)':>16}" for name in FUNCTIONS))
+    with tempfile.TemporaryDirectory() as compilation_dir:
+        for configuration, passes in configurations.items():
+            engine = JITEngine(compilation_dir=compilation_dir, backend=args.jit_backend, passes=passes)
+            timings = []
+            for name, (source, call_args) in FUNCTIONS.items():
+                func = interpret_module(parser.parse(f"{source}\n"), build_builtin_env()).get(name)
+                engine.compile_function(func)
+                # the ctypes call alone, without any conversion
+                timings.append(time_per_call(func.jit_function_call._compiled_func, call_args, args.calls))
+            print(f"{configuration:>34} " + " ".join(f"{timing:>16.0f}" for timing in timings))
@@ -0,0 +1,55 @@
+"""
+Measure the startup of the interpreter: import of `src.interpreter` and construction of the parser
+
+Each run is a new python process. The parser is built from the grammar ("no cache"), built and saved to an
+empty cache ("cold cache"), and loaded from the saved cache ("warm cache").
+
+Usage: python -m benchmarks.startup --runs 10
+"""
+import argparse
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = Path(__file__).absolute().parent.parent
+
+STARTUP_SCRIPT = """
+import time
+t = time.perf_counter_ns()
+import src.interpreter
+from src.lark_parser import initialize_parser
+imported = time.perf_counter_ns()
+initialize_parser({grammar!r}, cache_dir={cache_dir!r})
+print(imported - t, time.perf_counter_ns() - imported)
+"""
+
+
+def run_startup(grammar, cache_dir) -> tuple[int, int]:
+    """Import and parser construction times, in ns"""
+    script = STARTUP_SCRIPT.format(grammar=str(grammar), cache_dir=cache_dir and str(cache_dir))
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    import_time, parser_time = map(int, out.split())
+    return import_time, parser_time
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--runs", type=int, default=10)
+    arg_parser.add_argument("--grammar-definition", default=ROOT / "src" / "grammar.lark")
+    args = arg_parser.parse_args()
+
+    timings = {"no cache": [], "cold cache": [], "warm cache": []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for run in range(args.runs):
+            timings["no cache"].append(run_startup(args.grammar_definition, None))
+            cache_dir = Path(tmp_dir) / str(run)
+            timings["cold cache"].append(run_startup(args.grammar_definition, cache_dir))
+            timings["warm cache"].append(run_startup(args.grammar_definition, cache_dir))
+
+    print(f"{'parser':>12} {'import (ms)':>12} {'parser (ms)':>12} {'total (ms)':>12}")
+    for name, runs in timings.items():
+        import_time = statistics.median(import_time for import_time, _ in runs) / 1e6
+        parser_time = statistics.median(parser_time for _, parser_time in runs) / 1e6
+        print(f"{name:>12} {import_time:>12.1f} {parser_time:>12.1f} {import_time + parser_time:>12.1f}")
@@ -0,0 +1,171 @@
+"""
+Run the example programs and the workloads of `benchmarks/workloads` in each execution mode, and report the
+time spent parsing, compiling and executing them as JSON
+
+Modes:
+- interpreter: the tree walking interpreter, JIT disabled
+- jit: hot functions and loops are compiled, synchronously so that the compilation time is measured
+- sampled: as jit, and some jitted calls are also interpreted to compare the results (`src.verification`)
+- shadow: as jit, and each jitted call is also interpreted
+- memoized: as jit, and the results of pure functions are cached (`src.purity`), the other modes run every call
+
+The compilation time is split into the phases of `CompileMetrics.phase_ns`, the execution time excludes it.
+Each value is the median of the repeated runs.
+
+Usage:
+    python -m benchmarks.suite --repeat 5 --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json  # exits with 1 if some timing regressed
+    python -m benchmarks.suite --baseline baseline.json --input current.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+from pathlib import Path
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import lark
+
+from src import interpreter
+from src.compile import JITEngine
+from src.interpreter import build_builtin_env, interpret_module
+from src.lark_parser import parse_source
+from src.verification import Verifier
+
+ROOT = Path(__file__).absolute().parent.parent
+WORKLOADS = sorted((ROOT / "examples").glob("*.jil")) + sorted((ROOT / "benchmarks" / "workloads").glob("*.jil"))
+# JIT enabled, verification mode, memoization enabled
+MODES = {
+    "interpreter": (False, "off", False),
+    "jit": (True, "off", False),
+    "sampled": (True, "sampled", False),
+    "shadow": (True, "full", False),
+    "memoized": (True, "off", True),
+}
+TIMINGS = ("parse_ns", "compile_ns", "execute_ns", "total_ns")
+RESULTS_VERSION = 1
+
+
+def run_once(source, grammar, mode, backend, compilation_dir) -> dict:
+    t = time.perf_counter_ns()
+    module = parse_source(source, grammar, ast_cache_dir=None)
+    parse_ns = time.perf_counter_ns() - t
+
+    engine = JITEngine(compilation_dir, backend=backend)
+    jit_compile, verify_mode, memoize = MODES[mode]
+    interpreter.JIT_COMPILE, interpreter.VERIFIER, interpreter.JIT_ENGINE, interpreter.MEMOIZE = jit_compile, Verifier(verify_mode), engine, memoize
+    t = time.perf_counter_ns()
+    with contextlib.redirect_stdout(io.StringIO()):
+        interpret_module(module, build_builtin_env())
+    run_ns = time.perf_counter_ns() - t
+
+    compile_ns = sum(engine.metrics.compile_latencies)
+    return {
+        "parse_ns": parse_ns,
+        "compile_ns": compile_ns,
+        "compile_phases_ns": dict(engine.metrics.phase_ns),
+        "execute_ns": run_ns - compile_ns,
+        "total_ns": parse_ns + run_ns,
+        "compiled": engine.metrics.completed,
+        "compile_failures": engine.metrics.failed,
+    }
+
+
+def median_run(runs: list[dict]) -> dict:
+    phases = {phase for run in runs for phase in run["compile_phases_ns"]}
+    return {
+        **{key: int(statistics.median(run[key] for run in runs)) for key in TIMINGS},
+        "compile_phases_ns": {phase: int(statistics.median(run["compile_phases_ns"].get(phase, 0) for run in runs)) for phase in sorted(phases)},
+        "compiled": runs[-1]["compiled"],
+        "compile_failures": runs[-1]["compile_failures"],
+    }
+
+
+def run_suite(workloads, modes, repeat, backend, grammar) -> dict:
+    results = {}
+    saved_globals = {name: getattr(interpreter, name, None) for name in ("JIT_COMPILE", "VERIFIER", "JIT_ENGINE", "MEMOIZE")}
+    # the compilation failures are counted in the results
+    interpreter.logger.setLevel(logging.CRITICAL)
+    try:
+        for path in workloads:
+            source = path.read_text()
+            workload = str(path.relative_to(ROOT)) if path.is_relative_to(ROOT) else str(path)
+            results[workload] = {}
+            for mode in modes:
+                runs = []
+                try:
+                    # a new cache for each run, nothing is reused across runs
+                    for _ in range(repeat):
+                        with tempfile.TemporaryDirectory() as compilation_dir:
+                            runs.append(run_once(source, grammar, mode, backend, compilation_dir))
+                except Exception as err:
+                    results[workload][mode] = {"error": repr(err)}
+                    continue
+                results[workload][mode] = median_run(runs)
+                print(f"{workload} {mode}: {results[workload][mode]['total_ns'] / 1e6:.1f} ms", file=sys.stderr)
+    finally:
+        for name, value in saved_globals.items():
+            setattr(interpreter, name, value)
+        interpreter.logger.setLevel(logging.INFO)
+    return {
+        "version": RESULTS_VERSION,
+        "environment": {"python": platform.python_version(), "lark": lark.__version__, "machine": platform.machine(), "backend": backend},
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta_ns: int) -> dict:
+    """
+    Timings of `current` slower than in `baseline` by more than `threshold` (relative) and `min_delta_ns`, and
+    the ones faster by as much, programs that are not in both are ignored
+    """
+    regressions, improvements = [], []
+    for workload, modes in current["results"].items():
+        for mode, result in modes.items():
+            base = baseline["results"].get(workload, {}).get(mode)
+            if base is None or "error" in base or "error" in result:
+                continue
+            for key in TIMINGS:
+                delta = result[key] - base[key]
+                if abs(delta) < min_delta_ns or abs(delta) <= threshold * base[key]:
+                    continue
+                entry = {"workload": workload, "mode": mode, "timing": key, "baseline": base[key], "current": result[key],
+                         "ratio": round(result[key] / base[key], 3) if base[key] else None}
+                (regressions if delta > 0 else improvements).append(entry)
+    return {"threshold": threshold, "min_delta_ns": min_delta_ns, "regressions": regressions, "improvements": improvements}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    arg_parser.add_argument("--workloads", nargs="+", type=Path, default=WORKLOADS, help="jil files to run, defaults to the examples and benchmarks/workloads")
+    arg_parser.add_argument("--jit-backend", choices=JITEngine.backends, default="native")
+    arg_parser.add_argument("--grammar-definition", default=ROOT / "src" / "grammar.lark")
+    arg_parser.add_argument("--output", type=Path, help="write the results to this file instead of stdout")
+    arg_parser.add_argument("--baseline", type=Path, help="results to compare with, the comparison is written instead of the results")
+    arg_parser.add_argument("--input", type=Path, help="results to compare with the baseline, instead of running the suite")
+    arg_parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    arg_parser.add_argument("--min-delta-ms", type=float, default=1.0, help="smaller differences are noise")
+    args = arg_parser.parse_args()
+
+    if args.input:
+        current = json.loads(args.input.read_text())
+    else:
+        workloads = [path.absolute() for path in args.workloads]
+        current = run_suite(workloads, args.modes, args.repeat, args.jit_backend, args.grammar_definition)
+        if args.output:
+            args.output.write_text(json.dumps(current, indent=2) + "\n")
+
+    if args.baseline:
+        comparison = compare(json.loads(args.baseline.read_text()), current, args.threshold, int(args.min_delta_ms * 1e6))
+        print(json.dumps(comparison, indent=2))
+        sys.exit(1 if comparison["regressions"] else 0)
+    elif not args.output:
+        print(json.dumps(current, indent=2))
@@ -0,0 +1,202 @@
+"""
+Ahead of time compilation of jil functions to a standalone executable, or to a shared library with a C header
+
+The module is run once with the interpreter, JIT disabled and its output discarded, to get the function values of
+the entrypoints. They are compiled with the gcc backend of the JIT engine, with the functions they call, and the
+assembly of the compiled code and of the builtins is linked with a small C stub:
+- executable: `main` parses the arguments of the entrypoint (u64, decimal or 0x prefixed) and prints its result, it
+  exits with the status 2 and its usage when they are not valid
+- shared library: each entrypoint is exported under its jil name, and declared in a header next to the library
+
+Only functions of u64 values that the JIT can compile are supported. The result does not need python.
+
+Usage:
+    python -m src.aot --input-file examples/fibo.jil --entrypoint fibo --output fibo && ./fibo 80
+    python -m src.aot --input-file examples/fibo.jil --entrypoint fibo --shared --output libfibo.so
+"""
+import contextlib
+import io
+from pathlib import Path
+import subprocess
+import tempfile
+
+from src.ast_definition import ASTNoReturn
+from src.ir import IRError, layout_of
+from src.runtime import Function, Runtime
+
+EXECUTABLE_STUB = """\
+#include <errno.h>
+#include <inttypes.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+{declaration};
+
+static int usage(char *program) {{
+    fprintf(stderr, "usage: %s{usage}\\n", program);
+    return 2;
+}}
+
+/* a whole u64 argument, decimal or 0x prefixed, without sign nor spaces, a leading 0 is not octal */
+static int parse_u64(const char *arg, uint64_t *value) {{
+    const char *digits = "0123456789";
+    int base = 10;
+    if (arg[0] == '0' && (arg[1] == 'x' || arg[1] == 'X')) {{
+        arg += 2;
+        digits = "0123456789abcdefABCDEF";
+        base = 16;
+    }}
+    if (*arg == '\\0' || strspn(arg, digits) != strlen(arg)) {{
+        return 0;
+    }}
+    errno = 0;
+    *value = strtoull(arg, NULL, base);
+    return errno == 0;
+}}
+
+int main(int argc, char **argv) {{
+    uint64_t args[{arg_count} + 1];
+    if (argc != {arg_count} + 1) {{
+        return usage(argv[0]);
+    }}
+    for (int i = 1; i < argc; i++) {{
+        if (!parse_u64(argv[i], &args[i - 1])) {{
+            return usage(argv[0]);
+        }}
+    }}
+{call}
+    return 0;
+}}
+"""
+
+HEADER = """\
+#ifndef {guard}
+#define {guard}
+
+#include <stdint.h>
+
+{declarations}
+
+#endif
+"""
+
+
+# can not name the exported functions, the parameters are renamed
+C_KEYWORDS = {
+    "auto", "break", "case", "char", "const", "continue", "default", "do", "double", "else", "enum", "extern", "float",
+    "for", "goto", "if", "inline", "int", "long", "register", "restrict", "return", "short", "signed", "sizeof", "static",
+    "struct", "switch", "typedef", "union", "unsigned", "void", "volatile", "while",
+}
+
+
+class AOTError(RuntimeError):
+    ...
+
+
+def c_name(name: str) -> str:
+    return f"{name}_" if name in C_KEYWORDS else name
+
+
+def c_signature(label: str, function: Function) -> str:
+    """C declaration of a compiled function of u64 values"""
+    for arg in function.func.arguments:
+        try:
+            is_u64 = layout_of(arg.ident_type) == "u64"
+        except IRError:
+            is_u64 = False
+        if not is_u64:
+            raise NotImplementedError(f"Ahead of time compilation is only implemented for u64 arguments, not {arg.ident.value}: {arg.ident_type} of {function.name}")
+    ret = function.func.return_type
+    if not isinstance(ret, ASTNoReturn) and layout_of(ret) != "u64":
+        raise NotImplementedError(f"Ahead of time compilation is only implemented for u64 results, not {ret} of {function.name}")
+    params = ", ".join(f"uint64_t {c_name(arg.ident.value)}" for arg in function.func.arguments) or "void"
+    return f"{'void' if isinstance(ret, ASTNoReturn) else 'uint64_t'} {label}({params})"
+
+
+def compile_functions(source: str, entrypoints: list[str], compilation_dir) -> tuple[list[tuple[Function, str]], list[Path]]:
+    """Compiled entrypoints, with their labels, and the assembly files of the compiled code"""
+    with Runtime(jit_compile=False, jit_backend="gcc", jit_workers=0, verify="off", memoize=False, compilation_dir=compilation_dir) as runtime:
+        # the top level statements run, only the function values they declare are kept
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = runtime.load_source(source)
+        compiled = []
+        for name in entrypoints:
+            function = module.function(name)
+            try:
+                function.compile()
+            except NotImplementedError as err:
+                # IRError included
+                raise AOTError(f"Can not compile the entrypoint {name}: {err}") from err
+            compiled.append((function, function.func.jit_function_call.function_label))
+        return compiled, runtime.jit_engine.assembly_files()
+
+
+def gcc(*args):
+    res = subprocess.run(["gcc", "-O2", *map(str, args)], capture_output=True, text=True)
+    if res.returncode != 0:
+        raise AOTError(f"Failed to link with error: {res.stderr}")
+
+
+def build_executable(source: str, entrypoint: str, output: Path, compilation_dir=".jil_cache"):
+    [(function, label)], assembly_files = compile_functions(source, [entrypoint], compilation_dir)
+    arguments = ", ".join(f"args[{i}]" for i in range(len(function.func.arguments)))
+    if isinstance(function.func.return_type, ASTNoReturn):
+        call = f"    {label}({arguments});"
+    else:
+        call = f'    printf("%" PRIu64 "\\n", {label}({arguments}));'
+    stub = EXECUTABLE_STUB.format(
+        declaration=c_signature(label, function),
+        arg_count=len(function.func.arguments),
+        usage="".join(f" {arg.ident.value}" for arg in function.func.arguments),
+        call=call,
+    )
+    with tempfile.TemporaryDirectory() as build_dir:
+        stub_file = Path(build_dir) / "main.c"
+        stub_file.write_text(stub)
+        gcc("-o", output, stub_file, *assembly_files)
+
+
+def build_shared_library(source: str, entrypoints: list[str], output: Path, compilation_dir=".jil_cache") -> Path:
+    """Build the library, returns the path of its header"""
+    compiled, assembly_files = compile_functions(source, entrypoints, compilation_dir)
+    wrappers = []
+    declarations = []
+    for function, label in compiled:
+        if function.name in C_KEYWORDS:
+            raise AOTError(f"{function.name} is a keyword of C, it can not be exported")
+        declarations.append(c_signature(function.name, function) + ";")
+        call = f"{label}({', '.join(c_name(arg.ident.value) for arg in function.func.arguments)})"
+        body = f"{call};" if isinstance(function.func.return_type, ASTNoReturn) else f"return {call};"
+        wrappers.append(f"{c_signature(label, function)};\n{c_signature(function.name, function)} {{ {body} }}")
+
+    header_file = output.with_name(output.name.removesuffix(".so").removeprefix("lib") + ".h")
+    guard = "".join(char if char.isalnum() else "_" for char in header_file.name).upper()
+    header_file.write_text(HEADER.format(guard=guard, declarations="\n".join(declarations)))
+    with tempfile.TemporaryDirectory() as build_dir:
+        wrapper_file = Path(build_dir) / "exports.c"
+        wrapper_file.write_text(f'#include "{header_file.absolute()}"\n\n' + "\n\n".join(wrappers) + "\n")
+        gcc("-shared", "-fPIC", "-o", output, wrapper_file, *assembly_files)
+    return header_file
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--input-file", type=Path, required=True)
+    arg_parser.add_argument("--entrypoint", nargs="+", required=True, help="functions to compile, a single one for an executable")
+    arg_parser.add_argument("--output", type=Path, required=True)
+    arg_parser.add_argument("--shared", action="store_true", help="build a shared library and its C header instead of an executable")
+    arg_parser.add_argument("--compilation-dir", type=Path, default=Path(".jil_cache"), help="cache of the JIT engine, the compiled functions are reused")
+    args = arg_parser.parse_args()
+
+    source = args.input_file.read_text()
+    if args.shared:
+        header = build_shared_library(source, args.entrypoint, args.output, args.compilation_dir)
+        print(f"Built {args.output} and {header}")
+    else:
+        if len(args.entrypoint) != 1:
+            arg_parser.error("an executable has a single entrypoint")
+        build_executable(source, args.entrypoint[0], args.output, args.compilation_dir)
+        print(f"Built {args.output}")
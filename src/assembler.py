@@ -0,0 +1,286 @@
+"""
+Minimal x86-64 assembler for the AT&T syntax subset emitted by `CompilationContext`
+
+Used by the native JIT backend to place compiled functions directly in executable memory,
+without going through gcc and the filesystem.
+"""
+import ctypes
+from dataclasses import dataclass
+from functools import lru_cache
+import mmap
+import struct
+
+
+class AssemblerError(ValueError):...
+
+REGISTERS_64 = {
+    "rax": 0, "rcx": 1, "rdx": 2, "rbx": 3, "rsp": 4, "rbp": 5, "rsi": 6, "rdi": 7,
+    "r8": 8, "r9": 9, "r10": 10, "r11": 11, "r12": 12, "r13": 13, "r14": 14, "r15": 15,
+}
+REGISTERS_8 = {
+    "al": 0, "cl": 1, "dl": 2, "bl": 3, "spl": 4, "bpl": 5, "sil": 6, "dil": 7,
+    **{f"r{i}b": i for i in range(8, 16)},
+}
+
+CONDITION_CODES = {
+    "o": 0, "no": 1, "b": 2, "c": 2, "nae": 2, "ae": 3, "nb": 3, "nc": 3,
+    "e": 4, "z": 4, "ne": 5, "nz": 5, "be": 6, "na": 6, "a": 7, "nbe": 7,
+    "s": 8, "ns": 9, "p": 10, "np": 11, "l": 12, "nge": 12, "ge": 13, "nl": 13,
+    "le": 14, "ng": 14, "g": 15, "nle": 15,
+}
+
+# opcode of `op r64, r/m64`, and the modrm extension for the immediate form
+ALU_OPS = {
+    "add": (0x01, 0), "or": (0x09, 1), "and": (0x21, 4), "sub": (0x29, 5), "xor": (0x31, 6), "cmp": (0x39, 7),
+}
+# single operand instructions of the F7 group, by modrm extension
+UNARY_OPS = {"not": 2, "neg": 3, "mul": 4, "imul": 5, "div": 6, "idiv": 7}
+SHIFT_OPS = {"shl": 4, "sal": 4, "shr": 5, "sar": 7}
+
+
+@dataclass(frozen=True)
+class Reg:
+    code: int
+    size: int = 8
+
+@dataclass(frozen=True)
+class Mem:
+    base: int
+    disp: int = 0
+
+@dataclass(frozen=True)
+class Imm:
+    value: int
+
+
+def parse_operand(text: str):
+    text = text.strip()
+    if text.startswith("%"):
+        name = text[1:]
+        if name in REGISTERS_64:
+            return Reg(REGISTERS_64[name])
+        if name in REGISTERS_8:
+            return Reg(REGISTERS_8[name], size=1)
+        raise AssemblerError(f"Unknown register {text}")
+    if text.startswith("$"):
+        value = int(text[1:], 0)
+        # 64 bits immediates are two's complement, unsigned values are stored as their signed equivalent
+        if 2**63 <= value < 2**64:
+            value -= 2**64
+        return Imm(value)
+    if text.endswith(")"):
+        disp, _, base = text[:-1].partition("(")
+        base = parse_operand(base)
+        if not isinstance(base, Reg) or base.size != 8:
+            raise AssemblerError(f"Unsupported memory operand {text}")
+        return Mem(base.code, int(disp, 0) if disp else 0)
+    if text.startswith("*"):
+        raise AssemblerError(f"Indirect operands are not supported ({text})")
+    # anything else is a label, calls through the PLT (for gcc) go directly to their target
+    return text.removesuffix("@PLT")
+
+
+def parse_line(line: str):
+    """Returns None, a label definition ("name:") or a (mnemonic, operands) tuple"""
+    line = line.partition("#")[0].strip()
+    if not line or line.startswith("."):
+        return None
+    if line.endswith(":"):
+        return line
+    mnemonic, _, operands = line.partition(" ")
+    operands = [parse_operand(op) for op in operands.split(",")] if operands.strip() else []
+    return mnemonic, operands
+
+
+def _fits_i8(value):
+    return -2**7 <= value < 2**7
+
+def _fits_i32(value):
+    return -2**31 <= value < 2**31
+
+def _rex(w=False, reg=0, index=0, rm=0, force=False):
+    rex = 0x40 | (w << 3) | ((reg >> 3) << 2) | ((index >> 3) << 1) | (rm >> 3)
+    return bytes([rex]) if rex != 0x40 or force else b""
+
+def _modrm(reg, rm_operand):
+    """Encode the modrm (+sib +displacement) bytes for a register or memory operand"""
+    reg &= 7
+    if isinstance(rm_operand, Reg):
+        return bytes([0xC0 | (reg << 3) | (rm_operand.code & 7)])
+    base = rm_operand.base & 7
+    sib = b"\x24" if base == 4 else b""
+    # rbp/r13 as a base always need a displacement
+    if rm_operand.disp == 0 and base != 5:
+        return bytes([(reg << 3) | base]) + sib
+    if _fits_i8(rm_operand.disp):
+        return bytes([0x40 | (reg << 3) | base]) + sib + struct.pack("<b", rm_operand.disp)
+    if _fits_i32(rm_operand.disp):
+        return bytes([0x80 | (reg << 3) | base]) + sib + struct.pack("<i", rm_operand.disp)
+    raise AssemblerError(f"Displacement too large {rm_operand.disp}")
+
+def _rm_code(operand):
+    return operand.code if isinstance(operand, Reg) else operand.base
+
+def _encode_rm(opcode: bytes, reg, rm_operand, w=True, force_rex=False):
+    return _rex(w=w, reg=reg, rm=_rm_code(rm_operand), force=force_rex) + opcode + _modrm(reg, rm_operand)
+
+
+def _strip_suffix(mnemonic, names):
+    if mnemonic in names:
+        return mnemonic
+    if mnemonic.endswith("q") and mnemonic[:-1] in names:
+        return mnemonic[:-1]
+    return None
+
+
+def encode_instruction(mnemonic, operands):
+    """
+    Encode one instruction, returns the bytes and a label for the rel32 fixup at the end
+    of the instruction (jumps and calls), or None
+    """
+    match mnemonic, operands:
+        case ("ret" | "retq"), []:
+            return b"\xc3", None
+        case "nop", []:
+            return b"\x90", None
+        case "cqo", []:
+            return b"\x48\x99", None
+        case ("call" | "callq"), [str() as label]:
+            return b"\xe8\x00\x00\x00\x00", label
+        case ("call" | "callq"), [Reg(code, 8)]:
+            return _encode_rm(b"\xff", 2, Reg(code), w=False), None
+        case ("jmp" | "jmpq"), [str() as label]:
+            return b"\xe9\x00\x00\x00\x00", label
+        case _, [str() as label] if mnemonic[0] == "j" and mnemonic[1:] in CONDITION_CODES:
+            return bytes([0x0f, 0x80 | CONDITION_CODES[mnemonic[1:]]]) + b"\x00\x00\x00\x00", label
+        case _, [Reg(code, 1) as dst] if mnemonic.startswith("set") and mnemonic[3:] in CONDITION_CODES:
+            return _encode_rm(bytes([0x0f, 0x90 | CONDITION_CODES[mnemonic[3:]]]), 0, dst, w=False, force_rex=code >= 4), None
+        case ("push" | "pushq"), [Reg(code, 8)]:
+            return _rex(rm=code) + bytes([0x50 | (code & 7)]), None
+        case ("push" | "pushq"), [Imm(value)] if _fits_i8(value):
+            return b"\x6a" + struct.pack("<b", value), None
+        case ("push" | "pushq"), [Imm(value)] if _fits_i32(value):
+            return b"\x68" + struct.pack("<i", value), None
+        case ("push" | "pushq"), [Mem() as src]:
+            return _encode_rm(b"\xff", 6, src, w=False), None
+        case ("pop" | "popq"), [Reg(code, 8)]:
+            return _rex(rm=code) + bytes([0x58 | (code & 7)]), None
+        case ("pop" | "popq"), [Mem() as dst]:
+            return _encode_rm(b"\x8f", 0, dst, w=False), None
+        case ("mov" | "movq"), [Reg(src, 8), (Reg(_, 8) | Mem()) as dst]:
+            return _encode_rm(b"\x89", src, dst), None
+        case ("mov" | "movq"), [Mem() as src, Reg(dst, 8)]:
+            return _encode_rm(b"\x8b", dst, src), None
+        case ("mov" | "movq"), [Imm(value), (Reg(_, 8) | Mem()) as dst] if _fits_i32(value):
+            return _encode_rm(b"\xc7", 0, dst) + struct.pack("<i", value), None
+        case ("mov" | "movq" | "movabsq"), [Imm(value), Reg(dst, 8)]:
+            if not -2**63 <= value < 2**63:
+                raise AssemblerError(f"Immediate too large {value}")
+            return _rex(w=True, rm=dst) + bytes([0xb8 | (dst & 7)]) + struct.pack("<q", value), None
+        case "movzbq", [Reg(src, 1), Reg(dst, 8)]:
+            return _encode_rm(b"\x0f\xb6", dst, Reg(src, 1), w=True, force_rex=src >= 4), None
+        case ("lea" | "leaq"), [Mem() as src, Reg(dst, 8)]:
+            return _encode_rm(b"\x8d", dst, src), None
+        case ("test" | "testq"), [Reg(src, 8), (Reg(_, 8) | Mem()) as dst]:
+            return _encode_rm(b"\x85", src, dst), None
+        case ("imul" | "imulq"), [(Reg(_, 8) | Mem()) as src, Reg(dst, 8)]:
+            return _encode_rm(b"\x0f\xaf", dst, src), None
+
+    if (op := _strip_suffix(mnemonic, ALU_OPS)) is not None:
+        opcode, extension = ALU_OPS[op]
+        match operands:
+            case [Reg(src, 8), (Reg(_, 8) | Mem()) as dst]:
+                return _encode_rm(bytes([opcode]), src, dst), None
+            case [Mem() as src, Reg(dst, 8)]:
+                return _encode_rm(bytes([opcode + 2]), dst, src), None
+            case [Imm(value), (Reg(_, 8) | Mem()) as dst] if _fits_i8(value):
+                return _encode_rm(b"\x83", extension, dst) + struct.pack("<b", value), None
+            case [Imm(value), (Reg(_, 8) | Mem()) as dst] if _fits_i32(value):
+                return _encode_rm(b"\x81", extension, dst) + struct.pack("<i", value), None
+
+    if (op := _strip_suffix(mnemonic, UNARY_OPS)) is not None:
+        match operands:
+            case [(Reg(_, 8) | Mem()) as operand]:
+                return _encode_rm(b"\xf7", UNARY_OPS[op], operand), None
+
+    if (op := _strip_suffix(mnemonic, SHIFT_OPS)) is not None:
+        match operands:
+            case [Imm(value), (Reg(_, 8) | Mem()) as dst] if 0 <= value < 64:
+                return _encode_rm(b"\xc1", SHIFT_OPS[op], dst) + bytes([value]), None
+
+    raise AssemblerError(f"Unsupported instruction {mnemonic} {operands}")
+
+
+@lru_cache(maxsize=4096)
+def _encode_line(line: str):
+    """Returns None, a label definition or the encoded instruction, cached as functions share most of their lines"""
+    match parse_line(line):
+        case None:
+            return None
+        case str() as label:
+            return label
+        case (mnemonic, operands):
+            return encode_instruction(mnemonic, operands)
+
+
+def assemble(asm_code: str, base_address: int, symbols: dict[str, int]):
+    """
+    Assemble `asm_code` as if loaded at `base_address`
+
+    Labels not defined in `asm_code` are resolved with `symbols` (absolute addresses).
+    Returns the machine code and the address of each label it defines.
+    """
+    code = bytearray()
+    labels = {}
+    fixups = []
+    for line in asm_code.splitlines():
+        match _encode_line(line):
+            case None:
+                continue
+            case str() as label:
+                labels[label[:-1]] = len(code)
+            case (encoded, target):
+                code += encoded
+                if target is not None:
+                    fixups.append((len(code), target))
+
+    labels = {label: base_address + offset for label, offset in labels.items()}
+    for end_offset, target in fixups:
+        if target in labels:
+            target_address = labels[target]
+        elif target in symbols:
+            target_address = symbols[target]
+        else:
+            raise AssemblerError(f"Undefined label {target}")
+        rel = target_address - (base_address + end_offset)
+        if not _fits_i32(rel):
+            raise AssemblerError(f"Jump to {target} out of range")
+        code[end_offset - 4:end_offset] = struct.pack("<i", rel)
+
+    return bytes(code), labels
+
+
+class CodeArena:
+    """
+    A region of executable memory, filled linearly
+
+    It is allocated once so that every function placed in it can call the others with rel32 calls.
+    """
+    alignment = 16
+    def __init__(self, size=16 * 2**20) -> None:
+        self._memory = mmap.mmap(-1, size, prot=mmap.PROT_READ | mmap.PROT_WRITE | mmap.PROT_EXEC)
+        self.base_address = ctypes.addressof(ctypes.c_char.from_buffer(self._memory))
+        self.size = size
+        self.used = 0
+
+    def next_address(self):
+        return self.base_address + self.used
+
+    def place(self, asm_code: str, symbols: dict[str, int]) -> dict[str, int]:
+        """Assemble `asm_code` at the end of the arena, returns the addresses of the labels it defines"""
+        code, labels = assemble(asm_code, self.next_address(), symbols)
+        if self.used + len(code) > self.size:
+            raise AssemblerError("Code arena is full")
+        self._memory[self.used:self.used + len(code)] = code
+        self.used += -(-len(code) // self.alignment) * self.alignment
+        return labels
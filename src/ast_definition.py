@@ -1,6 +1,8 @@
 from abc import ABC
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import cached_property
 from typing import Callable, Tuple
+import weakref
 
 import lark
 from lark.indenter import Indenter
@@ -33,6 +35,8 @@ class ASTNoReturn(ASTNode):
 
 # Terminals
 class ASTNumber(ASTNode):
+    # runtime value of the literal, created once by the resolver
+    literal = None
     @classmethod
     def from_tree(cls, children):
         val, = children
@@ -45,6 +49,8 @@ class ASTNumber(ASTNode):
 
 class ASTOp(ASTNode):...
 class ASTIdentifier(ASTNode):
+    # (depth, slot) set by the resolver
+    address = None
     @classmethod
     def from_tree(cls, children):
         val, = children
@@ -149,36 +155,36 @@ class ASTStructureType(ASTType):
     def from_tree(cls, children):
         return cls(tuple(children))
     
+    @cached_property
+    def shape(self) -> "StructShape":
+        """Shape of the values cast to this type, casting them to it again is free"""
+        return StructShape(tuple(f.ident.value for f in self.fields), tuple(f.ident_type for f in self.fields))
+
     def cast(self, obj):
-        if not isinstance(obj, ASTStructValue):
+        if not isinstance(obj, StructValue):
             raise TypeError(f"Object of type {type(obj)} do not match struct {self}")
+        shape = self.shape
+        if obj.shape is shape:
+            return obj
 
-        val_field_names = {f.ident.value for f in obj.fields}
-        typ_field_names = {f.ident.value for f in self.fields}
-        if val_field_names != typ_field_names:
+        index = obj.shape.index
+        if len(index) != len(shape.index) or any(name not in index for name in shape.names):
+            val_field_names, typ_field_names = set(index), set(shape.index)
             raise TypeError(f"Fields do not match"
                             f"{f' expected {typ_field_names - val_field_names}' if typ_field_names - val_field_names else ''}"
                             f"{f' unexpected {val_field_names - typ_field_names}' if val_field_names - typ_field_names else ''}")
-        
-        final_fields = []
-        for field in (f.ident for f in self.fields):
-            field_typ, = (f.ident_type for f in self.fields if f.ident.value == field.value)
-            obj_field_value, = (f.value for f in obj.fields if f.ident.value == field.value)
-            final_fields.append(ASTStructMember(field, field_typ.cast(obj_field_value)))
-        
-        return ASTStructValue(tuple(final_fields))
-    
+
+        values = obj.values
+        return StructValue(shape, tuple(typ.cast(values[index[name]]) for name, typ in zip(shape.names, shape.types)))
+
     def __eq__(self, other) -> bool:
         if not isinstance(other, ASTStructureType):
             return False
-        val_field_names = {f.ident.value for f in other.fields}
-        typ_field_names = {f.ident.value for f in self.fields}
-        if val_field_names != typ_field_names:
+        shape, other_shape = self.shape, other.shape
+        if len(shape.index) != len(other_shape.index):
             return False
-        for field in (f.ident for f in self.fields):
-            field_typ, = (f.ident_type for f in self.fields if f.ident.value == field.value)
-            other_typ, = (f.ident_type for f in other.fields if f.ident.value == field.value)
-            if field_typ != other_typ:
+        for name, typ in zip(shape.names, shape.types):
+            if name not in other_shape.index or other_shape.types[other_shape.index[name]] != typ:
                 return False
         return True
 
@@ -210,7 +216,9 @@ class ASTVarDeclaration(ASTNode):
         rvalue = ASTUninitValue(None)
         return cls(lvalue, var_type, rvalue)
 
-class ASTModule(ASTNullary):...
+class ASTModule(ASTNullary):
+    # set by the resolver
+    scope = None
 
 class ASTBlock(ASTNode):
     value: Tuple[ASTStatement]
@@ -247,11 +255,23 @@ class ASTIfStatement(ASTNode):
 class ASTWhileStatement(ASTNode):
     cond: ASTExpression
     block: ASTBlock
+
+    # runtime attributes, for on stack replacement
+    backedge_count: int = field(default=0, repr=False, compare=False)
+    jit_loop_call: Callable | None = field(default=None, repr=False, compare=False)
+    jit_failed: bool = field(default=False, repr=False, compare=False)
+    # addresses of the names visible in the loop, set by the resolver
+    bindings: dict | None = field(default=None, repr=False, compare=False)
     @classmethod
     def from_tree(cls, children):
         cond, block = children
         return cls(cond, block)
 
+    def invalidate(self):
+        """A function the compiled loop calls directly is not the one held by its variable anymore, see `Frame.rebind`"""
+        self.jit_loop_call = None
+        self.backedge_count = 0
+
 # TODO: have a seperate runtime type for functions
 @dataclass
 class ASTFunctionDeclare(ASTNode):
@@ -259,8 +279,21 @@ class ASTFunctionDeclare(ASTNode):
     return_type: ASTIdentifier | ASTNoReturn
     body: ASTBlock
 
-    # runtime attribute
-    jit_function_call: Callable | None = None
+    # runtime attributes, not part of the function identity
+    jit_function_call: Callable | None = field(default=None, repr=False, compare=False)
+    call_count: int = field(default=0, repr=False, compare=False)
+    jit_failed: bool = field(default=False, repr=False, compare=False)
+    # code object of the body when run by the bytecode VM
+    bytecode: object = field(default=None, repr=False, compare=False)
+    # slots of the frame of a call, set by the resolver, and frames of the enclosing functions for function values
+    scope: object = field(default=None, repr=False, compare=False)
+    closure: tuple = field(default=(), repr=False, compare=False)
+    # memoization of the results (src.purity): None when decided by the purity analysis, True or False to force it
+    memoize: bool | None = field(default=None, repr=False, compare=False)
+    memo_checked: bool = field(default=False, repr=False, compare=False)
+    memo_cache: object = field(default=None, repr=False, compare=False)
+    # weak references to the functions and loops whose cached results or compiled code rely on this function
+    dependents: list | None = field(default=None, repr=False, compare=False)
     @classmethod
     def from_tree(cls, children):
         *typed_args_and_return, body = children
@@ -273,6 +306,27 @@ class ASTFunctionDeclare(ASTNode):
 
         return cls(tuple(typed_args), return_type, body)
 
+    def add_dependent(self, node: "ASTFunctionDeclare | ASTWhileStatement"):
+        if self.dependents is None:
+            self.dependents = []
+        self.dependents.append(weakref.ref(node))
+
+    def invalidate(self):
+        """
+        A variable read by the function, or by the functions it calls, is declared again (see `Frame.rebind`): its
+        results are not cached anymore, and it is interpreted until it gets hot again and is compiled with the new value
+        """
+        self.memo_cache = None
+        self.memo_checked = False
+        self.jit_function_call = None
+        self.call_count = 0
+        # cleared first, for recursive functions
+        dependents, self.dependents = self.dependents, None
+        for ref in dependents or ():
+            node = ref()
+            if node is not None:
+                node.invalidate()
+
 
 @dataclass
 class ASTFunctionCall(ASTNode):
@@ -296,12 +350,67 @@ class ASTStructMember(ASTNode):
 @dataclass
 class ASTStructValue(ASTNode):
     fields: Tuple[ASTStructMember]
+    # shape of the values of the literal, set by the resolver
+    shape = None
     @classmethod
     def from_tree(cls, children):
         # TODO: check that there are no duplicates field names
         return cls(tuple(children))
 
 
+class StructShape:
+    """
+    Names of the fields of struct values, in the order of their values, and the index of each name
+
+    The values of a struct literal share the shape of its field names, the values cast to a struct type
+    the shape of the type, which also has the types of the fields.
+    """
+    __slots__ = ("names", "index", "types")
+    _literals: dict[tuple[str, ...], "StructShape"] = {}
+
+    def __init__(self, names: tuple[str, ...], types: tuple | None = None) -> None:
+        self.names = names
+        self.index = {name: idx for idx, name in enumerate(names)}
+        self.types = types
+
+    @classmethod
+    def of_literal(cls, names: tuple[str, ...]) -> "StructShape":
+        shape = cls._literals.get(names)
+        if shape is None:
+            shape = cls._literals[names] = cls(names)
+        return shape
+
+    def __repr__(self) -> str:
+        return f"StructShape({self.names})"
+
+
+class StructValue:
+    """Runtime value of a struct, the values of its fields in the order of the names of `shape`"""
+    __slots__ = ("shape", "values")
+
+    def __init__(self, shape: StructShape, values: tuple) -> None:
+        self.shape = shape
+        self.values = values
+
+    def field(self, name: str):
+        """Value of the field `name`, KeyError if the struct has no such field"""
+        return self.values[self.shape.index[name]]
+
+    def items(self):
+        return zip(self.shape.names, self.values)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, StructValue):
+            return NotImplemented
+        if self.shape is other.shape:
+            return self.values == other.values
+        index = other.shape.index
+        return len(index) == len(self.values) and all(name in index and other.values[index[name]] == value for name, value in self.items())
+
+    def __repr__(self) -> str:
+        return "{" + ", ".join(f"{name}: {value!r}" for name, value in self.items()) + "}"
+
+
 @dataclass
 class ASTFieldLookup(ASTNode):
     obj: ASTIdentifier
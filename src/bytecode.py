@@ -0,0 +1,632 @@
+"""
+Flat bytecode for jil programs, and the dispatch loop VM running it
+
+Each block of code (the module, and the body of each function) is compiled to a `CodeObject`: a flat list of
+integers with an opcode and its argument every two slots. Arguments are slots of the current frame, index the
+constants or the addresses of the code object, or are jump targets. Identifiers are resolved to slots by
+`src.resolver` before compilation. The value of a block is its last statement, as in the tree walking interpreter.
+
+Compiled modules can be saved to `.jbc` files, and run later without parsing the source.
+"""
+import logging
+import marshal
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from src.ast_definition import *
+from src.compile import JITEngine, JITValuError
+from src.interpreter import BUILTIN_FUNCTIONS, BUILTIN_SCOPE, is_mutable
+from src.purity import memo_cache, memo_key
+from src.resolver import FunctionScope, resolve_module
+from src.runtime_values import *
+from src.utils import UNBOUND, Frame
+
+logger = logging.getLogger(__name__)
+
+# opcodes
+LOAD_CONST = 0
+LOAD_LOCAL = 1
+LOAD_OUTER = 2
+BINARY_OP = 3
+CALL = 4
+CHECK_ASSIGN = 5
+STORE = 6
+DECLARE_LOCAL = 7
+POP_TOP = 8
+JUMP = 9
+IF_FALSE_JUMP = 10
+WHILE_FALSE_JUMP = 11
+WHILE_TRUE_JUMP = 12
+MAKE_FUNCTION = 14
+BUILD_STRUCT = 15
+LOAD_FIELD = 16
+BUILD_STRUCT_TYPE = 17
+BUILD_FUNCTION_TYPE = 18
+MAKE_MUT = 19
+RAISE = 20
+
+OPCODE_NAMES = {value: name for name, value in globals().items() if name.isupper() and isinstance(value, int)}
+CONSTANT_OPCODES = {LOAD_CONST, MAKE_FUNCTION, BUILD_STRUCT, LOAD_FIELD, BUILD_STRUCT_TYPE, RAISE}
+ADDRESS_OPCODES = {LOAD_OUTER, CHECK_ASSIGN, STORE}
+SLOT_OPCODES = {LOAD_LOCAL, DECLARE_LOCAL}
+
+# binary operators can not be shadowed, they are dispatched to the builtins directly by index
+OPERATORS = ("/", "*", "+", "-", "<", "<=", ">", ">=", "==", "!=")
+
+# builtin operators on u64 values, inlined in the dispatch loop
+U64_OPERATIONS = (
+    lambda a, b: a // b,
+    lambda a, b: (a * b) & U64_MASK,
+    lambda a, b: (a + b) & U64_MASK,
+    lambda a, b: (a - b) & U64_MASK,
+    lambda a, b: int(a < b),
+    lambda a, b: int(a <= b),
+    lambda a, b: int(a > b),
+    lambda a, b: int(a >= b),
+    lambda a, b: int(a == b),
+    lambda a, b: int(a != b),
+)
+
+RAISABLE_ERRORS = {err.__name__: err for err in (NotImplementedError, ValueError, RuntimeError)}
+
+JBC_MAGIC = b"JBC\x00"
+JBC_VERSION = 3
+
+
+class BytecodeError(ValueError):
+    ...
+
+
+@dataclass(eq=False)
+class CodeObject:
+    scope: FunctionScope
+    instructions: list[int] = field(default_factory=list)
+    constants: list = field(default_factory=list)
+    # (depth, slot) of the variables accessed outside of the current frame, and assigned to
+    addresses: list[tuple[int, int]] = field(default_factory=list)
+    names: list[str] = field(default_factory=list)
+
+
+@dataclass(eq=False)
+class FunctionTemplate:
+    """Constant used by MAKE_FUNCTION, the argument and return types are evaluated at runtime"""
+    arg_names: tuple[str]
+    arg_slots: tuple[int]
+    code: CodeObject
+    # kept to jit compile the function, not saved in .jbc files
+    ast: ASTFunctionDeclare | None = None
+
+
+def cast(typ, value):
+    # u64 values are already ints, and boxed numbers are immutable so casting one to its own type would only copy it
+    inner = typ.value if type(typ) is ASTMut else typ
+    if (type(value) is int and type(inner) is U64) or (type(value) is Number and type(inner) is Number):
+        return value
+    return typ.cast(value)
+
+
+class _NoReturnConst:
+    """Marker for the shared ASTNoReturn constant"""
+
+
+class BytecodeCompiler:
+    def __init__(self, scope: FunctionScope) -> None:
+        self.code = CodeObject(scope)
+        self._constant_idx = {}
+        self._address_idx = {}
+
+    def emit(self, opcode: int, arg: int = 0) -> int:
+        self.code.instructions += (opcode, arg)
+        return len(self.code.instructions) - 2
+
+    def position(self) -> int:
+        return len(self.code.instructions)
+
+    def patch_jump(self, instruction_idx: int, target: int | None = None):
+        self.code.instructions[instruction_idx + 1] = self.position() if target is None else target
+
+    def constant(self, value, key=None) -> int:
+        # constants that can not be hashed (function templates) are never shared
+        if key is None:
+            self.code.constants.append(value)
+            return len(self.code.constants) - 1
+        if key not in self._constant_idx:
+            self._constant_idx[key] = len(self.code.constants)
+            self.code.constants.append(value)
+        return self._constant_idx[key]
+
+    def address(self, ident: ASTIdentifier) -> int:
+        if ident.address not in self._address_idx:
+            self._address_idx[ident.address] = len(self.code.addresses)
+            self.code.addresses.append(ident.address)
+            self.code.names.append(ident.value)
+        return self._address_idx[ident.address]
+
+    def emit_load(self, ident: ASTIdentifier):
+        if ident.address is None:
+            self.emit_raise(RuntimeError, f"Unknown {ident.value} in env")
+        elif ident.address[0] == self.code.scope.depth:
+            self.emit(LOAD_LOCAL, ident.address[1])
+        else:
+            self.emit(LOAD_OUTER, self.address(ident))
+
+    def emit_no_return(self):
+        self.emit(LOAD_CONST, self.constant(ASTNoReturn(None), key=_NoReturnConst))
+
+    def emit_raise(self, error: type[Exception], message: str):
+        self.emit(RAISE, self.constant((error.__name__, message), key=("raise", error.__name__, message)))
+
+    def compile_block(self, node: ASTBlock, keep_value=True):
+        if len(node.value) == 0:
+            raise BytecodeError("Unexpected empty block")
+        for i, statement in enumerate(node.value):
+            self.compile_statement(statement, keep_value=keep_value and i == len(node.value) - 1)
+
+    def compile_statement(self, node: ASTStatement, keep_value=True):
+        """Only the value of the last statement of a block is kept on the stack"""
+        match node.value:
+            case ASTExpression(value):
+                self.compile_expression(value)
+                if not keep_value:
+                    self.emit(POP_TOP)
+            case ASTAssignment((lvalue, rvalue)):
+                if not isinstance(lvalue, ASTIdentifier):
+                    self.emit_raise(NotImplementedError, f"Assignement to {type(lvalue)} is not implemented")
+                    return
+                if lvalue.address is None:
+                    self.emit_raise(RuntimeError, f"Unknown {lvalue.value} in env")
+                    return
+                address_idx = self.address(lvalue)
+                self.emit(CHECK_ASSIGN, address_idx)
+                self.compile_expression(rvalue)
+                self.emit(STORE, address_idx)
+                if keep_value:
+                    self.emit_no_return()
+            case ASTVarDeclaration(var_name, var_type, rvalue):
+                assert isinstance(var_name, ASTIdentifier), type(var_name)
+                if isinstance(var_type, ASTInferType):
+                    self.emit_raise(NotImplementedError, "Type inference not implemented yet")
+                    return
+                self.compile_typ(var_type)
+                if isinstance(rvalue, ASTUninitValue):
+                    self.emit(LOAD_CONST, self.constant(rvalue, key=ASTUninitValue))
+                else:
+                    self.compile_expression(rvalue)
+                self.emit(DECLARE_LOCAL, var_name.address[1])
+                if keep_value:
+                    self.emit_no_return()
+            case ASTIfStatement(cond, true_branch, false_branch):
+                self.compile_expression(cond)
+                jump_false = self.emit(IF_FALSE_JUMP)
+                # the variables of the blocks have their own slots in the frame
+                self.compile_block(true_branch)
+                jump_end = self.emit(JUMP)
+                self.patch_jump(jump_false)
+                if false_branch is not None:
+                    self.compile_block(false_branch)
+                else:
+                    self.emit_no_return()
+                self.patch_jump(jump_end)
+                if not keep_value:
+                    self.emit(POP_TOP)
+            case ASTWhileStatement(cond, block):
+                self.compile_expression(cond)
+                jump_end = self.emit(WHILE_FALSE_JUMP)
+                loop_start = self.position()
+                self.compile_block(block, keep_value=False)
+                self.compile_expression(cond)
+                self.emit(WHILE_TRUE_JUMP, loop_start)
+                self.patch_jump(jump_end)
+                if keep_value:
+                    self.emit_no_return()
+            case v:
+                raise NotImplementedError(f"Bytecode compilation not implemented for statement {v}")
+
+    def compile_typ(self, node):
+        match node:
+            case ASTUninitValue(_) | ASTNoReturn(_) | Number(_):
+                self.emit(LOAD_CONST, self.constant(node))
+            case ASTIdentifier():
+                self.emit_load(node)
+            case ASTStructureType(fields):
+                for field in fields:
+                    self.compile_typ(field.ident_type)
+                field_names = tuple(field.ident.value for field in fields)
+                self.emit(BUILD_STRUCT_TYPE, self.constant(field_names, key=("fields", field_names)))
+            case ASTType(typ):
+                self.compile_typ(typ)
+            case ASTMut(typ):
+                self.compile_typ(typ)
+                self.emit(MAKE_MUT)
+            case ASTFunctionType(arg_types, ret_type):
+                for arg in arg_types:
+                    self.compile_typ(arg)
+                self.compile_typ(ret_type)
+                self.emit(BUILD_FUNCTION_TYPE, len(arg_types))
+            case _:
+                raise NotImplementedError(f"Bytecode compilation of type {node} not implemented")
+
+    def compile_expression(self, node):
+        match node:
+            case ASTNumber(val):
+                self.emit(LOAD_CONST, self.constant(Number(val), key=("number", val)))
+            case ASTIdentifier():
+                self.emit_load(node)
+            case ASTBinaryOp(a, op, b):
+                self.compile_expression(a)
+                self.compile_expression(b)
+                self.emit(BINARY_OP, OPERATORS.index(op.value))
+            case ASTFunctionDeclare(arguments, ret_typ, body):
+                for arg in arguments:
+                    self.compile_typ(arg.ident_type)
+                self.compile_typ(ret_typ)
+                template = FunctionTemplate(
+                    tuple(arg.ident.value for arg in arguments),
+                    tuple(arg.ident.address[1] for arg in arguments),
+                    compile_code(body, node.scope),
+                    node,
+                )
+                self.emit(MAKE_FUNCTION, self.constant(template))
+            case ASTFunctionCall(func_name, arguments):
+                for arg in arguments:
+                    self.compile_expression(arg)
+                self.emit_load(func_name)
+                self.emit(CALL, len(arguments))
+            case ASTStructValue(fields):
+                for field in fields:
+                    self.compile_expression(field.value)
+                field_names = tuple(field.ident.value for field in fields)
+                self.emit(BUILD_STRUCT, self.constant(StructShape.of_literal(field_names), key=("shape", field_names)))
+            case ASTFieldLookup(obj, field_name):
+                self.compile_expression(obj)
+                # the error messages of the interpreter refer to the syntax nodes
+                lookup = (field_name.value, str(type(obj)), str(field_name))
+                self.emit(LOAD_FIELD, self.constant(lookup, key=("lookup", lookup)))
+            case ASTExpression(value):
+                self.compile_expression(value)
+            case _:
+                raise ValueError(f"Unexpected expression {type(node)}")
+
+
+def compile_code(block: ASTBlock, scope: FunctionScope) -> CodeObject:
+    compiler = BytecodeCompiler(scope)
+    compiler.compile_block(block)
+    return compiler.code
+
+
+def compile_module(module: ASTModule) -> CodeObject:
+    if not isinstance(module, ASTModule):
+        raise ValueError(f"Expecting an ASTModule, got {type(module)}")
+    resolve_module(module, BUILTIN_SCOPE)
+    return compile_code(module.value, module.scope)
+
+
+def disassemble(code: CodeObject, indent="") -> str:
+    lines = []
+    instructions = code.instructions
+    for pc in range(0, len(instructions), 2):
+        opcode, arg = instructions[pc], instructions[pc + 1]
+        if opcode in CONSTANT_OPCODES:
+            detail = code.constants[arg]
+        elif opcode in ADDRESS_OPCODES:
+            detail = f"{code.names[arg]}@{code.addresses[arg]}"
+        elif opcode in SLOT_OPCODES:
+            detail = code.scope.slot_names[arg]
+        elif opcode == BINARY_OP:
+            detail = OPERATORS[arg]
+        else:
+            detail = None
+        detail = "" if detail is None else f"{detail.arg_names}" if isinstance(detail, FunctionTemplate) else f"({detail})" if isinstance(detail, str) else f"({detail!r})"
+        lines.append(f"{indent}{pc:>5} {OPCODE_NAMES[opcode]:<20} {arg} {detail}".rstrip())
+        if opcode == MAKE_FUNCTION:
+            lines.append(disassemble(code.constants[arg].code, indent + "    "))
+    return "\n".join(lines)
+
+
+class VM:
+    """
+    Dispatch loop running code objects, with the same semantics as the tree walking interpreter
+
+    Calls of hot functions go to the JIT engine when one is given, loops are not replaced by compiled code. With
+    `memoize`, the results of pure functions are cached (`src.purity`).
+    """
+    def __init__(self, jit_engine: JITEngine | None = None, jit_call_threshold: int = 5, memoize: bool = False) -> None:
+        self.binary_ops = tuple(BUILTIN_FUNCTIONS[op].value for op in OPERATORS)
+        self.jit_engine = jit_engine
+        self.jit_call_threshold = jit_call_threshold
+        self.memoize = memoize
+
+    def run(self, module_code: CodeObject, builtin_env: Frame) -> Frame:
+        """Run a module, returns the frame holding its variables"""
+        module_frame = Frame(module_code.scope)
+        self.execute(module_code, (builtin_env, module_frame))
+        return module_frame
+
+    def call(self, func, arguments, frames: tuple[Frame, ...]):
+        if callable(func):
+            return func(*arguments)
+
+        assert isinstance(func, ASTFunctionDeclare), type(func)
+
+        if self.memoize and len(func.arguments) == len(arguments):
+            cache = memo_cache(func)
+            if cache is not None:
+                return cache.call(memo_key(func, arguments), lambda: self.call_function(func, arguments, frames))
+        return self.call_function(func, arguments, frames)
+
+    def call_function(self, func: ASTFunctionDeclare, arguments, frames: tuple[Frame, ...]):
+        """Call of `func`, jitted when it is compiled, without memoization"""
+        if self.jit_engine is not None and func.body is not None:
+            if func.jit_function_call is None and not func.jit_failed:
+                func.call_count += 1
+                if func.call_count == self.jit_call_threshold:
+                    self.jit_compile(func)
+            if func.jit_function_call is not None:
+                try:
+                    return func.jit_function_call(*arguments)
+                except JITValuError:
+                    logger.info("Failed to call jitted function")
+
+        if len(func.arguments) != len(arguments):
+            raise RuntimeError(f"Wrong number of arguments, got {len(arguments)}, expected {len(func.arguments)}")
+        frame = Frame(func.scope)
+        for arg_type, call_argument in zip(func.arguments, arguments):
+            slot = arg_type.ident.address[1]
+            frame.values[slot] = cast(arg_type.ident_type, call_argument)
+            frame.types[slot] = arg_type.ident_type
+        res = self.execute(func.bytecode, (*func.closure, frame))
+        return cast(func.return_type, res)
+
+    def jit_compile(self, func: ASTFunctionDeclare):
+        engine = self.jit_engine
+        if engine.workers:
+            engine.submit(engine.compile_function, func)
+            return
+        try:
+            engine.run_compile(engine.compile_function, func)
+        except Exception as err:
+            logger.error(err, exc_info=True)
+            func.jit_failed = True
+
+    def execute(self, code: CodeObject, frames: tuple[Frame, ...]):
+        instructions = code.instructions
+        constants = code.constants
+        addresses = code.addresses
+        frame = frames[-1]
+        values = frame.values
+        types = frame.types
+        binary_ops = self.binary_ops
+        u64_operations = U64_OPERATIONS
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        end = len(instructions)
+        while pc < end:
+            opcode = instructions[pc]
+            arg = instructions[pc + 1]
+            pc += 2
+            # most frequent opcodes first
+            if opcode == LOAD_LOCAL:
+                value = values[arg]
+                if value is UNBOUND:
+                    raise RuntimeError(f"Unknown {code.scope.slot_names[arg]} in env")
+                push(value)
+            elif opcode == LOAD_CONST:
+                push(constants[arg])
+            elif opcode == BINARY_OP:
+                b = pop()
+                a = pop()
+                if type(a) is int and type(b) is int:
+                    push(u64_operations[arg](a, b))
+                else:
+                    push(binary_ops[arg](a, b))
+            elif opcode == LOAD_OUTER:
+                depth, slot = addresses[arg]
+                value = frames[depth].values[slot]
+                if value is UNBOUND:
+                    raise RuntimeError(f"Unknown {code.names[arg]} in env")
+                push(value)
+            elif opcode == POP_TOP:
+                pop()
+            elif opcode == CHECK_ASSIGN:
+                depth, slot = addresses[arg]
+                var_frame = frames[depth]
+                value = var_frame.values[slot]
+                if value is UNBOUND:
+                    raise RuntimeError(f"Unknown {code.names[arg]} in env")
+                var_typ = var_frame.types[slot]
+                if type(value) is not ASTUninitValue and not is_mutable(var_typ):
+                    raise ValueError(f"Trying to assign to an immutable value {ASTIdentifier(code.names[arg])} with immutable type {type(var_typ)}, consider adding Mut")
+            elif opcode == STORE:
+                depth, slot = addresses[arg]
+                var_frame = frames[depth]
+                var_frame.values[slot] = cast(var_frame.types[slot], pop())
+            elif opcode == WHILE_TRUE_JUMP:
+                cond_res = pop()
+                if (cond_res if type(cond_res) is int else cond_res.value) != 0:
+                    pc = arg
+            elif opcode == DECLARE_LOCAL:
+                value = pop()
+                var_type = pop()
+                if type(value) is not ASTUninitValue:
+                    value = cast(var_type, value)
+                if frame.dependents:
+                    frame.rebind(arg)
+                values[arg] = value
+                types[arg] = var_type
+            elif opcode == IF_FALSE_JUMP:
+                cond_res = pop()
+                if type(cond_res) is not int and not isinstance(cond_res, Number):
+                    raise NotImplementedError(f"If condition only implemented for number values, not {type(cond_res)}")
+                if number_value(cond_res) == 0:
+                    pc = arg
+            elif opcode == JUMP:
+                pc = arg
+            elif opcode == CALL:
+                func = pop()
+                if arg:
+                    arguments = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    arguments = []
+                push(self.call(func, arguments, frames))
+            elif opcode == WHILE_FALSE_JUMP:
+                cond_res = pop()
+                if type(cond_res) is not int and not isinstance(cond_res, Number):
+                    raise NotImplementedError(f"While condition should resolve to a number, not {cond_res}")
+                if number_value(cond_res) == 0:
+                    pc = arg
+            elif opcode == LOAD_FIELD:
+                field_name, obj_type, field_repr = constants[arg]
+                struct = pop()
+                if not isinstance(struct, StructValue):
+                    raise RuntimeError(f"Attempting to access field of a {obj_type}, when a struct was expected")
+                idx = struct.shape.index.get(field_name)
+                if idx is None:
+                    raise ValueError(f"Field {field_repr} does not exist for struct")
+                push(struct.values[idx])
+            elif opcode == BUILD_STRUCT:
+                shape = constants[arg]
+                field_count = len(shape.names)
+                field_values = tuple(stack[len(stack) - field_count:])
+                del stack[len(stack) - field_count:]
+                push(StructValue(shape, field_values))
+            elif opcode == MAKE_FUNCTION:
+                template = constants[arg]
+                ret_typ = pop()
+                arg_count = len(template.arg_names)
+                arg_types = stack[len(stack) - arg_count:]
+                del stack[len(stack) - arg_count:]
+                func = ASTFunctionDeclare(
+                    tuple(ASTTypedIdent(template_ident(name, template.code.scope.depth, slot), typ)
+                          for name, slot, typ in zip(template.arg_names, template.arg_slots, arg_types)),
+                    ret_typ,
+                    template.ast.body if template.ast is not None else None,
+                    scope=template.code.scope,
+                    closure=frames,
+                )
+                func.bytecode = template.code
+                push(func)
+            elif opcode == BUILD_STRUCT_TYPE:
+                field_names = constants[arg]
+                field_types = stack[len(stack) - len(field_names):]
+                del stack[len(stack) - len(field_names):]
+                push(ASTStructureType(tuple(ASTTypedIdent(ASTIdentifier(name), typ) for name, typ in zip(field_names, field_types))))
+            elif opcode == BUILD_FUNCTION_TYPE:
+                ret_typ = pop()
+                arg_types = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                push(ASTFunctionType(tuple(arg_types), ret_typ))
+            elif opcode == MAKE_MUT:
+                push(ASTMut(pop()))
+            elif opcode == RAISE:
+                error_name, message = constants[arg]
+                raise RAISABLE_ERRORS[error_name](message)
+            else:
+                raise BytecodeError(f"Unknown opcode {opcode} at {pc - 2}")
+        return pop()
+
+
+def template_ident(name: str, depth: int, slot: int) -> ASTIdentifier:
+    ident = ASTIdentifier(name)
+    ident.address = (depth, slot)
+    return ident
+
+
+def _encode_constant(value):
+    match value:
+        case FunctionTemplate(arg_names, arg_slots, code):
+            return ("function", arg_names, arg_slots, _encode_code(code))
+        case ASTNoReturn():
+            return ("noreturn",)
+        case ASTUninitValue():
+            return ("uninit",)
+        case Number():
+            return ("number", type(value).__name__, value.value)
+        case StructShape(names=names):
+            return ("shape", names)
+        case str() | tuple():
+            return ("raw", value)
+        case _:
+            raise BytecodeError(f"Can not serialize constant {value!r}")
+
+
+def _decode_constant(encoded):
+    match encoded:
+        case ("function", arg_names, arg_slots, code):
+            return FunctionTemplate(arg_names, arg_slots, _decode_code(code))
+        case ("noreturn",):
+            return ASTNoReturn(None)
+        case ("uninit",):
+            return ASTUninitValue(None)
+        case ("number", "Number", value):
+            return Number(value)
+        case ("number", "U64", value):
+            return U64(value)
+        case ("shape", names):
+            return StructShape.of_literal(names)
+        case ("raw", value):
+            return value
+        case _:
+            raise BytecodeError(f"Invalid constant {encoded!r}")
+
+
+def _encode_code(code: CodeObject):
+    scope = (code.scope.depth, tuple(code.scope.slot_names), code.scope.names)
+    return (scope, tuple(code.instructions), tuple(_encode_constant(c) for c in code.constants), tuple(code.addresses), tuple(code.names))
+
+
+def _decode_code(encoded) -> CodeObject:
+    (depth, slot_names, scope_names), instructions, constants, addresses, names = encoded
+    return CodeObject(
+        FunctionScope(depth, list(slot_names), dict(scope_names)),
+        list(instructions),
+        [_decode_constant(c) for c in constants],
+        list(addresses),
+        list(names),
+    )
+
+
+def dumps(code: CodeObject) -> bytes:
+    return JBC_MAGIC + JBC_VERSION.to_bytes(2, "little") + marshal.dumps(_encode_code(code))
+
+
+def loads(data: bytes) -> CodeObject:
+    header_size = len(JBC_MAGIC) + 2
+    if data[:len(JBC_MAGIC)] != JBC_MAGIC:
+        raise BytecodeError("Not a jil bytecode file")
+    version = int.from_bytes(data[len(JBC_MAGIC):header_size], "little")
+    if version != JBC_VERSION:
+        raise BytecodeError(f"Unsupported bytecode version {version}, expected {JBC_VERSION}")
+    return _decode_code(marshal.loads(data[header_size:]))
+
+
+def save(code: CodeObject, path: Path):
+    Path(path).write_bytes(dumps(code))
+
+
+def load(path: Path) -> CodeObject:
+    return loads(Path(path).read_bytes())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from src.lark_parser import parse_source
+
+    arg_parser = argparse.ArgumentParser(description="Compile a jil file to bytecode")
+    arg_parser.add_argument("--input-file", type=Path, required=True)
+    arg_parser.add_argument("--output", type=Path, help="defaults to the input file with a .jbc suffix")
+    arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent / "grammar.lark")
+    arg_parser.add_argument("--disassemble", action="store_true")
+    args = arg_parser.parse_args()
+
+    if args.input_file.suffix == ".jbc":
+        module_code = load(args.input_file)
+    else:
+        module_code = compile_module(parse_source(args.input_file.read_text(), args.grammar_definition))
+        save(module_code, args.output or args.input_file.with_suffix(".jbc"))
+
+    if args.disassemble:
+        print(disassemble(module_code))
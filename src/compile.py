@@ -1,16 +1,29 @@
 from typing import Any
 from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 import ctypes
 from ctypes import CDLL
+from dataclasses import dataclass, field
 from enum import Enum
+import hashlib
+import logging
+import os
 from pathlib import Path
 import subprocess
 from textwrap import indent
+import threading
+import time
 
-from src.utils import Environment
+from src.assembler import AssemblerError, CodeArena
+from src.utils import UNBOUND
 from src.ast_definition import *
+from src.ir import COMPARISONS, Branch, CallTarget, Instruction, IRError, IRFunction, Jump, Return, StructLayout, build_function, build_loop, layout_of, terminator_args
 from src.jit_builtins import BUILTIN_FUNC_ASM
-from src.runtime_values import Number, U64
+from src.optimizer import DEFAULT_PASSES, PASSES, optimize
+from src.peephole import NEGATED_CONDITION_CODES, peephole
+from src.runtime_values import Number, U64, number_value
+
+logger = logging.getLogger(__name__)
 
 class JITValuError(ValueError):...
 
@@ -22,99 +35,663 @@ class Register(Enum):
     RCX = "rcx"
     R8 = "r8"
     R9 = "r9"
+    R10 = "r10"
+    R11 = "r11"
+    RBX = "rbx"
+    R12 = "r12"
+    R13 = "r13"
+    R14 = "r14"
+    R15 = "r15"
+    RBP = "rbp"
+    RSP = "rsp"
 
 class StackOffset(int):...
 
-CALL_ORDER = [Register.RDI, Register.RSI, Register.RDX, Register.RCX, Register.R8 , Register.R9]
-
-def systemv_call_order(sizes):
-    for size, reg in zip(sizes, CALL_ORDER):
-        assert size <= 8
-        yield reg
-    for idx, size in enumerate(sizes[6:]):
-        assert size <= 8
-        yield StackOffset(idx * 8)
+class Immediate(int):...
 
+@dataclass(frozen=True)
+class MemoryOffset:
+    base: Register
+    offset: int = 0
 
-def to_c_type(arg):
+CALL_ORDER = [Register.RDI, Register.RSI, Register.RDX, Register.RCX, Register.R8 , Register.R9]
+CALLEE_SAVED = [Register.RBX, Register.R12, Register.R13, Register.R14, Register.R15]
+# rax (results), rcx (second operand) and rdx (division) are scratch registers of the generated code,
+# caller saved registers come first as they do not need to be saved in the prelude
+ALLOCATABLE_REGISTERS = [Register.RDI, Register.RSI, Register.R8, Register.R9, Register.R10, Register.R11, *CALLEE_SAVED]
+
+def systemv_call_order(sizes, caller=True, return_size=8):
+    """
+    Locations of each 8 bytes of the arguments of a call, of `sizes` bytes, in registers and on the stack: above %rsp
+    for the caller right before the call, above the return address and the saved %rbp for the callee
+
+    Arguments only hold integers: a struct of up to 16 bytes takes the next registers if they are all free, bigger
+    ones and the ones that do not fit are on the stack. A result bigger than 16 bytes is written where
+    the caller points to in %rdi, the arguments start at %rsi.
+    """
+    registers = CALL_ORDER[1:] if return_size > 16 else CALL_ORDER
+    stack_idx = 0
+    for size in sizes:
+        count = -(-size // 8)
+        if size <= 16 and count <= len(registers):
+            yield from registers[:count]
+            registers = registers[count:]
+            continue
+        for _ in range(count):
+            yield MemoryOffset(Register.RSP, stack_idx * 8) if caller else MemoryOffset(Register.RBP, 16 + stack_idx * 8)
+            stack_idx += 1
+
+
+def typ_without_mut(typ):
+    return typ_without_mut(typ.value) if isinstance(typ, ASTMut) else typ
+
+
+def call_target(func: ASTFunctionDeclare, label) -> CallTarget:
+    returns = None if isinstance(func.return_type, ASTNoReturn) else layout_of(func.return_type)
+    return CallTarget(label, tuple(layout_of(arg.ident_type) for arg in func.arguments), returns)
+
+
+# ctypes structure of each struct layout, built once
+_C_STRUCTURES: dict[StructLayout, type[ctypes.Structure]] = {}
+
+def struct_c_type(layout: StructLayout) -> type[ctypes.Structure]:
+    """ctypes structure with the layout of the compiled code, ctypes passes and returns it following the same ABI"""
+    if layout not in _C_STRUCTURES:
+        fields = [(name, struct_c_type(typ) if isinstance(typ, StructLayout) else ctypes.c_uint64) for name, typ in layout.fields]
+        _C_STRUCTURES[layout] = type("JITStruct", (ctypes.Structure,), {"_fields_": fields})
+    return _C_STRUCTURES[layout]
+
+
+def typ_to_c_type(typ):
+    match typ:
+        case ASTMut(inner):
+            return typ_to_c_type(inner)
+        case U64():
+            return ctypes.c_uint64
+        case ASTNoReturn():
+            return None
+        case ASTStructureType():
+            try:
+                return struct_c_type(layout_of(typ))
+            except IRError as err:
+                raise NotImplementedError(f"Conversion to ctypes not implemented for {typ}") from err
+        case t:
+            raise NotImplementedError(f"Conversion to ctypes not implemented for {t}")
+
+
+def to_c_type(arg, c_type=ctypes.c_uint64):
     match arg:
-        # case U64(val):
-        #     return ctypes.c_uint64(val)
+        case int():
+            return c_type(arg)
         case Number(val):
-            return ctypes.c_int64(val)
+            return c_type(val)
+        case StructValue() if issubclass(c_type, ctypes.Structure):
+            # the fields are initialized in the order of the structure, nested structures recursively
+            values = (arg.field(name) for name, _ in c_type._fields_)
+            return c_type(*(to_c_type(value, field_c_type) if issubclass(field_c_type, ctypes.Structure) else number_value(value) for value, (_, field_c_type) in zip(values, c_type._fields_)))
         case a:
             raise NotImplementedError(f"Conversion to ctypes not implemented for {a}")
 
+
+def from_c_struct(value: ctypes.Structure, typ: ASTStructureType) -> StructValue:
+    """Struct value of a returned structure, with the shape of its type as casting to the type would"""
+    shape = typ_without_mut(typ).shape
+    values = []
+    for name, field_typ in zip(shape.names, shape.types):
+        field_value = getattr(value, name)
+        if isinstance(field_value, ctypes.Structure):
+            field_value = from_c_struct(field_value, field_typ)
+        values.append(field_value)
+    return StructValue(shape, tuple(values))
+
 class JITFunctionCall:
-    def __init__(self, function_label, function_args, function_ret_type, jit_engine) -> None:
+    """
+    Calls a compiled function from the interpreter
+
+    The ctypes prototype is built once from the function type, functions taking only
+    integers get their arguments as is and return unboxed u64 values. Structs are passed and
+    returned by value as ctypes structures with the layout of the compiled code.
+    """
+    def __init__(self, function_label, function_args, function_ret_type, function_address, jit_engine) -> None:
+        # keeps the engine, and so the compiled code, alive
         self.jit_engine = jit_engine
         self.function_args = function_args
         self.function_label = function_label
         self.func_ret_type = function_ret_type
-    
-    def __call__(self, *args) -> Any:
-        assert len(args) == len(self.function_args)
-        compiled_func = self.jit_engine.jitted_lib[f"{self.function_label}"]
-        # TODO: add a typ_to_c_type, and val_to_ctype that does typ_to_c_type(typ(val))(val)
-        compiled_func.argtypes = [ctypes.c_int64] * len(self.function_args)
-        compiled_func.restype = ctypes.c_int64
 
-        ctype_args = [to_c_type(arg) for arg in args]
-        res = compiled_func(*ctype_args)
+        arg_c_types = [typ_to_c_type(arg.ident_type) for arg in function_args]
+        ret_c_type = typ_to_c_type(function_ret_type)
+        self._arg_c_types = arg_c_types
+        self._compiled_func = ctypes.CFUNCTYPE(ret_c_type, *arg_c_types)(function_address)
+        # the ctypes result is already in the range of the return type
+        if ret_c_type is None:
+            self._box_result = ASTNoReturn
+        elif isinstance(ret_c_type, type) and issubclass(ret_c_type, ctypes.Structure):
+            self._box_result = lambda value: from_c_struct(value, function_ret_type)
+        else:
+            self._box_result = type(typ_without_mut(function_ret_type)).from_unchecked
+        self._integer_args = all(c_type is ctypes.c_uint64 for c_type in arg_c_types)
+        self._unboxed = self._integer_args and ret_c_type is ctypes.c_uint64
+        # native loop of `batch`, compiled on first use
+        self._batch_call = None
 
-        return type(self.func_ret_type)(res)
+    def __call__(self, *args) -> Any:
+        # the number of arguments is checked by ctypes
+        if self._unboxed:
+            # u64 values are python ints, and boxed numbers convert through _as_parameter_
+            return self._compiled_func(*args)
+        if self._integer_args:
+            return self._box_result(self._compiled_func(*args))
+
+        return self._box_result(self._compiled_func(*[to_c_type(arg, c_type) for arg, c_type in zip(args, self._arg_c_types, strict=True)]))
+
+    def batch(self, *arrays, out):
+        """
+        Call the function on each element of `arrays`, one array per argument, and write the results to `out`
+
+        The arrays are 1-D contiguous buffers of 8 bytes integers, eg NumPy int64 or uint64 arrays or
+        `array.array("Q")`, signed values are taken as their u64 two's complement. The whole batch runs in
+        a single call of a compiled loop, without the GIL. Returns `out`.
+        """
+        if not self._unboxed:
+            raise NotImplementedError(f"Batched calls are only implemented for functions of u64 values, not {self.function_label}")
+        if len(arrays) != len(self.function_args):
+            raise TypeError(f"Wrong number of arrays, got {len(arrays)}, expected {len(self.function_args)}")
+        results = u64_buffer(out, writable=True)
+        inputs = [u64_buffer(array) for array in arrays]
+        if any(len(values) != len(results) for values in inputs):
+            raise ValueError(f"The arrays should have the length of out, {len(results)}, not {[len(values) for values in inputs]}")
+        if self._batch_call is None:
+            address = self.jit_engine.compile_batch(self.function_label, len(self.function_args))
+            self._batch_call = ctypes.CFUNCTYPE(None, ctypes.c_uint64, ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p)(address)
+        # the compiled loop moves these pointers forward
+        pointers = (ctypes.c_void_p * max(len(inputs), 1))(*(ctypes.addressof(values) for values in inputs))
+        self._batch_call(len(results), pointers, ctypes.addressof(results))
+        return out
+
+
+def u64_buffer(array, writable=False) -> ctypes.Array:
+    """ctypes view of an array of 8 bytes integers, a copy when it is read only and not `writable`"""
+    view = memoryview(array)
+    if view.ndim != 1 or view.itemsize != 8 or view.format.lstrip("@=<") not in ("q", "Q", "l", "L") or not view.c_contiguous:
+        raise TypeError(f"Expected a contiguous 1-D array of 8 bytes integers, not {view.ndim}-D {view.format!r}")
+    c_type = ctypes.c_uint64 * len(view)
+    if not view.readonly:
+        return c_type.from_buffer(view)
+    if writable:
+        raise TypeError("The output array is read only")
+    return c_type.from_buffer_copy(view)
+
+
+BATCH_LOOP_PATTERN = """
+.global {label}
+.type {label}, @function
+{label}:
+    # enter, keeping the stack aligned on 16 bytes for the calls
+    pushq %rbp
+    movq %rsp, %rbp
+    pushq %rbx
+    pushq %r12
+    pushq %r13
+    subq $8, %rsp
+
+    movq %rdi, %rbx # elements left
+    movq %rsi, %r12 # pointers to the next element of each argument
+    movq %rdx, %r13 # pointer to the next result
+{label}_loop:
+    testq %rbx, %rbx
+    je {label}_done
+{load_arguments}
+    callq {function_label}@PLT
+    movq %rax, (%r13)
+    addq $8, %r13
+    subq $1, %rbx
+    jmp {label}_loop
+{label}_done:
+
+    # leave
+    addq $8, %rsp
+    popq %r13
+    popq %r12
+    popq %rbx
+    popq %rbp
+    retq
+"""
+
+LOAD_BATCH_ARGUMENT_PATTERN = """\
+    movq {offset}(%r12), %rax
+    movq (%rax), %{register}
+    addq $8, {offset}(%r12)"""
+
+
+def batch_loop_asm(label, function_label, arg_count) -> str:
+    """`label(count, arguments, results)` calls `function_label` on the next `count` elements of the argument arrays"""
+    if arg_count > len(CALL_ORDER):
+        raise NotImplementedError(f"Batched calls are only implemented for up to {len(CALL_ORDER)} arguments, not {arg_count}")
+    load_arguments = "\n".join(LOAD_BATCH_ARGUMENT_PATTERN.format(offset=8 * i, register=register.value) for i, register in enumerate(CALL_ORDER[:arg_count]))
+    return BATCH_LOOP_PATTERN.format(label=label, function_label=function_label, load_arguments=load_arguments)
+
+
+class JITLoopCall:
+    """Runs a loop compiled for on stack replacement, on the values of its live variables"""
+    def __init__(self, loop_label, live_vars, loop_address, jit_engine) -> None:
+        self.jit_engine = jit_engine
+        self.loop_label = loop_label
+        self.live_vars = live_vars
+        self._compiled_loop = ctypes.CFUNCTYPE(None, ctypes.POINTER(ctypes.c_uint64))(loop_address)
+        self._values_array = ctypes.c_uint64 * len(live_vars)
+
+    def __call__(self, values: list[int]) -> list[int]:
+        values = self._values_array(*values)
+        self._compiled_loop(values)
+        return list(values)
+
+
+# bump when the generated code changes for the same input, to invalidate cached artifacts
+JIT_ABI_VERSION = 8
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+@dataclass
+class CompileMetrics:
+    # compilations queued by `submit`, and the ones of them that are finished
+    submitted: int = 0
+    dequeued: int = 0
+    # all the compilations, in the background or not
+    completed: int = 0
+    failed: int = 0
+    # in ns, for each finished compilation: time spent waiting for a worker, and compiling
+    queue_waits: list[int] = field(default_factory=list)
+    compile_latencies: list[int] = field(default_factory=list)
+    # instructions removed by the peephole optimizer, by compiled label
+    peephole_removed: dict[str, int] = field(default_factory=dict)
+    # in ns, total time of each phase: "codegen" (IR, optimizations, assembly text), "assemble" (native assembler or gcc)
+    # and "load" (dlopen of the gcc libraries)
+    phase_ns: Counter = field(default_factory=Counter)
+
+    @property
+    def queue_depth(self) -> int:
+        """Compilations submitted and not finished yet"""
+        return self.submitted - self.dequeued
+
+    def summary(self) -> dict:
+        def percentiles(values):
+            values = sorted(values)
+            if not values:
+                return {}
+            return {"p50": values[len(values) // 2], "p90": values[int(len(values) * 0.9)], "max": values[-1]}
+
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "queue_depth": self.queue_depth,
+            "queue_wait_ns": percentiles(self.queue_waits),
+            "compile_latency_ns": percentiles(self.compile_latencies),
+            "peephole_removed": sum(self.peephole_removed.values()),
+            "phase_ns": dict(self.phase_ns),
+        }
 
 
 class JITEngine:
-    asm_file_name = "jitted_functions.s"
-    def __init__(self, compilation_dir) -> None:
+    """
+    Two backends are available:
+    - native: the generated assembly is encoded in process by `src.assembler` and placed
+      in executable memory, no external tool or filesystem access is needed
+    - gcc: each compiled function is assembled by gcc into its own shared library, the builtins are
+      assembled once and loaded with RTLD_GLOBAL so that the function libraries can resolve them
+      when loaded, as are the function libraries for the functions calling them. Used as a fallback when the native assembler does not support an instruction,
+      and for debugging as the generated .s and .so are kept in the compilation dir.
+
+    Functions are labelled after a hash of their content (function ast, resolved types), for the gcc
+    backend the compilation dir is a persistent cache reused across runs, evicted least recently used first
+    when its size exceeds `max_cache_size` bytes.
+
+    With `workers` > 0, `submit` compiles on a pool of threads while the interpreter keeps running,
+    the compiled code is switched in by setting `jit_function_call`/`jit_loop_call` once it is ready.
+    gcc runs outside of the GIL, the native backend interleaves with the interpreter.
+
+    The code is compiled through the SSA form of `src.ir`, optimized by the `passes` of `src.optimizer`,
+    and the emitted assembly by `src.peephole` unless `peephole` is False. The functions called by the compiled
+    code are compiled before it and called directly, see `compile_callees`.
+    """
+    backends = ("native", "gcc")
+    def __init__(self, compilation_dir, max_cache_size=64 * 2**20, backend="native", workers=0, passes=DEFAULT_PASSES, peephole=True) -> None:
+        if backend not in self.backends:
+            raise ValueError(f"Unknown JIT backend {backend}, expected one of {self.backends}")
+        unknown_passes = [name for name in passes if name not in PASSES]
+        if unknown_passes:
+            raise ValueError(f"Unknown optimization passes {unknown_passes}, expected some of {tuple(PASSES)}")
+        self.backend = backend
+        self.passes = tuple(passes)
+        self.peephole = peephole
         self.compilation_dir = Path(compilation_dir)
         self.compilation_dir.mkdir(parents=True, exist_ok=True)
-
-        self._compiled_functions = [*BUILTIN_FUNC_ASM]
-
-        self.jitted_lib: CDLL = CDLL(None)
-
-        # load dlclose from stdlib
-        self._dl_close_func = ctypes.CDLL("").dlclose
-        self._dl_close_func.argtypes = [ctypes.c_void_p]
-    
-    def compile_function(self, func: ASTFunctionDeclare, env):
-        # generate assembler
-
-        compiled_function_label = f"func_{len(self._compiled_functions) + 1}"
-
-        ctx = CompilationContext(block_label=compiled_function_label, export_func=True)
-
-        compile_function(func, env, ctx)
-
-        self._compiled_functions.append(str(ctx))
+        self.max_cache_size = max_cache_size
+        self.cache_stats = CacheStats()
+        self.metrics = CompileMetrics()
+
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jit") if workers else None
+        # protects the engine state shared between the workers
+        self._lock = threading.RLock()
+
+        # compiled function label -> address of the function
+        self._function_addresses: dict[str, int] = {}
+        # labels being linked by a worker, the others needing them wait for the address
+        self._pending_links: dict[str, Future] = {}
+
+        # gcc backend, initialized on first use
+        self._compiler_version = None
+        self._builtins_lib_name = None
+        # library name -> loaded library
+        self._loaded_libs: dict[str, CDLL] = {}
+
+        # native backend
+        self._code_arena = None
+        self._native_symbols: dict[str, int] = {}
+        if backend == "native":
+            self._code_arena = CodeArena()
+            self._native_symbols = self._code_arena.place("\n\n".join(BUILTIN_FUNC_ASM), {})
+
+    def run_compile(self, compile_method, node, *args):
+        """Run `compile_method(node, *args)` (compile_function or compile_loop) and record its latency"""
+        t = time.perf_counter_ns()
+        try:
+            compile_method(node, *args)
+        except Exception:
+            with self._lock:
+                self.metrics.failed += 1
+            raise
+        with self._lock:
+            self.metrics.completed += 1
+            self.metrics.compile_latencies.append(time.perf_counter_ns() - t)
+
+    def submit(self, compile_method, node, *args):
+        """Queue `compile_method(node, *args)` on the workers, `node.jit_failed` is set if it fails"""
+        with self._lock:
+            self.metrics.submitted += 1
+        return self._executor.submit(self._background_compile, time.perf_counter_ns(), compile_method, node, *args)
+
+    def _background_compile(self, submit_time, compile_method, node, *args):
+        with self._lock:
+            self.metrics.queue_waits.append(time.perf_counter_ns() - submit_time)
+        try:
+            self.run_compile(compile_method, node, *args)
+        except Exception as err:
+            logger.error(err, exc_info=True)
+            node.jit_failed = True
+        finally:
+            with self._lock:
+                self.metrics.dequeued += 1
+
+    def record_phase(self, phase, start_ns):
+        with self._lock:
+            self.metrics.phase_ns[phase] += time.perf_counter_ns() - start_ns
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    @property
+    def compiler_version(self) -> str:
+        if self._compiler_version is None:
+            res = subprocess.run(["gcc", "--version"], capture_output=True, text=True)
+            self._compiler_version = res.stdout.partition("\n")[0]
+        return self._compiler_version
+
+    def cache_key(self, *parts) -> str:
+        key = hashlib.sha256()
+        for part in (JIT_ABI_VERSION, *parts):
+            key.update(repr(part).encode())
+            key.update(b"\0")
+        return key.hexdigest()
+
+    def compile_function(self, func: ASTFunctionDeclare):
+        """Compile a function value, it reads the variables of the enclosing scopes from its closure"""
+        self._compile_function(func, callers=())
+
+    def _compile_function(self, func: ASTFunctionDeclare, callers: tuple):
+        """Compile `func`, and the functions it calls first, `callers` are the functions waiting for it to be compiled"""
+        callees = self.compile_callees(func.body, func.closure, func.scope.depth, (*callers, func))
+        # the code depends on the functions it calls, the function itself is not known by its label yet
+        callee_labels = {address: "self" if callee is func else callee.jit_function_call.function_label for address, callee in callees.items()}
+        # the argument and return types are already resolved when the function value is created
+        compiled_function_label = f"func_{self.cache_key(func.arguments, func.return_type, func.body, declared_types(func.body, func.closure), sorted(callee_labels.items()), self.passes, self.peephole)[:16]}"
+        targets = {
+            address: call_target(callee, compiled_function_label if callee is func else callee_labels[address])
+            for address, callee in callees.items()
+        }
+
+        def generate_asm():
+            return self.emit(compile_ir(build_function(func, compiled_function_label, targets), self.passes))
+        address = self.link_once(compiled_function_label, generate_asm, calls=callee_labels.values())
 
         func_args = func.arguments
         func_ret_type = func.return_type
-        compiled_func = JITFunctionCall(compiled_function_label, func_args, func_ret_type, self)
-        func.jit_function_call = compiled_func
-
-        self.reload()
-
-
-    
-    def reload(self):
-        asm_code = "\n\n".join(self._compiled_functions) + "\n"
-
-        target_file = self.compilation_dir / self.asm_file_name
-
-        target_file.write_text(asm_code)
-
+        compiled_func = JITFunctionCall(compiled_function_label, func_args, func_ret_type, address, self)
+        if callees_unchanged(callees, func.closure):
+            func.jit_function_call = compiled_func
+
+    def compile_callees(self, body, frames, depth, callers: tuple) -> dict[tuple[int, int], ASTFunctionDeclare]:
+        """
+        Functions called by `body`, by the address of the variable holding them, compiled if they are not yet
+
+        Only the immutable variables of the frames below `depth` are resolved: the function they hold when the
+        caller is compiled is the one it calls directly, until the variable is declared again and the compiled code of
+        the caller is dropped (`Frame.rebind`). The other calls are left to fail when the code is built.
+        `callers` are the code being compiled, last, and the functions waiting for it: the last one can call itself,
+        the functions calling each other are not compiled.
+        """
+        callees = {}
+        for call in iter_calls(body):
+            depth_of_func, slot = address = call.func_name.address
+            if address in callees or depth_of_func >= depth:
+                continue
+            callee, typ = frames[depth_of_func].values[slot], frames[depth_of_func].types[slot]
+            if isinstance(typ, ASTMut) or not isinstance(callee, ASTFunctionDeclare) or callee.body is None:
+                continue
+            if callee is callers[-1] and callee.memo_cache is not None:
+                # native recursive calls would not go through the cache of its results (src.purity)
+                raise IRError(f"Compiling recursive call of the memoized function {call.func_name.value} is not implemented")
+            if callee is not callers[-1] and any(callee is caller for caller in callers):
+                raise IRError(f"Compiling mutually recursive call of {call.func_name.value} is not implemented")
+            if callee is not callers[-1] and (callee.jit_function_call is None or callee.jit_function_call.jit_engine is not self):
+                if callee.jit_failed:
+                    raise IRError(f"Compiling call of {call.func_name.value}, that can not be compiled, is not implemented")
+                try:
+                    self._compile_function(callee, callers)
+                except NotImplementedError:
+                    callee.jit_failed = True
+                    raise
+            # the compiled code of the caller embeds the callee, and the callees of the callee
+            frames[depth_of_func].add_dependent(slot, callers[-1])
+            if callee is not callers[-1]:
+                callee.add_dependent(callers[-1])
+            callees[address] = callee
+        return callees
+
+    def compile_loop(self, while_stmt: ASTWhileStatement, frames):
+        """Compile a loop that is being interpreted for on stack replacement"""
+        # the variables of the loop that already exist in the interpreter, they are moved in and out of the compiled loop
+        live_vars = []
+        for name in dict.fromkeys(iter_variables(while_stmt)):
+            if name not in while_stmt.bindings:
+                # declared in a nested block of the loop
+                continue
+            depth, slot = while_stmt.bindings[name]
+            value, typ = frames[depth].values[slot], frames[depth].types[slot]
+            if value is UNBOUND:
+                continue
+            if type(value) is not int or not isinstance(typ_without_mut(typ), U64):
+                raise NotImplementedError(f"On stack replacement is only implemented for u64 variables, not {name}: {typ}")
+            live_vars.append(name)
+
+        callees = self.compile_callees(while_stmt, frames, len(frames), (while_stmt,))
+        targets = {address: call_target(callee, callee.jit_function_call.function_label) for address, callee in callees.items()}
+        compiled_loop_label = f"osr_{self.cache_key(while_stmt, live_vars, declared_types(while_stmt.block, frames), sorted((address, target.label) for address, target in targets.items()), self.passes, self.peephole)[:16]}"
+        def generate_asm():
+            # the loop runs in the innermost frame
+            ir_function = build_loop(while_stmt, live_vars, len(frames) - 1, compiled_loop_label, targets, frames)
+            return self.emit(compile_ir(ir_function, self.passes, osr=True))
+        address = self.link_once(compiled_loop_label, generate_asm, calls=[target.label for target in targets.values()])
+
+        if callees_unchanged(callees, frames):
+            while_stmt.jit_loop_call = JITLoopCall(compiled_loop_label, live_vars, address, self)
+
+    def compile_batch(self, function_label, arg_count) -> int:
+        """Address of the loop calling the compiled function `function_label` on arrays, see `JITFunctionCall.batch`"""
+        batch_label = f"batch_{function_label}"
+        return self.link_once(batch_label, lambda: batch_loop_asm(batch_label, function_label, arg_count), calls=[function_label])
+
+    def link_once(self, label, generate_asm, calls=()) -> int:
+        """
+        Address of `label`, linked by `link` the first time it is needed
+
+        The label is reserved under the lock: a worker needing a label another one is linking waits for its address
+        instead of compiling and linking it again.
+        """
+        with self._lock:
+            if label in self._function_addresses:
+                self.cache_stats.hits += 1
+                return self._function_addresses[label]
+            pending = self._pending_links.get(label)
+            if pending is None:
+                self._pending_links[label] = linking = Future()
+            else:
+                self.cache_stats.hits += 1
+        if pending is not None:
+            return pending.result()
+
+        try:
+            address = self.link(label, generate_asm, calls)
+        except BaseException as err:
+            with self._lock:
+                del self._pending_links[label]
+            linking.set_exception(err)
+            raise
+        with self._lock:
+            self._function_addresses[label] = address
+            del self._pending_links[label]
+        linking.set_result(address)
+        return address
+
+    def emit(self, compilation_context: "CompilationContext") -> str:
+        """Assembly of a compiled function, after the peephole optimization"""
+        if self.peephole:
+            removed = compilation_context.peephole()
+            with self._lock:
+                self.metrics.peephole_removed[compilation_context.block_label] = removed
+            logger.debug("Peephole removed %d instructions from %s", removed, compilation_context.block_label)
+        return str(compilation_context)
+
+    def link(self, label, generate_asm, calls=()) -> int:
+        """Make the code of `generate_asm()` executable, returns the address of `label`, `calls` are the compiled functions it calls"""
+        if self.backend == "native":
+            t = time.perf_counter_ns()
+            asm_code = generate_asm()
+            self.record_phase("codegen", t)
+            t = time.perf_counter_ns()
+            try:
+                with self._lock:
+                    labels = self._code_arena.place(asm_code, self._native_symbols)
+                    # only the function itself is visible to other functions, block labels are local
+                    self._native_symbols[label] = labels[label]
+            except AssemblerError as err:
+                self.record_phase("assemble", t)
+                if any(callee in self._native_symbols for callee in calls):
+                    raise NotImplementedError(f"Native assembly of {label} failed, and it calls native code: {err}") from err
+                logger.warning("Native assembly of %s failed, falling back to gcc: %s", label, err)
+                generate_asm = lambda: asm_code
+            else:
+                self.record_phase("assemble", t)
+                return labels[label]
+
+        with self._lock:
+            if self._builtins_lib_name is None:
+                builtins_asm = "\n\n".join(BUILTIN_FUNC_ASM)
+                self._builtins_lib_name = f"jit_builtins_{self.cache_key(builtins_asm, self.compiler_version)[:16]}"
+                self.load_unit(self._builtins_lib_name, lambda: builtins_asm, mode=ctypes.RTLD_GLOBAL)
+
+        # global, the libraries of the functions calling this one resolve it when loaded
+        lib = self.load_unit(f"{label}_{self.cache_key(self.compiler_version)[:8]}", generate_asm, mode=ctypes.RTLD_GLOBAL)
+        return ctypes.cast(lib[label], ctypes.c_void_p).value
+
+    def load_unit(self, unit_name, generate_asm, mode=ctypes.DEFAULT_MODE) -> CDLL:
+        """Load the shared library `unit_name` from the cache, or assemble it from `generate_asm()`"""
+        target_file = self.compilation_dir / f"{unit_name}.s"
         target_lib = target_file.with_suffix('.so')
 
-        res = subprocess.run(["gcc", "-shared", "-g", "-o", f"{target_lib}", f"{target_file}"], capture_output=True)
-        if res.returncode != 0:
-            raise RuntimeError(f"Failed to jit compile with error: {res.stderr}")
-
-        self._dl_close_func(self.jitted_lib._handle)
-
-        self.jitted_lib = CDLL(str(target_lib))
+        if target_lib.exists():
+            with self._lock:
+                self.cache_stats.hits += 1
+            # mark as recently used for the eviction
+            os.utime(target_lib)
+            t = time.perf_counter_ns()
+            lib = CDLL(str(target_lib), mode=mode)
+            self.record_phase("load", t)
+        else:
+            with self._lock:
+                self.cache_stats.misses += 1
+            # build in temporary files so that a concurrent run or worker never uses partially written files
+            tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+            tmp_file = target_file.with_suffix(f"{tmp_suffix}.s")
+            tmp_lib = target_lib.with_suffix(tmp_suffix)
+            t = time.perf_counter_ns()
+            tmp_file.write_text(generate_asm() + "\n")
+            self.record_phase("codegen", t)
+            t = time.perf_counter_ns()
+            res = subprocess.run(["gcc", "-shared", "-g", "-o", f"{tmp_lib}", f"{tmp_file}"], capture_output=True)
+            self.record_phase("assemble", t)
+            if res.returncode != 0:
+                raise RuntimeError(f"Failed to jit compile with error: {res.stderr}")
+            os.replace(tmp_file, target_file)
+            os.replace(tmp_lib, target_lib)
+
+            t = time.perf_counter_ns()
+            lib = CDLL(str(target_lib), mode=mode)
+            self.record_phase("load", t)
+            with self._lock:
+                self.evict(keep=unit_name)
+
+        with self._lock:
+            self._loaded_libs[unit_name] = lib
+        return lib
+
+    def assembly_files(self) -> list[Path]:
+        """Assembly of the builtins and of the functions compiled by this engine, gcc backend only"""
+        if self.backend != "gcc":
+            raise NotImplementedError(f"The assembly files are only kept by the gcc backend, not {self.backend}")
+        return [self.compilation_dir / f"{unit_name}.s" for unit_name in self._loaded_libs]
+
+    def evict(self, keep=None):
+        """Remove the least recently used artifacts until the cache fits in `max_cache_size`"""
+        units = {}
+        for path in self.compilation_dir.iterdir():
+            if path.suffix in (".s", ".so"):
+                units.setdefault(path.stem, []).append(path)
+        sizes = {unit: sum(p.stat().st_size for p in paths) for unit, paths in units.items()}
+        cache_size = sum(sizes.values())
+
+        def last_use(unit):
+            lib = self.compilation_dir / f"{unit}.so"
+            return lib.stat().st_mtime if lib.exists() else 0
+
+        for unit in sorted(units, key=last_use):
+            if cache_size <= self.max_cache_size:
+                break
+            # libraries loaded by this engine are still in use
+            if unit == keep or unit in self._loaded_libs:
+                continue
+            for path in units[unit]:
+                path.unlink(missing_ok=True)
+            cache_size -= sizes[unit]
+            self.cache_stats.evictions += 1
 
 
 
@@ -130,6 +707,10 @@ def _source_to_str(source) -> str:
         case StackOffset(offset):
             # at 0 overwrites the previous rbp
             source = f"{offset}(%rbp)"
+        case Immediate(value):
+            source = f"${value}"
+        case MemoryOffset(base, offset):
+            source = f"{offset}(%{base.value})"
         case int():
             raise RuntimeError("Unexpectd int")
         case _:
@@ -152,13 +733,34 @@ class Label:
     def __str__(self) -> str:
         return f"{self.value}"
 
+class FrameSize:
+    """Size of the stack frame of a function, known once all its nested contexts are compiled"""
+    def __init__(self) -> None:
+        self.size = 0
+    def __str__(self) -> str:
+        # keep the stack 16 bytes aligned for calls
+        return f"    subq ${-(-self.size // 16) * 16}, %rsp"
+
+@dataclass
+class RegisterAllocation:
+    """Where the values of a compiled function live"""
+    locations: dict[Instruction, Register | StackOffset | Immediate] = field(default_factory=dict)
+    # callee saved registers used by the function, and where the prelude saves them
+    saved_registers: list[tuple[Register, StackOffset]] = field(default_factory=list)
+    # caller saved registers holding values needed after each call, and where they are saved
+    clobbered: dict[Instruction, list[Register]] = field(default_factory=dict)
+    call_save_slots: dict[Register, StackOffset] = field(default_factory=dict)
+
 class CompilationContext:
-    _unique_block_index = Counter()
-    def __init__(self, block_label, stack_size=0, export_func=False) -> None:
+    def __init__(self, block_label, export_func=False) -> None:
         self.block_label = block_label
+        # labels only depend on the function being compiled
+        self.label_counter = Counter()
+        self.frame = FrameSize()
+        self.registers = RegisterAllocation()
         self.block = []
         self.export_func = export_func
-        self.stack_size = stack_size # size allocated on the stack
+        self.stack_size = 0 # size allocated on the stack
     
     def __str__(self) -> str:
         res = f"{self.block_label}:\n" + "\n".join([indent(b, prefix="    ") if isinstance(b, str) else str(b) for b in self.block])
@@ -166,17 +768,19 @@ class CompilationContext:
             res = f".global {self.block_label}\n.type {self.block_label}, @function\n{res}\n"
         return res
     
-    def include_block(self, ctx: "CompilationContext"):
-        self.block.append(ctx)
-    
+    def peephole(self) -> int:
+        """Optimize the emitted instructions with `src.peephole`, returns the number of instructions removed"""
+        self.block, removed = peephole(self.block)
+        return removed
+
     def get_unique_label(self, prefix):
-        self._unique_block_index[prefix] += 1
-        return f"{prefix}_{self._unique_block_index[prefix]}"
+        self.label_counter[prefix] += 1
+        return f"{prefix}_{self.label_counter[prefix]}"
 
     def emit_move(self, source, destination, comment=None):
 
-        if isinstance(source, StackOffset) and isinstance(destination, StackOffset): 
-            raise NotImplementedError("stack to stack move not implemented yet")
+        if isinstance(source, (StackOffset, MemoryOffset)) and isinstance(destination, (StackOffset, MemoryOffset)):
+            raise NotImplementedError("memory to memory move not implemented yet")
         destination = _source_to_str(destination)
         
         source = _source_to_str(source)
@@ -205,15 +809,18 @@ class CompilationContext:
         self.block.append(f"jmp {target}")
     
     def emit_prelude(self):
-        # TODO: caller/callee reg saved stuff
         self.block.extend([
             "# enter",
             "pushq %rbp",
             "movq %rsp, %rbp",
+            self.frame,
         ])
+        for reg, slot in self.registers.saved_registers:
+            self.emit_move(source=reg, destination=slot, comment="callee saved")
 
     def emit_epilogue(self):
-        # TODO: caller/callee reg saved stuff
+        for reg, slot in self.registers.saved_registers:
+            self.emit_move(source=slot, destination=reg)
         self.block.extend([
             "# leave",
             "movq %rbp, %rsp",
@@ -221,6 +828,20 @@ class CompilationContext:
             "retq"
         ])
     
+    def reserve_stack(self, size) -> StackOffset:
+        """
+        Reserve `size` bytes in the stack frame, returns the offset of the reserved space
+
+        The frame is allocated once in the prelude, so reserving space in a loop body does not grow the stack at each iteration
+        """
+        assert size % 8 == 0
+        self.stack_size += size
+        self.frame.size = max(self.frame.size, self.stack_size)
+        return StackOffset(-self.stack_size)
+
+    def emit_load_address(self, source: StackOffset, destination: Register):
+        self.block.append(f"leaq {_source_to_str(source)}, {_source_to_str(destination)}")
+
     def emit_grow_stack(self, size):
         assert size % 8 == 0
         self.stack_size += size
@@ -231,203 +852,599 @@ class CompilationContext:
         self.stack_size -= size
         self.block.append(f"addq ${size}, %rsp")
     
-    def emit_if_branch(self, cond_true_label, cond_false_label):
+    def emit_binary_op(self, op, source, destination=Register.RAX, comment=None):
+        """`destination = destination op source`"""
+        self.block.append(f"{op} {_source_to_str(source)}, {_source_to_str(destination)}{_format_comment(comment)}")
+
+    def emit_compare(self, source, destination=Register.RAX):
+        """Set the flags for a comparison of `destination` with `source`, see `CONDITION_CODES` to use them"""
+        self.block.append(f"cmpq {_source_to_str(source)}, {_source_to_str(destination)}")
+
+    def emit_set_condition(self, condition):
+        """%rax = 1 if the flags of the last comparison match `condition`, otherwise 0"""
         self.block.extend([
-            "cmp $0, %rax",
-            f"jne {cond_true_label}",
-            f"jmp {cond_false_label}",
+            f"set{condition} %al",
+            "movzbq %al, %rax",
         ])
 
-    def emit_cond_jump(self, cond_true_label):
+    def emit_if_branch(self, condition, cond_true_label, cond_false_label):
         self.block.extend([
-            "cmp $0, %rax",
-            f"jne {cond_true_label}",
+            f"j{condition} {cond_true_label}",
+            f"jmp {cond_false_label}",
         ])
 
+    def emit_cond_jump(self, condition, cond_true_label):
+        self.block.append(f"j{condition} {cond_true_label}")
 
 
-def compile_function(func: ASTFunctionDeclare, env, compilation_context: CompilationContext, inline=False):
-    compilation_context.emit_prelude()
-
-    # move arguments to the expected places
-    compilation_context.emit_grow_stack(8 * len(func.arguments))
-    current_size = compilation_context.stack_size
-    # set arguments
-    func_env = Environment(parent=env, env=None)
-    for idx, (addr, arg) in enumerate(zip(systemv_call_order([8] * len(func.arguments)), func.arguments)):
-        dest = StackOffset(-(current_size - idx * 8))
-        compilation_context.emit_move(source=addr, destination=dest)
-        func_env.set(arg.ident.value, dest, None)
-
-
-    compile_block(func.body, func_env, compilation_context)
-
-    compilation_context.emit_epilogue()
 
+def callees_unchanged(callees, frames) -> bool:
+    """The variables of the functions called directly by the compiled code were not declared again while it was compiled"""
+    return all(frames[depth].values[slot] is callee for (depth, slot), callee in callees.items())
 
-def compile_block(block, env, compilation_context):
-    for statement in block.value:
-        compile_statement(statement, env, compilation_context)
+def iter_identifiers(node):
+    """
+    Identifiers of the variables read or written by a statement or an expression, types and called functions excluded
 
-def compile_statement(stmt, env, compilation_context):
-    match stmt.value:
-        case ASTExpression(value):
-            compile_expression(value, env, compilation_context)
-        case ASTVarDeclaration(ident, var_type,  rvalue):
-            compile_var_declaration(ident, var_type, rvalue, env, compilation_context)
+    In evaluation order: the value assigned to a variable comes before the variable.
+    """
+    match node:
+        case ASTIdentifier():
+            yield node
+        case ASTStatement(inner) | ASTExpression(inner):
+            yield from iter_identifiers(inner)
+        case ASTBlock(statements):
+            for statement in statements:
+                yield from iter_identifiers(statement)
         case ASTAssignment((lvalue, rvalue)):
-            if not isinstance(lvalue, ASTIdentifier):
-                raise NotImplementedError(f"Compiling assignement to {lvalue} not implemented")
-            compile_var_assignement(lvalue, rvalue, env, compilation_context)
-        case ASTNamedBlock():
-            raise NotImplementedError(f"Interpret statement not implemented for named blocks")
-        case ASTIfStatement() as if_stmt:
-            compile_if_statement(if_stmt, env, compilation_context)
-            # raise NotImplementedError(f"Interpret statement not implemented for if statement")
-        case ASTWhileStatement() as while_stmt:
-            compile_while_statement(while_stmt, env, compilation_context)
-        case v:
-            raise NotImplementedError(f"Interpret statement not implemented for {v}")
-
-def compile_if_statement(if_stmt: ASTIfStatement, env: Environment, compilation_context: CompilationContext):
-
-    compile_expression(if_stmt.cond, env, compilation_context)
-
-    cond_true_label = compilation_context.get_unique_label("if_cond_true")
-    cond_false_label = compilation_context.get_unique_label("if_cond_false")
-    end_if_label = Label(compilation_context.get_unique_label("end_if_label"))
-
-    compilation_context.emit_if_branch(cond_true_label, cond_false_label)
-
-    cond_true_block = CompilationContext(block_label=cond_true_label, stack_size=compilation_context.stack_size)
-    cond_true_env = Environment(parent=env)
-    compile_block(if_stmt.if_block, cond_true_env, cond_true_block)
-    cond_true_block.emit_jump(end_if_label)
-    compilation_context.include_block(cond_true_block)
-
-    cond_false_block = CompilationContext(block_label=cond_false_label, stack_size=compilation_context.stack_size)
-    if if_stmt.else_block is not None:
-        cond_false_env = Environment(parent=env)
-        compile_block(if_stmt.else_block, cond_false_env, cond_false_block)
-    cond_false_block.emit_jump(end_if_label)
-    compilation_context.include_block(cond_false_block)
-
-    compilation_context.emit_jump_target(end_if_label)
-
-def compile_while_statement(while_stmt: ASTWhileStatement, env: Environment, compilation_context: CompilationContext):
-    loop_label = compilation_context.get_unique_label("while")
-    block_ctx = CompilationContext(block_label=loop_label, stack_size=compilation_context.stack_size)
-    compile_block(while_stmt.block, env, block_ctx)
-    compile_expression(while_stmt.cond, env, block_ctx)
-    block_ctx.emit_cond_jump(loop_label)
-    compilation_context.include_block(block_ctx)
-
-def compile_expression(exp, env, compilation_context: CompilationContext):
-    # kinda inline function call
-    match exp:
-        case ASTExpression(exp):
-            return compile_expression(exp, env, compilation_context)
-        case ASTNumber() as val:
-            # move literal to rax
-            compilation_context.emit_move(source=val, destination=Register.RAX)
-        case ASTIdentifier(ident):
-            # retrieve value and move it to rax
-            arg = env.get(ident)
-            compilation_context.emit_move(source=arg, destination=Register.RAX)
-        case ASTBinaryOp(a, op, b):
-            # raise NotImplementedError("Binary operation not implemented yet")
-            assert isinstance(op, ASTOp), type(op)
-
-            # TODO: resolve op to a function then compile like a function call of the operator
-            match op.value:
-                case "+":
-                    compile_function_call("add", (a, b), env, compilation_context)
-                case "-":
-                    compile_function_call("sub", (a, b), env, compilation_context)
-                case "*":
-                    compile_function_call("mul", (a, b), env, compilation_context)
-                case "/":
-                    compile_function_call("div", (a, b), env, compilation_context)
-                case "<":
-                    compile_function_call("lt", (a, b), env, compilation_context)
-                case ">":
-                    compile_function_call("gt", (a, b), env, compilation_context)
-                case "<=":
-                    compile_function_call("lte", (a, b), env, compilation_context)
-                case ">=":
-                    compile_function_call("gte", (a, b), env, compilation_context)
-                case "==":
-                    compile_function_call("eq", (a, b), env, compilation_context)
-                case "!=":
-                    compile_function_call("neq", (a, b), env, compilation_context)
-                case o:
-                    raise NotImplementedError(f"Operation compilation not implemented for {o}")
-        case ASTFunctionDeclare(_):
-            raise NotImplementedError("Function declaration inside expression is not supported yet")
-        case ASTFunctionCall(func_name, arguments):
-            func = env.get(func_name)
-            compile_function_call(func, arguments, env, compilation_context)
-        case o:
-            raise NotImplementedError(f"Compilation of {type(o)} not implemented yet")
-
-def compile_var_declaration(lvalue, var_type, rvalue, env: Environment, compilation_context: CompilationContext):
-    if isinstance(var_type, ASTFunctionType):
-        raise NotImplementedError(f"Compiling inner functions is not supported yet")
-    if not isinstance(var_type.value, ASTIdentifier):
-        if isinstance(var_type.value, ASTType):
-            return compile_var_declaration(lvalue, var_type.value, rvalue, env, compilation_context)
-        raise NotImplementedError(f"Compiling variablle declaration of type {var_type.value} is not implemented")
-    if not var_type.value.value == "u64":
-        raise NotImplementedError(f"Compiling variablle of type {var_type.value} is not implemented")
-    if not isinstance(lvalue, ASTIdentifier):
-        raise NotImplementedError(f"Assigning to anything else than an identifier is not supported yet (found: {type(lvalue)})")
-    match rvalue:
-        case ASTFunctionDeclare() as func_dec:
-            # update env/compilation context to be able to call the function later
-            raise NotImplementedError("Function declare compilation is not implemented yet")
-            # should be called from jit engine
-            compile_function(func_dec, env, compilation_context)
-        case ASTExpression(exp):
-            # results is in rax because only qword are implemented, but it could not be the case later
-            compile_expression(exp, env, compilation_context)
-            # add some space on the stack for the new variable
-            compilation_context.emit_grow_stack(8)
-            var_addr = StackOffset(-compilation_context.stack_size)
-            env.set(lvalue.value, var_addr, None) # TODO: do not ignore type
-            compilation_context.emit_move(source=Register.RAX, destination=var_addr)
-
-def compile_var_assignement(lvalue, rvalue, env, compilation_context: CompilationContext):
-    match rvalue:
-        case ASTExpression(exp):
-            if not isinstance(lvalue, ASTIdentifier):
-                raise NotImplementedError(f"Compiling assignement to {exp} not implemented")
-            var_addr = env.get(lvalue.value)
-            # TODO: check that types of value and variable match
-            compile_expression(exp, env, compilation_context)
-            compilation_context.emit_move(source=Register.RAX, destination=var_addr)
-        case o:
-            raise NotImplementedError(f"Compiling assigning {o} not implemented")
-
-def compile_function_call(func, arguments, env: Environment, compilation_context: CompilationContext):
-    if isinstance(func, str):
-        func_label = func
+            yield from iter_identifiers(rvalue)
+            yield from iter_identifiers(lvalue)
+        case ASTVarDeclaration(ident, _, rvalue):
+            yield from iter_identifiers(rvalue)
+            yield from iter_identifiers(ident)
+        case ASTBinaryOp(a, _, b):
+            yield from iter_identifiers(a)
+            yield from iter_identifiers(b)
+        case ASTIfStatement(cond, if_block, else_block):
+            yield from iter_identifiers(cond)
+            yield from iter_identifiers(if_block)
+            yield from iter_identifiers(else_block)
+        case ASTWhileStatement(cond, block):
+            yield from iter_identifiers(cond)
+            yield from iter_identifiers(block)
+        case ASTFunctionCall(_, arguments):
+            for arg in arguments:
+                yield from iter_identifiers(arg)
+        case ASTFieldLookup(obj, _):
+            yield from iter_identifiers(obj)
+        case ASTStructValue(fields):
+            for field in fields:
+                yield from iter_identifiers(field.value)
+
+def iter_calls(node):
+    """Function calls of a statement or an expression, including the calls in their arguments"""
+    match node:
+        case ASTStatement(inner) | ASTExpression(inner):
+            yield from iter_calls(inner)
+        case ASTBlock(statements):
+            for statement in statements:
+                yield from iter_calls(statement)
+        case ASTAssignment((lvalue, rvalue)):
+            yield from iter_calls(rvalue)
+            yield from iter_calls(lvalue)
+        case ASTVarDeclaration(_, _, rvalue):
+            yield from iter_calls(rvalue)
+        case ASTBinaryOp(a, _, b):
+            yield from iter_calls(a)
+            yield from iter_calls(b)
+        case ASTIfStatement(cond, if_block, else_block):
+            yield from iter_calls(cond)
+            yield from iter_calls(if_block)
+            yield from iter_calls(else_block)
+        case ASTWhileStatement(cond, block):
+            yield from iter_calls(cond)
+            yield from iter_calls(block)
+        case ASTFunctionCall(_, arguments):
+            yield node
+            for arg in arguments:
+                yield from iter_calls(arg)
+        case ASTFieldLookup(obj, _):
+            yield from iter_calls(obj)
+        case ASTStructValue(fields):
+            for field in fields:
+                yield from iter_calls(field.value)
+
+def declared_types(node, frames) -> list:
+    """Compiled types of the variables declared in a block, None when they can not be compiled: the named types are read from `frames`"""
+    match node:
+        case ASTStatement(inner):
+            return declared_types(inner, frames)
+        case ASTBlock(statements):
+            return [typ for statement in statements for typ in declared_types(statement, frames)]
+        case ASTVarDeclaration(_, var_type, _):
+            try:
+                return [layout_of(var_type, frames)]
+            except IRError:
+                return [None]
+        case ASTIfStatement(_, if_block, else_block):
+            return declared_types(if_block, frames) + (declared_types(else_block, frames) if else_block is not None else [])
+        case ASTWhileStatement(_, block):
+            return declared_types(block, frames)
+    return []
+
+def iter_variables(node):
+    """Names of the variables read or written by a statement or an expression, types and called functions excluded"""
+    for ident in iter_identifiers(node):
+        yield ident.value
+
+# u64 comparisons are unsigned: above/below instead of greater/less
+CONDITION_CODES = {"<": "b", "<=": "be", ">": "a", ">=": "ae", "==": "e", "!=": "ne"}
+# condition codes once the operands of the comparison are swapped
+SWAPPED_CONDITION_CODES = {"b": "a", "be": "ae", "a": "b", "ae": "be", "e": "e", "ne": "ne"}
+# operations computed in place, `destination op= source`
+IN_PLACE_OPS = {"+": "addq", "-": "subq", "*": "imulq", "<<": "shlq", ">>": "shrq"}
+
+def _is_immediate(instruction: Instruction) -> bool:
+    # immediates are sign extended from 32 bits
+    return instruction.op == "const" and instruction.value < 2**31
+
+def fused_comparisons(function: IRFunction) -> set[Instruction]:
+    """Comparisons only used by the branch right after them, compiled to a compare and a conditional jump"""
+    uses = function.uses()
+    fused = set()
+    for block in function.blocks:
+        match block.terminator:
+            case Branch(cond, _, _) if cond.op in COMPARISONS and block.instructions and block.instructions[-1] is cond and uses[cond] == [block]:
+                fused.add(cond)
+    return fused
+
+def phi_copies(block, succ) -> list[tuple[Instruction, Instruction]]:
+    """(phi, value) copies done at the end of `block` when going to `succ`"""
+    idx = succ.predecessors.index(block)
+    return [(phi, phi.args[idx]) for phi in succ.phis]
+
+def liveness(order) -> tuple[dict, dict]:
+    """
+    Values live at the start and at the end of each block
+
+    Phis are written at the end of their predecessors, their operands read there.
+    """
+    live_in = {block: set() for block in order}
+    live_out = {block: set() for block in order}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(order):
+            out = set()
+            for succ in block.successors:
+                out |= live_in[succ] - set(succ.phis)
+                out.update(value for _, value in phi_copies(block, succ))
+            live = set(out)
+            live.update(terminator_args(block.terminator))
+            for instruction in reversed(block.instructions):
+                live.discard(instruction)
+                if instruction.op != "phi":
+                    live.update(instruction.args)
+            if out != live_out[block] or live != live_in[block]:
+                live_out[block], live_in[block] = out, live
+                changed = True
+    return live_in, live_out
+
+def live_after_definitions(order, live_in, live_out) -> dict[Instruction, set[Instruction]]:
+    """Values live right after the definition of each value, the phis of a block are all defined at its start"""
+    live_after = {}
+    for block in order:
+        live = set(live_out[block]) | set(terminator_args(block.terminator))
+        for instruction in reversed(block.instructions):
+            if instruction.op == "phi":
+                break
+            live_after[instruction] = set(live)
+            live.discard(instruction)
+            live.update(instruction.args)
+        for phi in block.phis:
+            live_after[phi] = live_in[block] | set(block.phis)
+    return live_after
+
+def coalesce_phis(order, live_after, unallocated) -> dict[Instruction, Instruction]:
+    """
+    Group each phi with its operands when their values are never live at the same time, the group
+    shares a location and the copies of the phi disappear. Returns the representative of each grouped value.
+    """
+    groups = {}
+    def group(value):
+        return groups.setdefault(value, [value])
+
+    def interfere(a, b):
+        return a in live_after.get(b, ()) or b in live_after.get(a, ())
+
+    for block in order:
+        for phi in block.phis:
+            for arg in phi.args:
+                phi_group, arg_group = group(phi), group(arg)
+                if arg in unallocated or arg.op == "const" or phi_group is arg_group:
+                    continue
+                if any(interfere(a, b) for a in phi_group for b in arg_group):
+                    continue
+                phi_group.extend(arg_group)
+                for value in arg_group:
+                    groups[value] = phi_group
+    return {value: members[0] for value, members in groups.items()}
+
+def live_intervals(function: IRFunction, order, live_in, live_out, unallocated, representatives) -> tuple[dict[Instruction, list[int]], dict[Instruction, int]]:
+    """
+    Interval of positions, in the block order `order`, where each value is live, by representative, and the
+    position of each instruction
+
+    The intervals have no holes: a value only live at the start and the end of a loop keeps its location
+    in the whole loop.
+    """
+    position = 0
+    starts, ends = {}, {}
+    positions = {}
+    for block in order:
+        starts[block] = position
+        for instruction in block.instructions:
+            position += 1
+            positions[instruction] = starts[block] if instruction.op == "phi" else position
+        position += 1
+        ends[block] = position
+        position += 1
+
+    intervals = {}
+    def extend(value, position):
+        if value in unallocated:
+            return
+        interval = intervals.setdefault(representatives.get(value, value), [position, position])
+        interval[0] = min(interval[0], position)
+        interval[1] = max(interval[1], position)
+
+    for param in function.params:
+        extend(param, 0)
+    for block in order:
+        for value in live_in[block]:
+            extend(value, starts[block])
+        for value in live_out[block]:
+            extend(value, ends[block])
+        for instruction in block.instructions:
+            extend(instruction, positions[instruction])
+            if instruction.op == "phi":
+                for pred in block.predecessors:
+                    extend(instruction, ends[pred])
+            else:
+                for arg in instruction.args:
+                    extend(arg, positions[instruction])
+        for arg in terminator_args(block.terminator):
+            extend(arg, ends[block])
+    # the operands of a fused comparison are read by the branch
+    for value in unallocated:
+        if value.op in COMPARISONS:
+            for arg in value.args:
+                extend(arg, ends[value.block])
+    return intervals, positions
+
+def linear_scan(intervals, registers, hints, preferences=None) -> dict:
+    """
+    Assign a register of `registers` to each interval, None when it is spilled
+
+    Intervals are taken by start position, `hints` are tried first (arguments stay in place), then the free
+    registers in the order of `registers`, or of `preferences` for the values it has. When no register
+    is free the interval ending last is spilled, as it would hold a register the longest.
+    """
+    preferences = preferences or {}
+    allocation = {}
+    free = list(registers)
+    # (end, value) of the intervals holding a register
+    active = []
+    for value, (start, end) in sorted(intervals.items(), key=lambda item: (item[1][0], item[0] not in hints)):
+        for active_interval in [interval for interval in active if interval[0] < start]:
+            active.remove(active_interval)
+            free.append(allocation[active_interval[1]])
+
+        if free:
+            reg = hints.get(value) if hints.get(value) in free else min(free, key=preferences.get(value, registers).index)
+            free.remove(reg)
+            allocation[value] = reg
+            active.append((end, value))
+            continue
+        spilled = max(active, key=lambda interval: interval[0])
+        if spilled[0] > end:
+            allocation[value] = allocation[spilled[1]]
+            allocation[spilled[1]] = None
+            active.remove(spilled)
+            active.append((end, value))
+        else:
+            allocation[value] = None
+    return allocation
+
+# values live across a call prefer the registers it preserves
+CALL_PRESERVED_FIRST = [*CALLEE_SAVED, *(reg for reg in ALLOCATABLE_REGISTERS if reg not in CALLEE_SAVED)]
+
+def allocate_registers(function: IRFunction, order, fused, hints, compilation_context: CompilationContext) -> RegisterAllocation:
+    """
+    Location of each value, spilled values and saved registers get a slot in the stack frame
+
+    The caller saved registers still holding a value after a call are saved around it, see `RegisterAllocation.clobbered`.
+    """
+    immediates = {instruction for instruction in function.instructions() if _is_immediate(instruction)}
+    # calls returning nothing or a struct, a struct is in the results of the call, and the constants left unused
+    # without dead code elimination, materialized at the start they could overwrite a constant sharing their register
+    valueless = {instruction for instruction in function.instructions() if instruction.typ is None}
+    valueless |= {value for value, users in function.uses().items() if value.op == "const" and not users}
+    live_in, live_out = liveness(order)
+    live_after = live_after_definitions(order, live_in, live_out)
+    representatives = coalesce_phis(order, live_after, immediates | fused | valueless)
+    intervals, positions = live_intervals(function, order, live_in, live_out, immediates | fused | valueless, representatives)
+    group_hints = {representatives.get(value, value): reg for value, reg in hints.items()}
+    calls = [instruction for instruction in function.instructions() if instruction.op == "call"]
+    crossing = {
+        value: CALL_PRESERVED_FIRST for value, (start, end) in intervals.items()
+        if any(start < positions[call] < end for call in calls)
+    }
+    allocation = linear_scan(intervals, ALLOCATABLE_REGISTERS, group_hints, crossing)
+    used = set(allocation.values())
+    registers = RegisterAllocation(saved_registers=[(reg, compilation_context.reserve_stack(8)) for reg in CALLEE_SAVED if reg in used])
+    for value, reg in allocation.items():
+        registers.locations[value] = reg if reg is not None else compilation_context.reserve_stack(8)
+    for value, representative in representatives.items():
+        if representative in registers.locations:
+            registers.locations[value] = registers.locations[representative]
+    for value in immediates:
+        registers.locations[value] = Immediate(value.value)
+    for call in calls:
+        live_registers = {registers.locations.get(value) for value in live_after[call] if value is not call}
+        registers.clobbered[call] = [reg for reg in ALLOCATABLE_REGISTERS if reg in live_registers and reg not in CALLEE_SAVED]
+    return registers
+
+
+_MEMORY = (StackOffset, MemoryOffset)
+
+def _emit_copy(source, destination, compilation_context: CompilationContext, scratch=Register.RDX):
+    """Move `source` to `destination`, memory to memory moves go through `scratch`, or the stack if it is None"""
+    if source == destination:
+        return
+    if isinstance(source, _MEMORY) and isinstance(destination, _MEMORY):
+        if scratch is None:
+            compilation_context.emit_push(source)
+            compilation_context.block.append(f"popq {_source_to_str(destination)}")
+            return
+        compilation_context.emit_move(source=source, destination=scratch)
+        source = scratch
+    compilation_context.emit_move(source=source, destination=destination)
+
+def emit_parallel_copies(copies, compilation_context: CompilationContext):
+    """
+    Copy each (source, destination) as if all the copies happened at once, a destination can be the source
+    of another copy. The cycles (swaps) go through %rax.
+    """
+    copies = [(source, destination) for source, destination in copies if source != destination]
+    while copies:
+        ready = [copy for copy in copies if all(copy[1] != source for source, _ in copies)]
+        if ready:
+            # a scratch register for the memory to memory moves, holding no value still to be copied
+            pending = {location for copy in copies for location in copy}
+            scratch = next((reg for reg in (Register.RDX, Register.RAX, Register.RCX) if reg not in pending), None)
+            for source, destination in ready:
+                _emit_copy(source, destination, compilation_context, scratch)
+            copies = [copy for copy in copies if copy not in ready]
+            continue
+        # only cycles are left, the value of a destination is saved so it can be overwritten
+        _, destination = copies[0]
+        _emit_copy(destination, Register.RAX, compilation_context)
+        copies = [(Register.RAX if source == destination else source, dest) for source, dest in copies]
+
+def _emit_operation(op, destination, a, b, compilation_context: CompilationContext):
+    """`destination = a op b`, the operands are locations"""
+    if op == "/":
+        # unsigned division of rdx:rax, the divisor can not be an immediate
+        compilation_context.emit_move(source=a, destination=Register.RAX)
+        if isinstance(b, Immediate):
+            compilation_context.emit_move(source=b, destination=Register.RCX)
+            b = Register.RCX
+        compilation_context.block.extend(["xorq %rdx, %rdx", f"divq {_source_to_str(b)}"])
+        _emit_copy(Register.RAX, destination, compilation_context)
+        return
+    if op in CONDITION_CODES:
+        if not isinstance(a, Register):
+            compilation_context.emit_move(source=a, destination=Register.RAX)
+            a = Register.RAX
+        compilation_context.emit_compare(b, a)
+        compilation_context.emit_set_condition(CONDITION_CODES[op])
+        _emit_copy(Register.RAX, destination, compilation_context)
+        return
+
+    mnemonic = IN_PLACE_OPS[op]
+    if op in ("+", "*") and b == destination:
+        # commutative, the operand already in place is the one updated
+        a, b = b, a
+    if op == "*" and isinstance(b, Immediate):
+        # no immediate form of imul in the emitted subset
+        compilation_context.emit_move(source=b, destination=Register.RCX)
+        b = Register.RCX
+    if isinstance(destination, Register) and b != destination:
+        _emit_copy(a, destination, compilation_context)
+        compilation_context.emit_binary_op(mnemonic, b, destination)
+    else:
+        compilation_context.emit_move(source=a, destination=Register.RAX)
+        compilation_context.emit_binary_op(mnemonic, b, Register.RAX)
+        _emit_copy(Register.RAX, destination, compilation_context)
+
+def _emit_compare(comparison: Instruction, locations, compilation_context: CompilationContext) -> str:
+    """Compare the operands of a fused comparison, returns the condition code to jump on when it is true"""
+    a, b = (locations[arg] for arg in comparison.args)
+    condition = CONDITION_CODES[comparison.op]
+    if isinstance(a, Immediate) and not isinstance(b, Immediate):
+        # `0 < n` is compared as `n > 0`, the immediate is the source
+        a, b, condition = b, a, SWAPPED_CONDITION_CODES[condition]
+    if not isinstance(a, Register):
+        compilation_context.emit_move(source=a, destination=Register.RAX)
+        a = Register.RAX
+    compilation_context.emit_compare(b, a)
+    return condition
+
+def _emit_call(call: Instruction, results: list[Instruction], locations, clobbered, compilation_context: CompilationContext):
+    """
+    Call a compiled function following the System V ABI, the registers in `clobbered` are saved around it
+
+    A returned struct goes to the locations of the `results` of the call, from %rax and %rdx or from the
+    space of the frame the callee writes it to.
+    """
+    target = call.value
+    slots = compilation_context.registers.call_save_slots
+    for reg in clobbered:
+        if reg not in slots:
+            slots[reg] = compilation_context.reserve_stack(8)
+        compilation_context.emit_move(source=reg, destination=slots[reg])
+    result_area = compilation_context.reserve_stack(target.return_size) if target.return_size > 16 else None
+
+    destinations = list(systemv_call_order(target.argument_sizes, return_size=target.return_size))
+    stack_args = [(arg, destination) for arg, destination in zip(call.args, destinations) if isinstance(destination, MemoryOffset)]
+    # the stack arguments are written first, the registers of the others can hold their values
+    stack_size = -(-8 * len(stack_args) // 16) * 16
+    if stack_size:
+        compilation_context.emit_grow_stack(stack_size)
+    for arg, destination in stack_args:
+        _emit_copy(locations[arg], destination, compilation_context, scratch=Register.RAX)
+    emit_parallel_copies([(locations[arg], destination) for arg, destination in zip(call.args, destinations) if isinstance(destination, Register)], compilation_context)
+    if result_area is not None:
+        compilation_context.emit_load_address(result_area, CALL_ORDER[0])
+    # through the PLT for gcc, the callee is in another shared library
+    compilation_context.emit_call(f"{target.label}@PLT")
+    if stack_size:
+        compilation_context.emit_shrink_stack(stack_size)
+
+    if call in locations:
+        _emit_copy(Register.RAX, locations[call], compilation_context)
+    sources = [StackOffset(result_area + 8 * idx) for idx in range(target.return_size // 8)] if result_area is not None else [Register.RAX, Register.RDX]
+    for result in results:
+        if result in locations:
+            _emit_copy(sources[result.value], locations[result], compilation_context, scratch=Register.RCX)
+    for reg in clobbered:
+        compilation_context.emit_move(source=slots[reg], destination=reg)
+
+def lower_function(function: IRFunction, compilation_context: CompilationContext, osr=False):
+    """
+    Emit the assembly of `function`
+
+    Its parameters are the arguments of a function, or for a loop compiled for on stack replacement the values
+    pointed by its only argument, where the values it returns are written back.
+    """
+    # the copies of the phis need a block of their own on the edges from a branch to a block with several predecessors
+    for block in list(function.blocks):
+        if block.phis and len(block.predecessors) > 1:
+            for pred in list(block.predecessors):
+                if len(pred.successors) > 1:
+                    function.split_edge(pred, block)
+    order = function.reverse_postorder()
+    fused = fused_comparisons(function)
+
+    param_sources = list(systemv_call_order(function.argument_sizes, caller=False, return_size=function.return_size)) if not osr else []
+    # arguments stay in the register they are passed in when possible
+    hints = {param: source for param, source in zip(function.params, param_sources) if isinstance(source, Register)}
+    registers = allocate_registers(function, order, fused, hints, compilation_context)
+    compilation_context.registers = registers
+    locations = registers.locations
+    vars_pointer = compilation_context.reserve_stack(8) if osr else None
+    # where to write a returned struct that does not fit in registers
+    result_pointer = compilation_context.reserve_stack(8) if not osr and function.return_size > 16 else None
+    compilation_context.emit_prelude()
+    if result_pointer is not None:
+        compilation_context.emit_move(source=CALL_ORDER[0], destination=result_pointer)
+
+    if osr:
+        compilation_context.emit_move(source=CALL_ORDER[0], destination=vars_pointer)
+        # the pointer is moved out of rdi, that can hold a value
+        compilation_context.emit_move(source=CALL_ORDER[0], destination=Register.RCX)
+        for idx, param in enumerate(function.params):
+            if param in locations:
+                _emit_copy(MemoryOffset(Register.RCX, 8 * idx), locations[param], compilation_context)
     else:
-        raise NotImplementedError("Calling non builtin functions not implemented yet")
-
-    # assume all values are 64 bits, todo compute stack size needed
-    # compilation_context.emit_reserve_stack(len(args))
-    # tofix: stack arguments
-    if len(arguments) > 6:
-        compilation_context.emit_grow_stack(8 * len(arguments))
-    current_size = compilation_context.stack_size
-    for addr, arg in zip(systemv_call_order([8] * len(arguments)), arguments):
-        # TODO: compile expression should accept a target destination for the result to be stored in, for now assumes its in rax
-        compile_expression(arg, env, compilation_context)
-        # compilation_context.emit_push(source=Register.RAX)
-        if isinstance(addr, StackOffset):
-            # adjust stack offset from the point of view of the caller
-            addr = StackOffset(current_size - addr)
-        compilation_context.emit_move(source=Register.RAX, destination=addr)
-    compilation_context.emit_call(func_label)
-    if len(arguments) > 6:
-        compilation_context.emit_shrink_stack(8 * len(arguments))
+        # an argument can be passed in the register another one is allocated to
+        emit_parallel_copies([(source, locations[param]) for param, source in zip(function.params, param_sources) if param in locations], compilation_context)
+    # after the arguments, the registers they are passed in can hold constants
+    for instruction in function.constants.values():
+        if instruction not in fused and not isinstance(locations.get(instruction), (Immediate, type(None))):
+            compilation_context.emit_move(source=Immediate(instruction.value), destination=Register.RAX)
+            _emit_copy(Register.RAX, locations[instruction], compilation_context)
+
+    # blocks only jumping to another one, usually split edges whose copies all disappeared, are skipped
+    forwards = {}
+    for block in order[1:]:
+        match block.terminator:
+            case Jump(target) if not block.instructions and all(locations[phi] == locations[value] for phi, value in phi_copies(block, target)):
+                forwards[block] = target
+    def resolve(block):
+        while block in forwards:
+            block = forwards[block]
+        return block
+    order = [block for block in order if block not in forwards]
+
+    results = {}
+    for instruction in function.instructions():
+        if instruction.op == "result":
+            results.setdefault(instruction.args[0], []).append(instruction)
+
+    labels = {block: Label(f"{compilation_context.block_label}_{block.label}") for block in order}
+    for idx, block in enumerate(order):
+        next_block = order[idx + 1] if idx + 1 < len(order) else None
+        if idx > 0:
+            compilation_context.emit_jump_target(labels[block])
+        for instruction in block.instructions:
+            if instruction.op in ("phi", "param", "const", "result") or instruction in fused:
+                continue
+            if instruction.op == "call":
+                _emit_call(instruction, results.get(instruction, []), locations, registers.clobbered[instruction], compilation_context)
+                continue
+            a, b = (locations[arg] for arg in instruction.args)
+            _emit_operation(instruction.op, locations.get(instruction, Register.RAX), a, b, compilation_context)
+
+        match block.terminator:
+            case Jump(target):
+                emit_parallel_copies([(locations[value], locations[phi]) for phi, value in phi_copies(block, target)], compilation_context)
+                target = resolve(target)
+                if target is not next_block:
+                    compilation_context.emit_jump(labels[target])
+            case Branch(cond, if_true, if_false) if isinstance(locations.get(cond), Immediate):
+                # a constant condition, left when constant propagation is disabled, cmp can not compare two immediates
+                target = resolve(if_true if cond.value else if_false)
+                if target is not next_block:
+                    compilation_context.emit_jump(labels[target])
+            case Branch(cond, if_true, if_false):
+                if_true, if_false = resolve(if_true), resolve(if_false)
+                if cond in fused:
+                    condition = _emit_compare(cond, locations, compilation_context)
+                else:
+                    compilation_context.emit_compare(Immediate(0), locations[cond])
+                    condition = "ne"
+                if if_false is next_block:
+                    compilation_context.emit_cond_jump(condition, labels[if_true])
+                elif if_true is next_block:
+                    compilation_context.emit_cond_jump(NEGATED_CONDITION_CODES[condition], labels[if_false])
+                else:
+                    compilation_context.emit_if_branch(condition, labels[if_true], labels[if_false])
+            case Return(values) if osr:
+                compilation_context.emit_move(source=vars_pointer, destination=Register.RCX)
+                for idx, value in enumerate(values):
+                    source = locations[value]
+                    if isinstance(source, StackOffset):
+                        compilation_context.emit_move(source=source, destination=Register.RAX)
+                        source = Register.RAX
+                    compilation_context.emit_move(source=source, destination=MemoryOffset(Register.RCX, 8 * idx))
+                compilation_context.emit_epilogue()
+            case Return(values) if result_pointer is not None:
+                compilation_context.emit_move(source=result_pointer, destination=Register.RCX)
+                for idx, value in enumerate(values):
+                    _emit_copy(locations[value], MemoryOffset(Register.RCX, 8 * idx), compilation_context, scratch=Register.RAX)
+                # the address of the result is returned
+                compilation_context.emit_move(source=Register.RCX, destination=Register.RAX)
+                compilation_context.emit_epilogue()
+            case Return(values):
+                # a struct of 16 bytes is returned in rax and rdx
+                emit_parallel_copies([(locations[value], reg) for value, reg in zip(values, (Register.RAX, Register.RDX))], compilation_context)
+                compilation_context.emit_epilogue()
+
+def compile_ir(function: IRFunction, passes, osr=False) -> CompilationContext:
+    """Optimize `function` with `passes` and emit its code, exported under the function name"""
+    optimize(function, passes)
+    compilation_context = CompilationContext(block_label=function.name, export_func=True)
+    lower_function(function, compilation_context, osr=osr)
+    return compilation_context
@@ -1,35 +1,67 @@
+import operator
 import time
 from typing import Callable
 import logging
 
 
 from src.ast_definition import *
-from src.compile import JITEngine, JITValuError
-from src.utils import Environment, TypedVar
+from src.compile import JITEngine, JITValuError, typ_without_mut
+from src.resolver import FunctionScope, resolve_module
+from src.utils import UNBOUND, Frame, TypedVar
 from src.runtime_values import *
+from src.purity import memo_cache, memo_key, memo_summary
+from src.verification import VERIFY_MODES, Verifier
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.INFO)
 
 JIT_COMPILE = True
-SHADOW_JIT = True
+# `src.compile.JITEngine` compiling the hot functions and loops, set by the command line or by `src.runtime.Runtime`
+JIT_ENGINE = None
+# jitted calls also interpreted to compare the results, see `src.verification`
+VERIFIER = Verifier("sampled")
 DEBUG = False
+# number of calls before a function is compiled, and of iterations before a running loop is replaced by compiled code
+JIT_CALL_THRESHOLD = 5
+JIT_LOOP_THRESHOLD = 50
+# `src.profiler.Profiler` recording the calls, None when not profiling
+PROFILER = None
+# results of pure functions are cached, see `src.purity`
+MEMOIZE = True
+# names of the functions always (True) or never (False) memoized, applied when they are declared
+MEMOIZE_OVERRIDES: dict[str, bool] = {}
+
+
+def builtin_operator(operation):
+    """
+    Operator on numbers, the result has the type of the left operand
+
+    u64 values are python ints, the result wraps around without allocating a boxed number. Literals wrap around too,
+    the compiled code computes them as u64 values.
+    """
+    def apply(a, b):
+        b = number_value(b)
+        if type(a) is int:
+            return int(operation(a, b)) & U64_MASK
+        return type(a)(int(operation(a.value, b)) & U64_MASK)
+    return apply
 
 
 # TODO: add type checking to builtin functions
 BUILTIN_FUNCTIONS = {
-    "/":  TypedVar(lambda a, b: type(a)(a.value / b.value), ASTInferType(None)),
-    "*":  TypedVar(lambda a, b: type(a)(a.value * b.value), ASTInferType(None)),
-    "+":  TypedVar(lambda a, b: type(a)(a.value + b.value), ASTInferType(None)),
-    "-":  TypedVar(lambda a, b: type(a)(a.value - b.value), ASTInferType(None)),
-    "<":  TypedVar(lambda a, b: type(a)(int(a.value < b.value)), ASTInferType(None)),
-    "<=": TypedVar(lambda a, b: type(a)(int(a.value <= b.value)), ASTInferType(None)),
-    ">":  TypedVar(lambda a, b: type(a)(int(a.value > b.value)), ASTInferType(None)),
-    ">=": TypedVar(lambda a, b: type(a)(int(a.value >= b.value)), ASTInferType(None)),
-    "==":  TypedVar(lambda a, b: type(a)(int(a.value == b.value)), ASTInferType(None)),
-    "!=":  TypedVar(lambda a, b: type(a)(int(a.value != b.value)), ASTInferType(None)),
-    "print": TypedVar(lambda *a: print(*a), ASTInferType(None)),
+    # integer division, exact on the whole u64 range like the division of the compiled code
+    "/":  TypedVar(builtin_operator(operator.floordiv), ASTInferType(None)),
+    "*":  TypedVar(builtin_operator(operator.mul), ASTInferType(None)),
+    "+":  TypedVar(builtin_operator(operator.add), ASTInferType(None)),
+    "-":  TypedVar(builtin_operator(operator.sub), ASTInferType(None)),
+    "<":  TypedVar(builtin_operator(lambda a, b: int(a < b)), ASTInferType(None)),
+    "<=": TypedVar(builtin_operator(lambda a, b: int(a <= b)), ASTInferType(None)),
+    ">":  TypedVar(builtin_operator(lambda a, b: int(a > b)), ASTInferType(None)),
+    ">=": TypedVar(builtin_operator(lambda a, b: int(a >= b)), ASTInferType(None)),
+    "==":  TypedVar(builtin_operator(lambda a, b: int(a == b)), ASTInferType(None)),
+    "!=":  TypedVar(builtin_operator(lambda a, b: int(a != b)), ASTInferType(None)),
+    "print": TypedVar(lambda *a: print(*map(display, a)), ASTInferType(None)),
     "pdb": TypedVar(lambda: pdb.set_trace(), ASTInferType(None)),
 }
 
@@ -39,8 +71,16 @@ BUILTIN_TYPES = {
     "struct": TypedVar(Struct(), ASTInferType)
 }
 
-def build_builtin_env():
-    return Environment(parent=None, env={**BUILTIN_FUNCTIONS, **BUILTIN_TYPES})
+# operators can not be shadowed, they are called directly instead of being looked up
+OPERATOR_FUNCTIONS = {op: var.value for op, var in BUILTIN_FUNCTIONS.items()}
+
+BUILTIN_SCOPE = FunctionScope.from_names({**BUILTIN_FUNCTIONS, **BUILTIN_TYPES})
+
+def build_builtin_env() -> Frame:
+    frame = Frame(BUILTIN_SCOPE)
+    for name, var in {**BUILTIN_FUNCTIONS, **BUILTIN_TYPES}.items():
+        frame.set(name, var.value, var.typ)
+    return frame
 
 def run(ast):
 
@@ -51,15 +91,19 @@ def run(ast):
     else:
         raise ValueError(f"Expecting an ASTModule, got {type(ast)}")
 
-def interpret_module(node: ASTModule, env: Environment):
-    interpret_block(node.value, env)
+def interpret_module(node: ASTModule, builtin_env: Frame) -> Frame:
+    """Run a module, returns the frame holding its variables"""
+    resolve_module(node, BUILTIN_SCOPE)
+    module_frame = Frame(node.scope)
+    interpret_block(node.value, (builtin_env, module_frame))
+    return module_frame
 
-def interpret_block(node: ASTBlock, env: Environment) -> ASTNumber | ASTStructValue | ASTNoReturn:
+def interpret_block(node: ASTBlock, frames: tuple[Frame, ...]) -> ASTNumber | StructValue | ASTNoReturn:
     if len(node.value) == 0:
         raise ValueError("Unexpected empty block")
     res = ASTNoReturn(None)
     for statement in node.value:
-        res = interpret_statement(statement, env)
+        res = interpret_statement(statement, frames)
     return res
 
 def is_mutable(typ):
@@ -76,226 +120,353 @@ def is_mutable(typ):
         case _:
             raise NotImplementedError(f"Checking mutability not implemented for {typ}")
 
-def interpret_statement(node: ASTStatement, env: Environment) -> ASTNumber | ASTStructValue | ASTNoReturn:
+def lookup(ident: ASTIdentifier, frames: tuple[Frame, ...]) -> tuple[Frame, int]:
+    """Frame and slot of a declared variable"""
+    if ident.address is None:
+        raise RuntimeError(f"Unknown {ident.value} in env")
+    depth, slot = ident.address
+    frame = frames[depth]
+    if frame.values[slot] is UNBOUND:
+        raise RuntimeError(f"Unknown {ident.value} in env")
+    return frame, slot
+
+def interpret_statement(node: ASTStatement, frames: tuple[Frame, ...]) -> ASTNumber | StructValue | ASTNoReturn:
     match node.value:
         case ASTExpression(value):
-            return interpret_expression(value, env)
+            return interpret_expression(value, frames)
         case ASTAssignment((lvalue, rvalue)):
             if not isinstance(lvalue, ASTIdentifier):
                 raise NotImplementedError(f"Assignement to {type(lvalue)} is not implemented")
-            var_typ = env.get_typ(lvalue.value)
+            frame, slot = lookup(lvalue, frames)
+            var_typ = frame.types[slot]
             # check that the type is mutable, or not initialized yet
-            if not isinstance(env.get(lvalue.value), ASTUninitValue) and not is_mutable(var_typ):
+            if not isinstance(frame.values[slot], ASTUninitValue) and not is_mutable(var_typ):
                 raise ValueError(f"Trying to assign to an immutable value {lvalue} with immutable type {type(var_typ)}, consider adding Mut")
-            rvalue = interpret_expression(rvalue, env)
+            rvalue = interpret_expression(rvalue, frames)
             rvalue = var_typ.cast(rvalue)
-            env.update(lvalue.value, rvalue)
+            if isinstance(rvalue, ASTFunctionDeclare) and lvalue.value in MEMOIZE_OVERRIDES:
+                rvalue.memoize = MEMOIZE_OVERRIDES[lvalue.value]
+            frame.values[slot] = rvalue
             return ASTNoReturn(None)
         case ASTVarDeclaration(var_name, var_type, rvalue):
             assert isinstance(var_name, ASTIdentifier), type(var_name)
             if isinstance(var_type, ASTInferType):
                 raise NotImplementedError("Type inference not implemented yet")
-            var_type = interpret_typ(var_type, env)
+            var_type = interpret_typ(var_type, frames)
             if not isinstance(rvalue, ASTUninitValue):
-                rvalue = interpret_expression(rvalue, env)
+                rvalue = interpret_expression(rvalue, frames)
                 rvalue = var_type.cast(rvalue)
-            env.set(var_name.value, rvalue, var_type)
+                if isinstance(rvalue, ASTFunctionDeclare) and var_name.value in MEMOIZE_OVERRIDES:
+                    rvalue.memoize = MEMOIZE_OVERRIDES[var_name.value]
+            depth, slot = var_name.address
+            if frames[depth].dependents:
+                frames[depth].rebind(slot)
+            frames[depth].values[slot] = rvalue
+            frames[depth].types[slot] = var_type
         # case ASTNamedBlock(block_name, block):
         #     return interpret_block(block, env)
         case ASTIfStatement(cond, true_branch, false_branch):
-            cond_res = interpret_expression(cond, env)
-            if not isinstance(cond_res, Number):
+            cond_res = interpret_expression(cond, frames)
+            if type(cond_res) is not int and not isinstance(cond_res, Number):
                 raise NotImplementedError(f"If condition only implemented for number values, not {type(cond_res)}")
-            block_env = Environment(parent=env)
-            if cond_res.value != 0:
-                return interpret_block(true_branch, block_env)
+            # the variables of the block have their own slots in the frame
+            if number_value(cond_res) != 0:
+                return interpret_block(true_branch, frames)
 
             if false_branch is not None:
-                return interpret_block(false_branch, block_env)
-        case ASTWhileStatement(cond, block):
-            cond_res = interpret_expression(cond, env)
-            if not isinstance(cond_res, Number):
+                return interpret_block(false_branch, frames)
+        case ASTWhileStatement(cond, block) as while_stmt:
+            cond_res = interpret_expression(cond, frames)
+            if type(cond_res) is not int and not isinstance(cond_res, Number):
                 raise NotImplementedError(f"While condition should resolve to a number, not {cond_res}")
-            while cond_res.value != 0:
-                interpret_block(block, env)
-                cond_res = interpret_expression(cond, env)
+            while number_value(cond_res) != 0:
+                interpret_block(block, frames)
+                if JIT_COMPILE and not while_stmt.jit_failed:
+                    while_stmt.backedge_count += 1
+                    if while_stmt.backedge_count == JIT_LOOP_THRESHOLD:
+                        jit_compile(JIT_ENGINE.compile_loop, while_stmt, frames)
+                    if while_stmt.jit_loop_call is not None and on_stack_replace(while_stmt, frames):
+                        break
+                cond_res = interpret_expression(cond, frames)
             return ASTNoReturn(None)
         case v:
             raise NotImplementedError(f"Interpret statement not implemented for {v}")
     return ASTNoReturn(None)
 
 
-def interpret_typ(node, env: Environment):
+def jit_compile(compile_method, node: ASTFunctionDeclare | ASTWhileStatement, *args):
+    """
+    Compile a hot function or loop, `compile_method(node, *args)`, in the background when the JIT engine has workers
+
+    The interpreter keeps running `node` until its compiled version is set.
+    """
+    if JIT_ENGINE.workers:
+        JIT_ENGINE.submit(compile_method if PROFILER is None else PROFILER.background_compile(compile_method), node, *args)
+        return
+
+    try:
+        t = time.perf_counter_ns()
+        if PROFILER is not None:
+            PROFILER.compile(JIT_ENGINE.run_compile, compile_method, node, *args)
+        else:
+            JIT_ENGINE.run_compile(compile_method, node, *args)
+        dt = time.perf_counter_ns() - t
+        logger.info("Compiled %s in %d ns", "func" if isinstance(node, ASTFunctionDeclare) else "loop", dt)
+    except Exception as err:
+        # any failure of the compiler falls back to the interpreter, like a compilation in the background
+        if DEBUG:
+            raise err
+        else:
+            logger.error(err, exc_info=True)
+        # do not retry every time
+        node.jit_failed = True
+
+
+def on_stack_replace(while_stmt: ASTWhileStatement, frames: tuple[Frame, ...]) -> bool:
+    """
+    Run the remaining iterations of a loop with compiled code, from the state reached by the interpreter
+
+    Returns False when the loop could not be run compiled, and the interpreter should continue.
+    """
+    loop_call = while_stmt.jit_loop_call
+    slots = []
+    values = []
+    for name in loop_call.live_vars:
+        depth, slot = while_stmt.bindings[name]
+        frame = frames[depth]
+        value = frame.values[slot]
+        if type(value) is not int or not isinstance(typ_without_mut(frame.types[slot]), U64):
+            return False
+        slots.append((frame, slot))
+        values.append(value)
+
+    results = loop_call(values) if PROFILER is None else PROFILER.osr(loop_call, values)
+    for (frame, slot), value in zip(slots, results):
+        frame.values[slot] = value
+    return True
+
+
+def interpret_typ(node, frames: tuple[Frame, ...]):
     match node:
         case ASTUninitValue(_):
             return node
         case ASTNoReturn(_):
             return node
         case ASTIdentifier(ident):
-            return env.get(ident)
+            frame, slot = lookup(node, frames)
+            return frame.values[slot]
         case Number(_):
             return node
         case ASTStructureType(fields):
             interp_fields = []
             for field in fields:
-                field_typ = interpret_typ(field.ident_type, env)
+                field_typ = interpret_typ(field.ident_type, frames)
                 interp_fields.append(ASTTypedIdent(field.ident, field_typ))
             
             return ASTStructureType(tuple(interp_fields))
 
         case ASTType(typ):
-            return interpret_typ(typ, env)
+            return interpret_typ(typ, frames)
         case ASTMut(typ):
-            return ASTMut(interpret_typ(typ, env))
+            return ASTMut(interpret_typ(typ, frames))
         case ASTFunctionType(arg_types, ret_type):
             arguments = []
             for arg in arg_types:
-                arguments.append(interpret_typ(arg, env))
-            ret = interpret_typ(ret_type, env)
+                arguments.append(interpret_typ(arg, frames))
+            ret = interpret_typ(ret_type, frames)
 
             return ASTFunctionType(tuple(arguments), ret)
         case _:
             raise NotImplementedError(f"Interp of type {node} not implemented")
         
 
-def interpret_expression(node: ASTExpression | ASTNumber | ASTBinaryOp, env: Environment) -> Number | ASTStructValue | ASTFunctionDeclare | ASTNoReturn:
+def interpret_expression(node: ASTExpression | ASTNumber | ASTBinaryOp, frames: tuple[Frame, ...]) -> Number | StructValue | ASTFunctionDeclare | ASTNoReturn:
     match node:
         case ASTNumber(val):
-            return Number(val)
+            # materialized by the resolver
+            return node.literal if node.literal is not None else Number(val)
         case ASTIdentifier(ident):
-            return env.get(ident)
+            frame, slot = lookup(node, frames)
+            return frame.values[slot]
         case ASTBinaryOp(a, op, b):
-            val_a = interpret_expression(a, env)
-            val_b = interpret_expression(b, env)
-            val_op = op.value
-            op_func = env.get(val_op)
-            f_ret = interpret_func_call(op_func, (val_a, val_b), env)
+            val_a = interpret_expression(a, frames)
+            val_b = interpret_expression(b, frames)
+            op_func = OPERATOR_FUNCTIONS[op.value]
+            f_ret = op_func(val_a, val_b)
             if isinstance(f_ret, ASTNoReturn):
                 raise NotImplementedError()
             return f_ret
         case ASTFunctionDeclare(arguments, ret_typ, body):
             interp_args = []
             for arg in arguments:
-                ident_typ = interpret_typ(arg.ident_type, env)
+                ident_typ = interpret_typ(arg.ident_type, frames)
                 interp_args.append(ASTTypedIdent(arg.ident, ident_typ))
             
-            interp_return_typ = interpret_typ(ret_typ, env)
+            interp_return_typ = interpret_typ(ret_typ, frames)
         
             # TODO: when astnodes and interpreter values are differnt replace with the internal function value
-            return ASTFunctionDeclare(tuple(interp_args), interp_return_typ, body)
+            return ASTFunctionDeclare(tuple(interp_args), interp_return_typ, body, scope=node.scope, closure=frames)
     
         case ASTFunctionCall(func_name, arguments):
-            arg_values = [interpret_expression(arg, env) for arg in arguments]
-            func = env.get(func_name.value)
-            f_ret = interpret_func_call(func, arg_values, env)
+            arg_values = [interpret_expression(arg, frames) for arg in arguments]
+            frame, slot = lookup(func_name, frames)
+            func = frame.values[slot]
+            if PROFILER is not None:
+                f_ret = PROFILER.call(func_name.value, interpret_func_call, func, arg_values, frames)
+            else:
+                f_ret = interpret_func_call(func, arg_values, frames)
             if f_ret == ASTNoReturn(None):
                 return ASTNoReturn(None)
             return f_ret
         case ASTStructValue(fields):
-            interp_fields = list()
-            for field in fields:
-                field_value = interpret_expression(field.value, env)
-                interp_fields.append(ASTStructMember(field.ident, field_value))
-            return ASTStructValue(tuple(interp_fields))
+            return StructValue(node.shape, tuple(interpret_expression(field.value, frames) for field in fields))
 
         case ASTFieldLookup(obj, field_name):
-            struct = interpret_expression(obj, env)
-            if not isinstance(struct, ASTStructValue):
+            struct = interpret_expression(obj, frames)
+            if not isinstance(struct, StructValue):
                 raise RuntimeError(f"Attempting to access field of a {type(obj)}, when a struct was expected")
-            
-            for field in struct.fields:
-                if field.ident.value == field_name.value:
-                    if isinstance(field.value, ASTExpression):
-                        raise ValueError("Unevaluated struct field value")
-                    field_value = field.value
-                    break
-            else:
+            idx = struct.shape.index.get(field_name.value)
+            if idx is None:
                 raise ValueError(f"Field {field_name} does not exist for struct")
-            return field_value
+            return struct.values[idx]
 
     
     if not isinstance(node, ASTExpression):
         raise ValueError(f"Unexpected expression {type(node)}")
 
-    return interpret_expression(node.value, env)
+    return interpret_expression(node.value, frames)
 
-def interpret_func_call(func: Callable | ASTFunctionDeclare, arguments, env: Environment, force_intepret=False) -> ASTNumber | ASTStructValue | ASTNoReturn:
+def interpret_func_call(func: Callable | ASTFunctionDeclare, arguments, frames: tuple[Frame, ...], force_intepret=False) -> ASTNumber | StructValue | ASTNoReturn:
     if callable(func):
         return func(*arguments)
 
     assert isinstance(func, ASTFunctionDeclare), type(func)
 
-    if not force_intepret and JIT_COMPILE and func.jit_function_call is None:
-        try:
-            t = time.perf_counter_ns()
-            JIT_ENGINE.compile_function(func, env)
-            dt = time.perf_counter_ns() - t
-            logger.info("Compiled func in %d ns", dt)
-        except NotImplementedError as err:
-            if DEBUG:
-                raise err
-            else:
-                logger.error(err, exc_info=True)
+    if MEMOIZE and not force_intepret and len(func.arguments) == len(arguments):
+        cache = memo_cache(func)
+        if cache is not None:
+            return cache.call(memo_key(func, arguments), lambda: call_function(func, arguments, frames))
+    return call_function(func, arguments, frames, force_intepret)
+
+
+def call_function(func: ASTFunctionDeclare, arguments, frames: tuple[Frame, ...], force_intepret=False) -> ASTNumber | StructValue | ASTNoReturn:
+    """Call of `func`, jitted when it is compiled, without memoization"""
+    if not force_intepret and JIT_COMPILE and func.jit_function_call is None and not func.jit_failed:
+        func.call_count += 1
+        if func.call_count == JIT_CALL_THRESHOLD:
+            jit_compile(JIT_ENGINE.compile_function, func)
 
     if not force_intepret and func.jit_function_call is not None:
-        if SHADOW_JIT:
-            t = time.perf_counter_ns()
-            interp_res = interpret_func_call(func, arguments, env, force_intepret=True)
-            dt = time.perf_counter_ns() - t
-            logger.info("Intepreted func in %d ns", dt)
-            try:
-                t = time.perf_counter_ns()
-                jit_res = func.jit_function_call(*arguments)
-                dt = time.perf_counter_ns() - t
-                logger.info("Run jitted func in %d ns", dt)
-                if interp_res != jit_res:
-                    print(f"Jit and interp got different results: jit({jit_res}), interp({interp_res})")
-                return jit_res
-            except JITValuError:
-                logger.info("Failed to call jitted function")
-        else:
-            try:
-                return func.jit_function_call(*arguments)
-            except JITValuError:
-                logger.info("Failed to call jitted function")
+        jit_call = func.jit_function_call
+        verify = VERIFIER.should_verify(jit_call)
+        if PROFILER is not None:
+            PROFILER.ran("verified" if verify else "jit")
+        try:
+            if not verify:
+                return jit_call(*arguments)
+            res, matched = VERIFIER.verify(jit_call, arguments, lambda: interpret_func_call(func, arguments, frames, force_intepret=True))
+            if not matched:
+                logger.warning("Jitted %s returned a different result than the interpreter, interpreting it from now on", jit_call.function_label)
+                func.jit_function_call = None
+                func.jit_failed = True
+            return res
+        except JITValuError:
+            logger.info("Failed to call jitted function")
 
     if len(func.arguments) != len(arguments):
         raise RuntimeError(f"Wrong number of arguments, got {len(arguments)}, expected {len(func.arguments)}")
-    new_env = Environment(parent=env)
+    # functions see the frames of where they are declared, not the ones of the caller
+    frame = Frame(func.scope)
     for arg_type, call_argument in zip(func.arguments, arguments):
         # TODO: check that the types of the arguments passed to the function match the ones of the function type definition
         call_argument = arg_type.ident_type.cast(call_argument)
-        new_env.set(arg_type.ident.value, call_argument, arg_type.ident_type)
-    res = interpret_block(func.body, new_env)
+        depth, slot = arg_type.ident.address
+        frame.values[slot] = call_argument
+        frame.types[slot] = arg_type.ident_type
+    res = interpret_block(func.body, (*func.closure, frame))
     return func.return_type.cast(res)
 
 
 if __name__ == "__main__":
     import argparse
+    import json
     from pathlib import Path
     import sys
     import pdb
     import traceback
 
-    from src.lark_parser import initialize_parser
+    from src.lark_parser import AST_CACHE_DIR, parse_source
+    from src.optimizer import DEFAULT_PASSES, PASSES
 
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("--input-file", type=Path, required=True)
     arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent / "grammar.lark")
     arg_parser.add_argument("--jit-compile", action="store_true")
+    arg_parser.add_argument("--jit-backend", choices=JITEngine.backends, default="native")
+    arg_parser.add_argument("--jit-workers", type=int, default=1, help="threads compiling in the background, 0 to compile synchronously")
+    arg_parser.add_argument("--jit-call-threshold", type=int, default=JIT_CALL_THRESHOLD, help="calls before a function is compiled")
+    arg_parser.add_argument("--jit-loop-threshold", type=int, default=JIT_LOOP_THRESHOLD, help="loop iterations before a running loop switches to compiled code")
+    arg_parser.add_argument("--jit-passes", nargs="*", choices=PASSES, default=DEFAULT_PASSES, help="optimization passes run on the compiled code, in order")
+    arg_parser.add_argument("--verify", choices=VERIFY_MODES, default=VERIFIER.mode, help="jitted calls also interpreted to check their results")
+    arg_parser.add_argument("--verify-sample-rate", type=int, default=VERIFIER.sample_rate, help="with --verify sampled, 1 in N jitted calls is verified")
+    arg_parser.add_argument("--verify-time-budget", type=float, help="with --verify sampled, fraction of the run time that can be spent verifying")
+    arg_parser.add_argument("--verify-report", type=Path, help="write the verification report, with the mismatches, to this JSON file")
+    arg_parser.add_argument("--no-memoize", nargs="*", metavar="NAME", help="do not cache the results of these functions, of any function without names")
+    arg_parser.add_argument("--memoize", nargs="+", metavar="NAME", default=[], help="cache the results of these functions, even when they are not found pure")
+    arg_parser.add_argument("--bytecode", action="store_true", help="run with the bytecode VM, implied for .jbc input files")
+    arg_parser.add_argument("--no-ast-cache", action="store_true", help="parse the input file even when its syntax tree is cached")
+    arg_parser.add_argument("--profile", action="store_true", help="report the calls and the time spent in each function, tree walking interpreter only")
+    arg_parser.add_argument("--profile-output", type=Path, help="collapsed stacks of the profile, for flamegraph tools, defaults to <input file name>.folded")
     arg_parser.add_argument("--debug", action="store_true")
 
     args = arg_parser.parse_args()
+    if args.profile and (args.input_file.suffix == ".jbc" or args.bytecode):
+        arg_parser.error("--profile is only supported by the tree walking interpreter")
 
     JIT_COMPILE = args.jit_compile
-    JIT_ENGINE = JITEngine(compilation_dir=".jil_cache")
-
-    parser, ast_builder = initialize_parser(args.grammar_definition)
-
-    res = parser.parse(Path(args.input_file).read_text())
+    JIT_CALL_THRESHOLD = args.jit_call_threshold
+    JIT_LOOP_THRESHOLD = args.jit_loop_threshold
+    VERIFIER = Verifier(args.verify, args.verify_sample_rate, args.verify_time_budget)
+    JIT_ENGINE = JITEngine(compilation_dir=".jil_cache", backend=args.jit_backend, workers=args.jit_workers, passes=args.jit_passes)
+    ast_cache_dir = None if args.no_ast_cache else AST_CACHE_DIR
+    MEMOIZE = args.no_memoize != []
+    MEMOIZE_OVERRIDES = {**{name: True for name in args.memoize}, **{name: False for name in args.no_memoize or ()}}
+
+    if args.input_file.suffix == ".jbc" or args.bytecode:
+        from src import bytecode
+
+        if args.input_file.suffix == ".jbc":
+            module_code = bytecode.load(args.input_file)
+        else:
+            module_code = bytecode.compile_module(parse_source(Path(args.input_file).read_text(), args.grammar_definition, ast_cache_dir))
+        vm = bytecode.VM(jit_engine=JIT_ENGINE if JIT_COMPILE else None, jit_call_threshold=JIT_CALL_THRESHOLD, memoize=MEMOIZE)
+        execute = lambda: vm.run(module_code, build_builtin_env())
+    else:
+        res = parse_source(Path(args.input_file).read_text(), args.grammar_definition, ast_cache_dir)
+        execute = lambda: run(res)
+        if args.profile:
+            from src.profiler import Profiler
+            PROFILER = Profiler()
 
     try:
-        run(res)
+        execute()
+        memoized = memo_summary()
+        if memoized["functions"]:
+            logger.info("Memoized functions: %s", memoized)
+        if JIT_COMPILE:
+            JIT_ENGINE.shutdown()
+            logger.info("JIT cache: %s", JIT_ENGINE.cache_stats)
+            logger.info("JIT compilations: %s", JIT_ENGINE.metrics.summary())
+            verification = VERIFIER.report()
+            if verification["jit_calls"]:
+                logger.info("JIT verification: %d of %d jitted calls verified, %d mismatches", verification["verified_calls"], verification["jit_calls"], verification["mismatch_count"])
+            if args.verify_report:
+                args.verify_report.write_text(json.dumps(verification, indent=2) + "\n")
+        if PROFILER is not None:
+            PROFILER.finish()
+            profile_output = args.profile_output or Path(args.input_file.with_suffix(".folded").name)
+            profile_output.write_text(PROFILER.collapsed_stacks())
+            logger.info("Profile, collapsed stacks in %s:\n%s", profile_output, PROFILER.report())
     except Exception:
         if args.debug:
             extype, value, tb = sys.exc_info()
@@ -0,0 +1,694 @@
+"""
+Mid level intermediate representation of the JIT, in SSA form
+
+A function is a list of basic blocks, each holding instructions and ending with a terminator (jump, branch
+or return). Every instruction defines one value, used directly as an operand by the other instructions:
+variables are renamed to the values assigned to them, phi instructions merge the values reaching a block
+from its predecessors. All values are u64, comparisons give 0 or 1: structs are split into a value per field
+(scalar replacement), their memory layout only matters when they are passed to or returned by compiled
+functions, see `StructLayout`. Calls of other compiled functions are the only instructions with side effects,
+they are never removed or moved.
+
+Functions are built from the resolved syntax tree (variables are identified by their (depth, slot) address)
+with the algorithm of Braun et al., "Simple and Efficient Construction of Static Single Assignment Form".
+`src.optimizer` transforms them, `src.compile` lowers them to assembly.
+"""
+from dataclasses import dataclass, field
+
+from src.ast_definition import *
+from src.runtime_values import U64, U64_MASK
+
+ARITHMETIC_OPS = ("+", "-", "*", "/", "<<", ">>")
+COMPARISONS = ("<", "<=", ">", ">=", "==", "!=")
+COMMUTATIVE_OPS = ("+", "*", "==", "!=")
+
+
+class IRError(NotImplementedError):
+    """The code uses a feature that can not be compiled"""
+
+
+@dataclass(frozen=True)
+class StructLayout:
+    """
+    Memory layout of a struct type: its fields in the order of the type, u64 fields take 8 bytes and nested
+    structs are inlined, so every field is at a constant offset and a struct is a sequence of u64 values
+    """
+    fields: tuple[tuple[str, "str | StructLayout"], ...]
+
+    @property
+    def size(self) -> int:
+        return sum(type_size(typ) for _, typ in self.fields)
+
+    def offset(self, name) -> int:
+        """Offset of the field `name`, in bytes"""
+        offset = 0
+        for field_name, typ in self.fields:
+            if field_name == name:
+                return offset
+            offset += type_size(typ)
+        raise KeyError(name)
+
+
+def type_size(typ: "str | StructLayout | None") -> int:
+    """Size in bytes of a value of a compiled type, "u64" or a StructLayout, 0 for None (nothing)"""
+    if typ is None:
+        return 0
+    return 8 if typ == "u64" else typ.size
+
+
+def layout_of(typ, frames=()) -> "str | StructLayout":
+    """
+    Compiled type of a type of the language: "u64" or a StructLayout
+
+    `typ` is resolved (the types of the function values), or the identifiers it refers to are read from `frames`.
+    """
+    match typ:
+        case ASTType(inner) | ASTMut(inner):
+            return layout_of(inner, frames)
+        case U64():
+            return "u64"
+        case ASTStructureType(fields):
+            if not fields:
+                raise IRError("Compiling empty struct is not implemented")
+            return StructLayout(tuple((field.ident.value, layout_of(field.ident_type, frames)) for field in fields))
+        case ASTIdentifier(name) if typ.address is not None and typ.address[0] < len(frames):
+            depth, slot = typ.address
+            value = frames[depth].values[slot]
+            if isinstance(value, (U64, ASTStructureType)) and not isinstance(frames[depth].types[slot], ASTMut):
+                return layout_of(value, frames)
+        case ASTIdentifier("u64"):
+            return "u64"
+    raise IRError(f"Compiling values of type {typ} is not implemented")
+
+
+@dataclass(frozen=True)
+class CallTarget:
+    """A compiled function called by the compiled code, with the compiled types of its arguments and result"""
+    label: str
+    arguments: tuple["str | StructLayout", ...]
+    # None when the function returns nothing
+    returns: "str | StructLayout | None"
+
+    @property
+    def argument_sizes(self) -> list[int]:
+        return [type_size(typ) for typ in self.arguments]
+
+    @property
+    def return_size(self) -> int:
+        return type_size(self.returns)
+
+
+@dataclass(eq=False)
+class Instruction:
+    # an operator of ARITHMETIC_OPS or COMPARISONS, or "const", "param", "phi", "call", "result"
+    op: str
+    args: list["Instruction"] = field(default_factory=list)
+    # literal of a const, index of a param, CallTarget of a call, index of the 8 bytes of the struct returned by the
+    # call of a result
+    value: int | CallTarget | None = None
+    # None for the calls of functions returning nothing or a struct, its values are results
+    typ: str | None = "u64"
+    block: "BasicBlock | None" = field(default=None, repr=False)
+
+    @property
+    def has_side_effects(self) -> bool:
+        return self.op == "call"
+
+    def __repr__(self) -> str:
+        return f"Instruction({self.op!r}, value={self.value!r})"
+
+
+@dataclass(eq=False)
+class Jump:
+    target: "BasicBlock"
+
+@dataclass(eq=False)
+class Branch:
+    cond: Instruction
+    if_true: "BasicBlock"
+    if_false: "BasicBlock"
+
+@dataclass(eq=False)
+class Return:
+    # the return value of a function, the final values of the live variables of a loop
+    values: list[Instruction]
+
+Terminator = Jump | Branch | Return
+
+
+@dataclass(eq=False)
+class Aggregate:
+    """Struct value of the code being built, each of its u64 fields is a value of its own"""
+    fields: dict[str, "Instruction | Aggregate"]
+
+    @property
+    def typ(self) -> StructLayout:
+        return StructLayout(tuple((name, value.typ) for name, value in self.fields.items()))
+
+    def leaves(self) -> list[Instruction]:
+        """The u64 values of the struct, in memory order"""
+        return [leaf for value in self.fields.values() for leaf in (value.leaves() if isinstance(value, Aggregate) else [value])]
+
+    @classmethod
+    def from_leaves(cls, layout: StructLayout, leaves) -> "Aggregate":
+        leaves = iter(leaves)
+        def build(layout):
+            return cls({name: build(typ) if isinstance(typ, StructLayout) else next(leaves) for name, typ in layout.fields})
+        return build(layout)
+
+
+def cast(value: "Instruction | Aggregate", typ, what) -> "Instruction | Aggregate":
+    """`value` as a value of the compiled type `typ`, the fields of a struct are reordered as in its type"""
+    if typ == "u64":
+        if not isinstance(value, Instruction):
+            raise IRError(f"Compiling {what}: a struct is used where an u64 is expected")
+        return value
+    if not isinstance(value, Aggregate) or set(value.fields) != {name for name, _ in typ.fields}:
+        raise IRError(f"Compiling {what}: the value does not match the struct type {typ}")
+    return Aggregate({name: cast(value.fields[name], field_typ, what) for name, field_typ in typ.fields})
+
+
+@dataclass(eq=False)
+class BasicBlock:
+    label: str
+    # phis first
+    instructions: list[Instruction] = field(default_factory=list)
+    terminator: Terminator | None = None
+    # the args of a phi are in the order of the predecessors
+    predecessors: list["BasicBlock"] = field(default_factory=list)
+
+    def __repr__(self) -> str:
+        return f"BasicBlock({self.label!r})"
+
+    @property
+    def successors(self) -> list["BasicBlock"]:
+        match self.terminator:
+            case Jump(target):
+                return [target]
+            case Branch(_, if_true, if_false):
+                return [if_true, if_false]
+        return []
+
+    @property
+    def phis(self) -> list[Instruction]:
+        return [instruction for instruction in self.instructions if instruction.op == "phi"]
+
+    def append(self, instruction: Instruction) -> Instruction:
+        instruction.block = self
+        self.instructions.append(instruction)
+        return instruction
+
+    def remove_predecessor(self, pred: "BasicBlock"):
+        idx = self.predecessors.index(pred)
+        del self.predecessors[idx]
+        for phi in self.phis:
+            del phi.args[idx]
+
+
+def terminator_args(terminator: Terminator) -> list[Instruction]:
+    match terminator:
+        case Branch(cond, _, _):
+            return [cond]
+        case Return(values):
+            return values
+    return []
+
+
+@dataclass(eq=False)
+class IRFunction:
+    name: str
+    params: list[Instruction] = field(default_factory=list)
+    blocks: list[BasicBlock] = field(default_factory=list)
+    # constants are defined once, at the start of the entry block
+    constants: dict[int, Instruction] = field(default_factory=dict)
+    label_counter: int = 0
+    # in bytes, of each argument, split in params of 8 bytes, and of the returned values (0 when there is none)
+    argument_sizes: list[int] = field(default_factory=list)
+    return_size: int = 8
+
+    @property
+    def entry(self) -> BasicBlock:
+        return self.blocks[0]
+
+    def new_block(self, prefix) -> BasicBlock:
+        self.label_counter += 1
+        block = BasicBlock(f"{prefix}_{self.label_counter}")
+        self.blocks.append(block)
+        return block
+
+    def constant(self, value: int) -> Instruction:
+        value &= U64_MASK
+        if value not in self.constants:
+            const = Instruction("const", value=value, block=self.entry)
+            self.entry.instructions.insert(0, const)
+            self.constants[value] = const
+        return self.constants[value]
+
+    def instructions(self):
+        for block in self.blocks:
+            yield from block.instructions
+
+    def replace_uses(self, old: Instruction, new: Instruction):
+        for block in self.blocks:
+            for instruction in block.instructions:
+                instruction.args = [new if arg is old else arg for arg in instruction.args]
+            match block.terminator:
+                case Branch(cond, _, _) if cond is old:
+                    block.terminator.cond = new
+                case Return(values):
+                    block.terminator.values = [new if value is old else value for value in values]
+
+    def remove(self, instruction: Instruction):
+        instruction.block.instructions.remove(instruction)
+        if instruction.op == "const":
+            del self.constants[instruction.value]
+
+    def uses(self) -> dict[Instruction, list[Instruction | BasicBlock]]:
+        """Users of each instruction, blocks for the terminators"""
+        users = {instruction: [] for instruction in self.instructions()}
+        for block in self.blocks:
+            for instruction in block.instructions:
+                for arg in instruction.args:
+                    users[arg].append(instruction)
+            for arg in terminator_args(block.terminator):
+                users[arg].append(block)
+        return users
+
+    def reverse_postorder(self) -> list[BasicBlock]:
+        """Blocks reachable from the entry, each before its successors except on back edges"""
+        order = []
+        visited = set()
+        def visit(block):
+            visited.add(block)
+            # the first successor ends up first, so the layout follows the source
+            for succ in reversed(block.successors):
+                if succ not in visited:
+                    visit(succ)
+            order.append(block)
+        visit(self.entry)
+        return order[::-1]
+
+    def remove_unreachable_blocks(self):
+        reachable = set(self.reverse_postorder())
+        for block in self.blocks:
+            if block not in reachable:
+                for succ in block.successors:
+                    if succ in reachable:
+                        succ.remove_predecessor(block)
+        self.blocks = [block for block in self.blocks if block in reachable]
+
+    def split_edge(self, pred: BasicBlock, succ: BasicBlock) -> BasicBlock:
+        """Insert an empty block on the edge from `pred` to `succ`"""
+        block = self.new_block("edge")
+        block.terminator = Jump(succ)
+        block.predecessors = [pred]
+        succ.predecessors[succ.predecessors.index(pred)] = block
+        match pred.terminator:
+            case Jump():
+                pred.terminator.target = block
+            case Branch(_, if_true, if_false):
+                if if_true is succ:
+                    pred.terminator.if_true = block
+                if if_false is succ:
+                    pred.terminator.if_false = block
+        return block
+
+    def dominators(self) -> dict[BasicBlock, BasicBlock]:
+        """
+        Immediate dominator of each reachable block, the entry is its own dominator
+
+        Cooper, Harvey and Kennedy, "A Simple, Fast Dominance Algorithm"
+        """
+        order = self.reverse_postorder()
+        index = {block: idx for idx, block in enumerate(order)}
+        idom = {self.entry: self.entry}
+
+        def intersect(a, b):
+            while a is not b:
+                while index[a] > index[b]:
+                    a = idom[a]
+                while index[b] > index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                preds = [pred for pred in block.predecessors if pred in idom]
+                new_idom = preds[0]
+                for pred in preds[1:]:
+                    new_idom = intersect(pred, new_idom)
+                if idom.get(block) is not new_idom:
+                    idom[block] = new_idom
+                    changed = True
+        return idom
+
+    def loops(self) -> list[tuple[BasicBlock, set[BasicBlock]]]:
+        """Natural loops, (header, blocks of the loop), innermost first"""
+        idom = self.dominators()
+        def dominates(a, b):
+            while b is not a and idom[b] is not b:
+                b = idom[b]
+            return b is a
+
+        loops = {}
+        for block in idom:
+            for succ in block.successors:
+                if dominates(succ, block):
+                    # back edge, the loop is everything reaching it without going through the header
+                    body = loops.setdefault(succ, {succ})
+                    worklist = [block]
+                    while worklist:
+                        current = worklist.pop()
+                        if current not in body:
+                            body.add(current)
+                            worklist.extend(current.predecessors)
+        return sorted(loops.items(), key=lambda loop: len(loop[1]))
+
+    def __str__(self) -> str:
+        names = {}
+        def name(instruction):
+            if instruction.op == "const":
+                return f"${instruction.value}"
+            return names.setdefault(instruction, f"%{len(names)}")
+
+        lines = [f"function {self.name}({', '.join(name(param) for param in self.params)}):"]
+        for block in self.blocks:
+            preds = ", ".join(pred.label for pred in block.predecessors)
+            lines.append(f"{block.label}:" + (f" # preds: {preds}" if preds else ""))
+            for instruction in block.instructions:
+                if instruction.op in ("const", "param"):
+                    continue
+                op = f"call {instruction.value.label}" if instruction.op == "call" else instruction.op
+                if instruction.op == "result":
+                    op = f"result {instruction.value}"
+                lines.append(f"    {name(instruction)} = {op} {', '.join(name(arg) for arg in instruction.args)}")
+            match block.terminator:
+                case Jump(target):
+                    lines.append(f"    jump {target.label}")
+                case Branch(cond, if_true, if_false):
+                    lines.append(f"    branch {name(cond)}, {if_true.label}, {if_false.label}")
+                case Return(values):
+                    lines.append(f"    return {', '.join(name(value) for value in values)}")
+        return "\n".join(lines)
+
+
+class IRBuilder:
+    """Builds the SSA form of a function body or of a loop, from its resolved syntax tree"""
+    def __init__(self, name, depth, callees=None, frames=()) -> None:
+        self.function = IRFunction(name)
+        # the functions that can be called, by the address of the variable holding them
+        self.callees: dict[tuple[int, int], CallTarget] = callees or {}
+        # depth of the frame of the compiled code, the variables of other frames are not accessible
+        self.depth = depth
+        # the frames below the compiled code, where the named types are read
+        self.frames = frames
+        # the variables holding structs, each field is a variable of its own, addressed by (depth, slot, index)
+        self.struct_layouts: dict[tuple[int, int], StructLayout] = {}
+        self.current_defs: dict[tuple[int, int], dict[BasicBlock, Instruction]] = {}
+        self.sealed: set[BasicBlock] = set()
+        self.incomplete_phis: dict[BasicBlock, dict[tuple[int, int], Instruction]] = {}
+        # the value replacing each removed trivial phi, the values read before a removal may still refer to it
+        self.replaced_phis: dict[Instruction, Instruction] = {}
+        # for the error messages
+        self.names: dict[tuple[int, int], str] = {}
+        # the variables of other frames a loop is compiled with
+        self.param_addresses: set[tuple[int, int]] = set()
+        self.block = self.function.new_block("entry")
+        self.sealed.add(self.block)
+
+    def add_param(self, address, name) -> Instruction:
+        self.names[address] = name
+        self.param_addresses.add(address)
+        param = self.block.append(Instruction("param", value=len(self.function.params)))
+        self.function.params.append(param)
+        self.write_variable(address, self.block, param)
+        return param
+
+    def write_variable(self, address, block, value):
+        self.current_defs.setdefault(address, {})[block] = value
+
+    def write_value(self, address, name, block, value: "Instruction | Aggregate"):
+        self.names[address] = name
+        if isinstance(value, Aggregate):
+            self.struct_layouts[address] = value.typ
+            for idx, leaf in enumerate(value.leaves()):
+                self.names[(*address, idx)] = name
+                self.write_variable((*address, idx), block, leaf)
+        else:
+            self.write_variable(address, block, value)
+
+    def read_variable(self, ident: ASTIdentifier, block) -> "Instruction | Aggregate":
+        if ident.address is None or (ident.address[0] != self.depth and ident.address not in self.param_addresses):
+            raise IRError(f"Compiling access to {ident.value}, declared outside of the compiled code, is not implemented")
+        self.names.setdefault(ident.address, ident.value)
+        if ident.address in self.struct_layouts:
+            layout = self.struct_layouts[ident.address]
+            return Aggregate.from_leaves(layout, [self.read_address((*ident.address, idx), block) for idx in range(layout.size // 8)])
+        return self.read_address(ident.address, block)
+
+    def resolve(self, value: Instruction) -> Instruction:
+        """`value`, or the value that replaced it if it is a removed phi"""
+        while value in self.replaced_phis:
+            value = self.replaced_phis[value]
+        return value
+
+    def read_address(self, address, block) -> Instruction:
+        if block in self.current_defs.get(address, {}):
+            return self.resolve(self.current_defs[address][block])
+        if block not in self.sealed:
+            # the predecessors are not all known yet, the operands are added when the block is sealed
+            value = self.new_phi(block)
+            self.incomplete_phis.setdefault(block, {})[address] = value
+        elif len(block.predecessors) == 1:
+            value = self.read_address(address, block.predecessors[0])
+        elif not block.predecessors:
+            raise IRError(f"Compiling access to {self.names[address]}, not set before the compiled code, is not implemented")
+        else:
+            value = self.new_phi(block)
+            # breaks the cycles of loops
+            self.write_variable(address, block, value)
+            value = self.add_phi_operands(address, value)
+        # reading the operands of a phi can remove the phis read before
+        value = self.resolve(value)
+        self.write_variable(address, block, value)
+        return value
+
+    def new_phi(self, block) -> Instruction:
+        phi = Instruction("phi", block=block)
+        block.instructions.insert(len(block.phis), phi)
+        return phi
+
+    def add_phi_operands(self, address, phi: Instruction) -> Instruction:
+        args = [self.read_address(address, pred) for pred in phi.block.predecessors]
+        # the operands read first are not in the function yet when the next ones remove trivial phis
+        phi.args = [self.resolve(arg) for arg in args]
+        return self.remove_trivial_phi(phi)
+
+    def remove_trivial_phi(self, phi: Instruction) -> Instruction:
+        """A phi merging a single value (and itself) is replaced by that value"""
+        others = {id(arg): arg for arg in phi.args if arg is not phi}
+        if len(others) > 1:
+            return phi
+        if not others:
+            raise IRError("Compiling access to a variable that is never set is not implemented")
+        same, = others.values()
+        users = [user for user in self.function.instructions() if phi in user.args and user is not phi]
+        self.function.replace_uses(phi, same)
+        phi.block.instructions.remove(phi)
+        self.replaced_phis[phi] = same
+        for defs in self.current_defs.values():
+            for block, value in defs.items():
+                if value is phi:
+                    defs[block] = same
+        for user in users:
+            if user.op == "phi" and user not in self.replaced_phis:
+                self.remove_trivial_phi(user)
+        # `same` can be one of the users, removed in turn
+        return self.resolve(same)
+
+    def seal_block(self, block):
+        for address, phi in self.incomplete_phis.pop(block, {}).items():
+            self.add_phi_operands(address, phi)
+        self.sealed.add(block)
+
+    def jump(self, target: BasicBlock):
+        self.block.terminator = Jump(target)
+        target.predecessors.append(self.block)
+
+    def branch(self, cond: Instruction, if_true: BasicBlock, if_false: BasicBlock):
+        self.block.terminator = Branch(cond, if_true, if_false)
+        if_true.predecessors.append(self.block)
+        if_false.predecessors.append(self.block)
+
+    def build_block(self, block: ASTBlock) -> Instruction | None:
+        """Build the statements of `block`, returns the value of the last one"""
+        value = None
+        for statement in block.value:
+            value = self.build_statement(statement)
+        return value
+
+    def build_statement(self, stmt: ASTStatement) -> Instruction | None:
+        match stmt.value:
+            case ASTExpression(value):
+                value = self.build_expression(value)
+                return value if value.typ is not None else None
+            case ASTVarDeclaration(ident, var_type, rvalue):
+                if isinstance(var_type, ASTFunctionType):
+                    raise IRError("Compiling inner functions is not supported yet")
+                typ = layout_of(var_type, self.frames)
+                if isinstance(rvalue, ASTUninitValue):
+                    raise IRError(f"Compiling declaration of {ident.value} without a value is not implemented")
+                self.write_value(ident.address, ident.value, self.block, cast(self.build_value(rvalue), typ, f"declaration of {ident.value}"))
+            case ASTAssignment((lvalue, rvalue)):
+                if not isinstance(lvalue, ASTIdentifier):
+                    raise IRError(f"Compiling assignement to {lvalue} not implemented")
+                # the variable has to be declared in the compiled code
+                current = self.read_variable(lvalue, self.block)
+                self.write_value(lvalue.address, lvalue.value, self.block, cast(self.build_value(rvalue), current.typ, f"assignment of {lvalue.value}"))
+            case ASTIfStatement(cond, if_block, else_block):
+                return self.build_if(cond, if_block, else_block)
+            case ASTWhileStatement(cond, block):
+                self.build_while(cond, block)
+            case v:
+                raise IRError(f"Compilation not implemented for {v}")
+        return None
+
+    def build_if(self, cond, if_block, else_block) -> "Instruction | Aggregate | None":
+        cond = self.build_scalar(cond, "if condition")
+        then_block = self.function.new_block("if_true")
+        else_entry = self.function.new_block("if_false")
+        join = self.function.new_block("end_if")
+        self.branch(cond, then_block, else_entry)
+        self.sealed.update((then_block, else_entry))
+
+        self.block = then_block
+        then_value = self.build_block(if_block)
+        self.jump(join)
+        self.block = else_entry
+        else_value = self.build_block(else_block) if else_block is not None else None
+        self.jump(join)
+
+        self.seal_block(join)
+        self.block = join
+        if then_value is None or else_value is None:
+            return None
+        # the value of the if statement
+        return self.merge(join, then_value, cast(else_value, then_value.typ, "if statement value"))
+
+    def merge(self, join, then_value, else_value) -> "Instruction | Aggregate":
+        if isinstance(then_value, Aggregate):
+            return Aggregate({name: self.merge(join, value, else_value.fields[name]) for name, value in then_value.fields.items()})
+        phi = self.new_phi(join)
+        phi.args = [self.resolve(then_value), self.resolve(else_value)]
+        return self.remove_trivial_phi(phi)
+
+    def build_while(self, cond, block):
+        # rotated loop: the condition is checked before entering the loop and at the end of each iteration
+        body = self.function.new_block("while")
+        exit_block = self.function.new_block("end_while")
+        self.branch(self.build_scalar(cond, "while condition"), body, exit_block)
+
+        self.block = body
+        self.build_block(block)
+        self.branch(self.build_scalar(cond, "while condition"), body, exit_block)
+        self.seal_block(body)
+        self.seal_block(exit_block)
+        self.block = exit_block
+
+    def build_value(self, exp) -> "Instruction | Aggregate":
+        """Build an expression whose value is used"""
+        value = self.build_expression(exp)
+        if value.typ is None:
+            raise IRError("Compiling use of the result of a function returning nothing is not implemented")
+        return value
+
+    def build_scalar(self, exp, what) -> Instruction:
+        return cast(self.build_value(exp), "u64", what)
+
+    def build_expression(self, exp) -> "Instruction | Aggregate":
+        match exp:
+            case ASTExpression(inner):
+                return self.build_expression(inner)
+            case ASTNumber(val):
+                return self.function.constant(val)
+            case ASTIdentifier():
+                return self.read_variable(exp, self.block)
+            case ASTBinaryOp(a, op, b):
+                if op.value not in ARITHMETIC_OPS and op.value not in COMPARISONS:
+                    raise IRError(f"Operation compilation not implemented for {op.value}")
+                a = self.build_scalar(a, f"operation {op.value}")
+                b = self.build_scalar(b, f"operation {op.value}")
+                return self.block.append(Instruction(op.value, [a, b]))
+            case ASTFunctionCall(func_name, arguments):
+                target = self.callees.get(func_name.address)
+                if target is None:
+                    raise IRError(f"Compiling call of {func_name.value} is not implemented")
+                if len(arguments) != len(target.arguments):
+                    raise IRError(f"Compiling call of {func_name.value} with {len(arguments)} arguments, expected {len(target.arguments)}")
+                args = []
+                for arg, typ in zip(arguments, target.arguments):
+                    value = cast(self.build_value(arg), typ, f"call of {func_name.value}")
+                    args.extend(value.leaves() if isinstance(value, Aggregate) else [value])
+                call = self.block.append(Instruction("call", args, value=target, typ="u64" if target.returns == "u64" else None))
+                if isinstance(target.returns, StructLayout):
+                    results = [self.block.append(Instruction("result", [call], value=idx)) for idx in range(target.return_size // 8)]
+                    return Aggregate.from_leaves(target.returns, results)
+                return call
+            case ASTStructValue(fields):
+                values = {}
+                for field in fields:
+                    if field.ident.value in values:
+                        raise IRError(f"Compiling struct with the field {field.ident.value} twice is not implemented")
+                    values[field.ident.value] = self.build_value(field.value)
+                if not values:
+                    raise IRError("Compiling empty struct is not implemented")
+                return Aggregate(values)
+            case ASTFieldLookup(obj, field_name):
+                struct = self.build_value(obj)
+                if not isinstance(struct, Aggregate) or field_name.value not in struct.fields:
+                    raise IRError(f"Compiling access to the field {field_name.value} of a value without it is not implemented")
+                return struct.fields[field_name.value]
+            case o:
+                raise IRError(f"Compilation of {type(o)} not implemented yet")
+
+
+def build_function(func: ASTFunctionDeclare, name: str, callees=None) -> IRFunction:
+    """
+    SSA form of a function taking and returning u64 values and structs, `callees` are the functions it can call by address
+
+    The fields of struct arguments are params of their own, a returned struct is returned as the values of its fields.
+    """
+    builder = IRBuilder(name, func.scope.depth, callees, func.closure)
+    for arg in func.arguments:
+        typ = layout_of(arg.ident_type, func.closure)
+        if isinstance(typ, StructLayout):
+            params = [builder.add_param((*arg.ident.address, idx), arg.ident.value) for idx in range(typ.size // 8)]
+            builder.write_value(arg.ident.address, arg.ident.value, builder.block, Aggregate.from_leaves(typ, params))
+        else:
+            builder.add_param(arg.ident.address, arg.ident.value)
+        builder.function.argument_sizes.append(type_size(typ))
+    value = builder.build_block(func.body)
+    if isinstance(func.return_type, ASTNoReturn):
+        builder.function.return_size = 0
+        builder.block.terminator = Return([])
+    elif value is None:
+        raise IRError("Compiling function without a return value is not implemented")
+    else:
+        typ = layout_of(func.return_type, func.closure)
+        value = cast(value, typ, "return value")
+        builder.function.return_size = type_size(typ)
+        builder.block.terminator = Return(value.leaves() if isinstance(value, Aggregate) else [value])
+    return builder.function
+
+
+def build_loop(while_stmt: ASTWhileStatement, live_vars, depth, name: str, callees=None, frames=()) -> IRFunction:
+    """SSA form of a loop for on stack replacement, taking and returning the values of its live u64 variables"""
+    builder = IRBuilder(name, depth, callees, frames)
+    live_addresses = [while_stmt.bindings[var] for var in live_vars]
+    for var, address in zip(live_vars, live_addresses):
+        builder.add_param(address, var)
+    builder.build_while(while_stmt.cond, while_stmt.block)
+    builder.block.terminator = Return([builder.read_address(address, builder.block) for address in live_addresses])
+    return builder.function
@@ -1,5 +1,7 @@
 
 BINARY_OP_FUNC_PATTERN = """
+.global {label}
+.type {label}, @function
 {label}:
     # enter
     pushq %rbp
@@ -15,6 +17,8 @@ BINARY_OP_FUNC_PATTERN = """
 """
 
 FACTOR_FUNC_PATTERN = """
+.global {label}
+.type {label}, @function
 {label}:
     # enter
     pushq %rbp
@@ -31,6 +35,8 @@ FACTOR_FUNC_PATTERN = """
 """
 
 COMP_FUNC_PATTERN = """
+.global {label}
+.type {label}, @function
 {label}:
     # enter
     pushq %rbp
@@ -38,7 +44,7 @@ COMP_FUNC_PATTERN = """
 
     xor %rax, %rax
     cmp %rsi, %rdi # rdi - rsi
-    {op} %al # signed integers comparison
+    {op} %al # unsigned integers comparison
 
     # leave
     movq %rbp, %rsp
@@ -52,10 +58,10 @@ SUB_FUNC = BINARY_OP_FUNC_PATTERN.format(label="sub", op="subq")
 MUL_FUNC = FACTOR_FUNC_PATTERN.format(label="mul", op="mulq")
 DIV_FUNC = FACTOR_FUNC_PATTERN.format(label="div", op="divq")
 
-GT_FUNC = COMP_FUNC_PATTERN.format(label="gt", op="setg") # use a/b (above/below) instead of g/l for unsigned
-LT_FUNC = COMP_FUNC_PATTERN.format(label="lt", op="setl")
-GTE_FUNC = COMP_FUNC_PATTERN.format(label="gte", op="setge")
-LTE_FUNC = COMP_FUNC_PATTERN.format(label="lte", op="setle")
+GT_FUNC = COMP_FUNC_PATTERN.format(label="gt", op="seta")
+LT_FUNC = COMP_FUNC_PATTERN.format(label="lt", op="setb")
+GTE_FUNC = COMP_FUNC_PATTERN.format(label="gte", op="setae")
+LTE_FUNC = COMP_FUNC_PATTERN.format(label="lte", op="setbe")
 EQ_FUNC = COMP_FUNC_PATTERN.format(label="eq", op="sete") 
 NEQ_FUNC = COMP_FUNC_PATTERN.format(label="neq", op="setne") 
 
@@ -1,33 +1,128 @@
 import argparse
+import functools
+import hashlib
+import logging
+import os
 from pathlib import Path
+import pickle
+import zlib
 
 import lark
 
-from src.ast_definition import ASTBuilder, BlockIndenter
+from src import ast_definition
+from src.ast_definition import ASTBuilder, ASTModule, BlockIndenter
 
+logger = logging.getLogger(__name__)
 
-def initialize_parser(grammar_file: Path):
+# built parsers are saved next to the compiled python files, None to always build the parser
+PARSER_CACHE_DIR = Path(__file__).absolute().parent / "__pycache__"
+# syntax trees of the parsed files, next to the jit cache
+AST_CACHE_DIR = Path(".jil_cache") / "ast"
+# part of the key of the cached syntax trees, along with the source of the AST classes and the grammar
+AST_CACHE_VERSION = 1
+
+
+def parser_cache_file(grammar_file: Path, cache_dir: Path) -> Path:
+    """
+    File of the built parser of `grammar_file`, keyed by the grammar content and the lark version
+
+    lark checks the hash of the grammar and of the options stored in the file before loading it and rebuilds
+    the parser when they changed, the key only keeps the parsers of different grammars apart.
+    """
+    grammar_hash = hashlib.sha256(grammar_file.read_bytes()).hexdigest()[:16]
+    return Path(cache_dir) / f"{grammar_file.stem}.{grammar_hash}.lark-{lark.__version__}.cache"
+
+
+def initialize_parser(grammar_file: Path, cache_dir: Path | None = PARSER_CACHE_DIR):
     ast_builder = ASTBuilder()
+    grammar_file = Path(__file__).parent / grammar_file
+    cache_file = False
+    if cache_dir is not None:
+        try:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            cache_file = str(parser_cache_file(grammar_file, cache_dir))
+        except OSError:
+            # read only install, the parser is built each time
+            pass
     parser = lark.Lark.open(
         str(grammar_file),
-        rel_to=__file__,
         parser="lalr",
         start="module",
         lexer_callbacks=ast_builder.lexer_callbacks(),
         transformer=ast_builder,
-        postlex=BlockIndenter()
+        postlex=BlockIndenter(),
+        cache=cache_file,
         )
 
     # TODO: check that the full grammar has been parsed properly and not Tree object from lark are left
     return parser, ast_builder
 
+
+@functools.cache
+def _parser(grammar_file: Path, cache_dir: Path | None):
+    return initialize_parser(grammar_file, cache_dir)[0]
+
+
+@functools.cache
+def _ast_definition_hash() -> bytes:
+    # the pickled trees refer to the AST classes by name, any change of the classes invalidates them
+    return hashlib.sha256(Path(ast_definition.__file__).read_bytes()).digest()
+
+
+def ast_cache_key(source: str, grammar_file: Path) -> str:
+    digest = hashlib.sha256(f"{AST_CACHE_VERSION}\0{lark.__version__}\0".encode())
+    digest.update(_ast_definition_hash())
+    digest.update(hashlib.sha256((Path(__file__).parent / grammar_file).read_bytes()).digest())
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+def _load_ast(path: Path) -> ASTModule | None:
+    try:
+        module = pickle.loads(zlib.decompress(path.read_bytes()))
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        # truncated file, or AST classes changed without changing their source (a dependency did)
+        logger.debug("Ignoring the cached syntax tree %s: %r", path, err)
+        return None
+    return module if isinstance(module, ASTModule) else None
+
+
+def _save_ast(path: Path, module: ASTModule):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(zlib.compress(pickle.dumps(module, protocol=pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp_path, path)
+    except (OSError, pickle.PicklingError, RecursionError) as err:
+        logger.debug("Could not cache the syntax tree in %s: %r", path, err)
+
+
+def parse_source(source: str, grammar_file: Path, ast_cache_dir: Path | None = AST_CACHE_DIR, parser_cache_dir: Path | None = PARSER_CACHE_DIR) -> ASTModule:
+    """
+    Syntax tree of `source`
+
+    Trees are cached in `ast_cache_dir`, keyed by the source, the grammar and the AST classes, a cached tree is
+    loaded without building the parser. The tree is cached before the resolver annotates it.
+    """
+    if ast_cache_dir is None:
+        return _parser(grammar_file, parser_cache_dir).parse(source)
+    path = Path(ast_cache_dir) / f"{ast_cache_key(source, grammar_file)}.ast"
+    module = _load_ast(path)
+    if module is None:
+        module = _parser(grammar_file, parser_cache_dir).parse(source)
+        _save_ast(path, module)
+    return module
+
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument("--grammar-definition", default=Path(__file__).absolute().parent / "grammar.lark")
     arg_parser.add_argument("--input-file", type=Path)
+    arg_parser.add_argument("--no-parser-cache", action="store_true", help="build the parser instead of loading it from its cache")
     args = arg_parser.parse_args()
 
-    parser, ast_builder = initialize_parser(args.grammar_definition)
+    parser, ast_builder = initialize_parser(args.grammar_definition, cache_dir=None if args.no_parser_cache else PARSER_CACHE_DIR)
 
     if args.input_file:
         res = parser.parse(Path(args.input_file).read_text())
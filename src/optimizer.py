@@ -0,0 +1,276 @@
+"""
+Optimization passes on the SSA form of `src.ir`
+
+Each pass transforms a function in place and can be enabled on its own (`JITEngine(passes=...)`,
+`--jit-passes` on the command line), to measure what it brings.
+"""
+from src.ir import *
+from src.runtime_values import U64_MASK
+
+
+def _fold(op, a: int, b: int) -> int | None:
+    """Value of `a op b` for u64 operands, None when it can not be computed at compile time"""
+    match op:
+        case "+":
+            return (a + b) & U64_MASK
+        case "-":
+            return (a - b) & U64_MASK
+        case "*":
+            return (a * b) & U64_MASK
+        case "/":
+            # the division by zero is left to happen at runtime
+            return a // b if b != 0 else None
+        case "<<":
+            return (a << b) & U64_MASK if b < 64 else None
+        case ">>":
+            return a >> b if b < 64 else None
+        case "<":
+            return int(a < b)
+        case "<=":
+            return int(a <= b)
+        case ">":
+            return int(a > b)
+        case ">=":
+            return int(a >= b)
+        case "==":
+            return int(a == b)
+        case "!=":
+            return int(a != b)
+    return None
+
+
+def _simplify(function: IRFunction, instruction: Instruction) -> Instruction | None:
+    """An equivalent value already computed, or a constant, None when there is none"""
+    if instruction.op == "phi":
+        others = {id(arg): arg for arg in instruction.args if arg is not instruction}
+        if len(others) == 1:
+            return next(iter(others.values()))
+        return None
+    if instruction.op not in ARITHMETIC_OPS and instruction.op not in COMPARISONS:
+        return None
+
+    a, b = instruction.args
+    a_const = a.value if a.op == "const" else None
+    b_const = b.value if b.op == "const" else None
+    if a_const is not None and b_const is not None:
+        value = _fold(instruction.op, a_const, b_const)
+        return function.constant(value) if value is not None else None
+    match instruction.op, a_const, b_const:
+        case ("+" | "-" | "<<" | ">>"), _, 0:
+            return a
+        case "+", 0, _:
+            return b
+        case ("*" | "/"), _, 1:
+            return a
+        case "*", 1, _:
+            return b
+        case "*", 0, _:
+            return a
+        case "*", _, 0:
+            return b
+    return None
+
+
+def constant_propagation(function: IRFunction):
+    """
+    Evaluate the operations on constants, remove the branches on constant conditions and the blocks
+    that are not reachable anymore, and apply the algebraic identities (x + 0, x * 1, ...)
+    """
+    changed = True
+    while changed:
+        changed = False
+        for block in function.blocks:
+            for instruction in list(block.instructions):
+                replacement = _simplify(function, instruction)
+                if replacement is not None:
+                    function.replace_uses(instruction, replacement)
+                    function.remove(instruction)
+                    changed = True
+            match block.terminator:
+                case Branch(cond, if_true, if_false) if cond.op == "const":
+                    taken, not_taken = (if_true, if_false) if cond.value != 0 else (if_false, if_true)
+                    block.terminator = Jump(taken)
+                    if taken is not not_taken:
+                        not_taken.remove_predecessor(block)
+                    changed = True
+        if changed:
+            function.remove_unreachable_blocks()
+
+
+def dead_code_elimination(function: IRFunction):
+    """Remove the instructions whose value is never used, the parameters and the calls are kept"""
+    live = set()
+    worklist = [arg for block in function.blocks for arg in terminator_args(block.terminator)]
+    worklist.extend(instruction for instruction in function.instructions() if instruction.has_side_effects)
+    while worklist:
+        instruction = worklist.pop()
+        if instruction not in live:
+            live.add(instruction)
+            worklist.extend(instruction.args)
+    for instruction in list(function.instructions()):
+        if instruction not in live and instruction.op != "param":
+            function.remove(instruction)
+
+
+def _dominator_tree(function: IRFunction) -> dict[BasicBlock, list[BasicBlock]]:
+    children = {block: [] for block in function.blocks}
+    for block, idom in function.dominators().items():
+        if block is not idom:
+            children[idom].append(block)
+    return children
+
+
+def common_subexpression_elimination(function: IRFunction):
+    """
+    Reuse the value of an operation already computed on the same operands, in a dominating block
+
+    The blocks are visited down the dominator tree, each one sees the expressions of its dominators.
+    """
+    children = _dominator_tree(function)
+
+    def visit(block, available: dict):
+        available = dict(available)
+        for instruction in list(block.instructions):
+            if instruction.op in ("param", "const") or instruction.has_side_effects:
+                continue
+            args = tuple(id(arg) for arg in instruction.args)
+            if instruction.op in COMMUTATIVE_OPS:
+                args = tuple(sorted(args))
+            # phis are only the same in the same block, results of the same call differ by their index
+            key = (instruction.op, instruction.value, args, block if instruction.op == "phi" else None)
+            if key in available:
+                function.replace_uses(instruction, available[key])
+                function.remove(instruction)
+            else:
+                available[key] = instruction
+        for child in children[block]:
+            visit(child, available)
+
+    visit(function.entry, {})
+
+
+def _preheader(function: IRFunction, header: BasicBlock, body: set[BasicBlock]) -> BasicBlock | None:
+    """Block before the loop, only jumping to its header, created if needed. None if the loop has several entries"""
+    outside = [pred for pred in header.predecessors if pred not in body]
+    if len(outside) != 1:
+        return None
+    pred, = outside
+    if len(pred.successors) == 1:
+        return pred
+    return function.split_edge(pred, header)
+
+
+def _insert_at_end(block: BasicBlock, instruction: Instruction):
+    instruction.block = block
+    match block.terminator:
+        case Branch(cond, _, _) if block.instructions and block.instructions[-1] is cond:
+            # the condition stays right before the branch, they are compiled together
+            block.instructions.insert(len(block.instructions) - 1, instruction)
+        case _:
+            block.instructions.append(instruction)
+
+
+def loop_invariant_code_motion(function: IRFunction):
+    """
+    Move the operations computing the same value at each iteration before the loop
+
+    Divisions are not moved, the loop could be skipped when the division would fail, nor calls.
+    """
+    for header, body in function.loops():
+        preheader = _preheader(function, header, body)
+        if preheader is None:
+            continue
+        invariant = set()
+        for block in function.reverse_postorder():
+            if block not in body:
+                continue
+            for instruction in list(block.instructions):
+                if instruction.op in ("phi", "param", "const", "/") or instruction.has_side_effects:
+                    continue
+                if all(arg.block not in body or arg in invariant for arg in instruction.args):
+                    invariant.add(instruction)
+                    block.instructions.remove(instruction)
+                    _insert_at_end(preheader, instruction)
+
+
+def _power_of_two(instruction: Instruction) -> int | None:
+    if instruction.op == "const" and instruction.value > 0 and instruction.value & (instruction.value - 1) == 0:
+        return instruction.value.bit_length() - 1
+    return None
+
+
+def strength_reduction(function: IRFunction):
+    """
+    Replace operations by cheaper ones:
+    - a multiplication of a loop counter by a constant by a value incremented along with the counter
+      (`i * 4` with `i` going up by 1 is a new variable going up by 4)
+    - multiplications and divisions by powers of two by shifts
+    """
+    for header, body in function.loops():
+        latches = [pred for pred in header.predecessors if pred in body]
+        preheader = _preheader(function, header, body)
+        if preheader is None or len(latches) != 1:
+            continue
+        latch, = latches
+        init_idx, next_idx = header.predecessors.index(preheader), header.predecessors.index(latch)
+        for counter in header.phis:
+            match counter.args[next_idx]:
+                case Instruction("+", [a, b]) if a is counter and b.op == "const":
+                    step = b.value
+                case Instruction("+", [a, b]) if b is counter and a.op == "const":
+                    step = a.value
+                case _:
+                    continue
+            for block in body:
+                for instruction in list(block.instructions):
+                    if instruction.op != "*":
+                        continue
+                    match instruction.args:
+                        case [a, b] if a is counter and b.op == "const":
+                            factor = b.value
+                        case [a, b] if b is counter and a.op == "const":
+                            factor = a.value
+                        case _:
+                            continue
+                    init = counter.args[init_idx]
+                    if init.op == "const":
+                        scaled_init = function.constant(init.value * factor)
+                    else:
+                        scaled_init = Instruction("*", [init, function.constant(factor)])
+                        _insert_at_end(preheader, scaled_init)
+                    reduced = Instruction("phi", block=header)
+                    header.instructions.insert(0, reduced)
+                    increment = Instruction("+", [reduced, function.constant(step * factor)])
+                    _insert_at_end(latch, increment)
+                    reduced.args = [None] * len(header.predecessors)
+                    reduced.args[init_idx], reduced.args[next_idx] = scaled_init, increment
+                    function.replace_uses(instruction, reduced)
+                    function.remove(instruction)
+
+    for instruction in list(function.instructions()):
+        match instruction.op, instruction.args:
+            case "*", [a, b] if _power_of_two(b) is not None:
+                instruction.op, instruction.args = "<<", [a, function.constant(_power_of_two(b))]
+            case "*", [a, b] if _power_of_two(a) is not None:
+                instruction.op, instruction.args = "<<", [b, function.constant(_power_of_two(a))]
+            case "/", [a, b] if _power_of_two(b) is not None:
+                instruction.op, instruction.args = ">>", [a, function.constant(_power_of_two(b))]
+
+
+PASSES = {
+    "constant_propagation": constant_propagation,
+    "strength_reduction": strength_reduction,
+    "common_subexpression_elimination": common_subexpression_elimination,
+    "loop_invariant_code_motion": loop_invariant_code_motion,
+    "dead_code_elimination": dead_code_elimination,
+}
+DEFAULT_PASSES = tuple(PASSES)
+
+
+def optimize(function: IRFunction, passes=DEFAULT_PASSES) -> IRFunction:
+    """Run `passes`, by name, in order"""
+    for name in passes:
+        if name not in PASSES:
+            raise ValueError(f"Unknown optimization pass {name}, expected one of {tuple(PASSES)}")
+        PASSES[name](function)
+    return function
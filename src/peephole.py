@@ -0,0 +1,211 @@
+"""
+Peephole optimization of the assembly emitted by `CompilationContext`
+
+Runs on the instruction list of a context before it is turned into text: the lines are parsed with the
+parser of `src.assembler`, then rewritten by local rules until none applies:
+- moves of a location to itself, or undoing the previous move, are removed, a load of the value just stored
+  is taken from the stored register
+- jumps to the next instruction are removed, a conditional jump over an unconditional one is inverted,
+  jumps to a jump go directly to its target, code after a jump or a return is unreachable until the next label
+- a `cmpq $0` of the result of a `setcc`, followed by a conditional jump, jumps on the flags of the
+  comparison that set it
+- labels no jump refers to are removed, so that the rules apply across them
+
+Items that are not strings are either labels (their text ends with ":") or opaque instructions no rule
+looks through (the frame size, nested contexts).
+"""
+from dataclasses import dataclass, field
+
+from src.assembler import Imm, Mem, Reg, parse_line
+
+NEGATED_CONDITION_CODES = {
+    "b": "ae", "ae": "b", "be": "a", "a": "be", "e": "ne", "ne": "e",
+    "l": "ge", "ge": "l", "le": "g", "g": "le", "s": "ns", "ns": "s", "o": "no", "no": "o", "p": "np", "np": "p",
+}
+# bound on the rewriting passes, in case rules undo each other (jumps between two jumps)
+MAX_PASSES = 16
+# instructions that do not change the flags, the values set by `setcc` can be moved with them
+_FLAGS_PRESERVING = ("movq", "movzbq")
+
+
+@dataclass(eq=False)
+class _Line:
+    # original item, emitted as is unless the line is rewritten
+    item: object
+    # "instruction", "label", "comment" or "opaque"
+    kind: str
+    label: str | None = None
+    mnemonic: str | None = None
+    operands: list = field(default_factory=list)
+    # text of the operands, to write the line back
+    texts: list[str] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, item) -> "_Line":
+        if not isinstance(item, str):
+            text = str(item)
+            return cls(item, "label", label=text[:-1]) if text.endswith(":") else cls(item, "opaque")
+        parsed = parse_line(item)
+        if parsed is None:
+            return cls(item, "comment")
+        if isinstance(parsed, str):
+            return cls(item, "label", label=parsed[:-1])
+        mnemonic, operands = parsed
+        texts = [text.strip() for text in item.partition("#")[0].strip().partition(" ")[2].split(",")] if operands else []
+        return cls(item, "instruction", mnemonic=mnemonic, operands=operands, texts=texts)
+
+    @classmethod
+    def instruction(cls, mnemonic, texts) -> "_Line":
+        return cls.parse(f"{mnemonic} {', '.join(texts)}")
+
+    @property
+    def condition(self) -> str | None:
+        """Condition code of a conditional jump"""
+        if self.kind == "instruction" and self.mnemonic.startswith("j") and self.mnemonic[1:] in NEGATED_CONDITION_CODES:
+            return self.mnemonic[1:]
+        return None
+
+    def is_jump(self) -> bool:
+        return self.kind == "instruction" and (self.mnemonic == "jmp" or self.condition is not None)
+
+
+def _uses_register(operand, reg: Reg) -> bool:
+    """`operand` is `reg`, or a part of it, or is addressed with it"""
+    return (isinstance(operand, Reg) and operand.code == reg.code) or (isinstance(operand, Mem) and operand.base == reg.code)
+
+def _independent(a, b) -> bool:
+    """Writing one of the operands does not change the location designated by the other"""
+    return not (isinstance(a, Reg) and _uses_register(b, a)) and not (isinstance(b, Reg) and _uses_register(a, b))
+
+
+class _Peephole:
+    def __init__(self, items) -> None:
+        self.lines = [_Line.parse(item) for item in items]
+
+    def next_index(self, idx) -> int | None:
+        """Index of the first line after `idx` that is not a comment"""
+        for next_idx in range(idx + 1, len(self.lines)):
+            if self.lines[next_idx].kind not in ("comment", "removed"):
+                return next_idx
+        return None
+
+    def following_labels(self, idx) -> set[str]:
+        """Labels right after `idx`, all designate the next instruction"""
+        labels = set()
+        next_idx = self.next_index(idx)
+        while next_idx is not None and self.lines[next_idx].kind == "label":
+            labels.add(self.lines[next_idx].label)
+            next_idx = self.next_index(next_idx)
+        return labels
+
+    def run(self) -> list:
+        for _ in range(MAX_PASSES):
+            if not self.run_pass():
+                break
+        return [line.item for line in self.lines]
+
+    def run_pass(self) -> bool:
+        changed = False
+        labels = {line.label: idx for idx, line in enumerate(self.lines) if line.kind == "label"}
+        for idx, line in enumerate(self.lines):
+            if line.kind != "instruction":
+                continue
+            next_idx = self.next_index(idx)
+            next_line = self.lines[next_idx] if next_idx is not None else None
+            match line.mnemonic, line.operands:
+                case "movq", [source, destination] if source == destination:
+                    line.kind = "removed"
+                    changed = True
+                case "movq", [source, destination] if next_line is not None and next_line.kind == "instruction" and next_line.mnemonic == "movq":
+                    changed |= self.merge_moves(line, next_idx)
+                case ("jmp" | "retq"), _ if next_line is not None and next_line.kind == "instruction":
+                    # unreachable
+                    next_line.kind = "removed"
+                    changed = True
+                case "cmpq", [Imm(0), tested] if next_line is not None and next_line.mnemonic in ("jne", "je"):
+                    changed |= self.merge_set_condition(idx, tested, next_idx)
+
+            if line.is_jump() and line.kind != "removed":
+                target = line.operands[0]
+                # jump to a jump
+                target_idx = self.next_index(labels[target]) if target in labels else None
+                if target_idx is not None and self.lines[target_idx].mnemonic == "jmp" and self.lines[target_idx].operands[0] != target:
+                    self.lines[idx] = line = _Line.instruction(line.mnemonic, self.lines[target_idx].texts)
+                    target = line.operands[0]
+                    changed = True
+                if target in self.following_labels(idx):
+                    line.kind = "removed"
+                    changed = True
+                elif line.condition is not None and next_line is not None and next_line.mnemonic == "jmp" and target in self.following_labels(next_idx):
+                    # jcc L1; jmp L2; L1: is jncc L2; L1:
+                    self.lines[idx] = _Line.instruction(f"j{NEGATED_CONDITION_CODES[line.condition]}", next_line.texts)
+                    next_line.kind = "removed"
+                    changed = True
+
+        references = {operand for line in self.lines if line.kind == "instruction" for operand in line.operands if isinstance(operand, str)}
+        for line in self.lines:
+            if line.kind == "label" and line.label not in references:
+                line.kind = "removed"
+                changed = True
+        self.lines = [line for line in self.lines if line.kind != "removed"]
+        return changed
+
+    def merge_moves(self, line: _Line, next_idx) -> bool:
+        source, destination = line.operands
+        next_source, next_destination = self.lines[next_idx].operands
+        if not _independent(source, destination):
+            return False
+        if (next_source, next_destination) in ((destination, source), (source, destination)):
+            # undoes the move, or repeats it
+            self.lines[next_idx].kind = "removed"
+            return True
+        if next_source == destination and isinstance(destination, Mem) and isinstance(source, Reg):
+            # load of the value just stored, it is still in the register
+            self.lines[next_idx] = _Line.instruction("movq", [line.texts[0], self.lines[next_idx].texts[1]])
+            return True
+        return False
+
+    def merge_set_condition(self, idx, tested, jump_idx) -> bool:
+        """`setcc %al; movzbq %al, %rax; cmpq $0, %rax; jne L` is `jcc L`, the moves keep the flags"""
+        moves = []
+        set_idx = idx - 1
+        while set_idx >= 0 and self.lines[set_idx].kind in ("comment", "instruction") and (self.lines[set_idx].kind == "comment" or self.lines[set_idx].mnemonic in _FLAGS_PRESERVING):
+            if self.lines[set_idx].kind == "instruction":
+                moves.append(self.lines[set_idx])
+            set_idx -= 1
+        if set_idx < 0:
+            return False
+        set_line = self.lines[set_idx]
+        if set_line.kind != "instruction" or not set_line.mnemonic.startswith("set") or set_line.mnemonic[3:] not in NEGATED_CONDITION_CODES:
+            return False
+
+        # locations holding the result of setcc
+        holders = set(set_line.operands)
+        for move in reversed(moves):
+            source, destination = move.operands
+            copied = source in holders
+            if isinstance(destination, Reg):
+                holders = {holder for holder in holders if not _uses_register(holder, destination)}
+            else:
+                holders.discard(destination)
+            if copied:
+                holders.add(destination)
+        if tested not in holders:
+            return False
+
+        condition = set_line.mnemonic[3:]
+        jump = self.lines[jump_idx]
+        if jump.mnemonic == "je":
+            condition = NEGATED_CONDITION_CODES[condition]
+        self.lines[jump_idx] = _Line.instruction(f"j{condition}", jump.texts)
+        self.lines[idx].kind = "removed"
+        return True
+
+
+def count_instructions(items) -> int:
+    return sum(_Line.parse(item).kind in ("instruction", "opaque") for item in items)
+
+def peephole(items) -> tuple[list, int]:
+    """Optimized `items`, and the number of instructions removed"""
+    optimized = _Peephole(items).run()
+    return optimized, count_instructions(items) - count_instructions(optimized)
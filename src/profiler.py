@@ -0,0 +1,160 @@
+"""
+Profiler of jil programs, `--profile` on the command line of `src.interpreter`
+
+The interpreter reports each call of a function (`call`), by the name it is called with, how the call ran (`ran`:
+interpreted, jitted, or both when verified), the compilations (`compile`) and the loops switched to compiled code
+(`osr`). It does nothing when `interpreter.PROFILER` is None, the default.
+
+Each function gets its inclusive time, with the calls it makes, and its exclusive time, without them. Functions calling each other natively
+in jitted code are not seen, their time is the time of the outermost jitted call. A compilation is a frame of its
+own, its time is attributed to the compiled function (or to the function running the compiled loop) and excluded
+from the time of the function it happens in. Compilations on the background workers are not in any call stack, they
+are reported under a `[jit workers]` root.
+
+`collapsed_stacks` is the input of flamegraph tools (flamegraph.pl, speedscope, inferno), in µs, jitted frames
+are suffixed with `_[j]` as flamegraph.pl colors them.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+import threading
+import time
+
+MODULE_FRAME = "<module>"
+COMPILE_FRAME = "[jit compile]"
+OSR_FRAME = "[osr loop]"
+WORKERS_FRAME = "[jit workers]"
+MODES = ("interpreted", "jit", "verified")
+
+
+@dataclass
+class FunctionStats:
+    calls: int = 0
+    # time of the outermost calls only, recursive calls are already in it
+    inclusive_ns: int = 0
+    # exclusive time, by how the calls ran
+    exclusive_ns: Counter = field(default_factory=Counter)
+    compile_ns: int = 0
+    compilations: int = 0
+
+
+@dataclass(eq=False)
+class _Frame:
+    name: str
+    start_ns: int
+    mode: str = "interpreted"
+    children_ns: int = 0
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self.functions: dict[str, FunctionStats] = {}
+        # exclusive time by call stack, frame labels from the root
+        self.stacks: Counter = Counter()
+        self._stack = [_Frame(MODULE_FRAME, time.perf_counter_ns())]
+        # compilations on the workers
+        self._lock = threading.Lock()
+
+    def stats(self, name) -> FunctionStats:
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats()
+        return stats
+
+    def call(self, name: str, func, *args):
+        """`func(*args)` as a call of the jil function `name`"""
+        frame = _Frame(name, time.perf_counter_ns())
+        self._stack.append(frame)
+        try:
+            return func(*args)
+        finally:
+            self._leave(frame)
+            stats = self.stats(name)
+            stats.calls += 1
+
+    def ran(self, mode: str):
+        """The current call ran in `mode` instead of being interpreted"""
+        self._stack[-1].mode = mode
+
+    def compile(self, compile_method, *args):
+        """Run a compilation, for the function being called"""
+        name = self._stack[-1].name
+        frame = _Frame(COMPILE_FRAME, time.perf_counter_ns())
+        self._stack.append(frame)
+        try:
+            return compile_method(*args)
+        finally:
+            elapsed = self._leave(frame)
+            stats = self.stats(name)
+            stats.compile_ns += elapsed
+            stats.compilations += 1
+
+    def background_compile(self, compile_method):
+        """`compile_method` timed on the worker running it, for the function being called when it is submitted"""
+        name = self._stack[-1].name
+
+        def timed(*args):
+            t = time.perf_counter_ns()
+            try:
+                return compile_method(*args)
+            finally:
+                elapsed = time.perf_counter_ns() - t
+                with self._lock:
+                    stats = self.stats(name)
+                    stats.compile_ns += elapsed
+                    stats.compilations += 1
+                    self.stacks[(WORKERS_FRAME, name, COMPILE_FRAME)] += elapsed
+        return timed
+
+    def osr(self, loop_call, values):
+        """Run the rest of a loop with its compiled code"""
+        frame = _Frame(OSR_FRAME, time.perf_counter_ns(), mode="jit")
+        self._stack.append(frame)
+        try:
+            return loop_call(values)
+        finally:
+            self._leave(frame)
+
+    def _leave(self, frame: _Frame) -> int:
+        elapsed = time.perf_counter_ns() - frame.start_ns
+        self.stacks[tuple(label(f) for f in self._stack)] += elapsed - frame.children_ns
+        self._stack.pop()
+        parent = self._stack[-1]
+        parent.children_ns += elapsed
+        if frame.name == OSR_FRAME:
+            # jitted time of the function running the loop
+            self.stats(parent.name).exclusive_ns["jit"] += elapsed - frame.children_ns
+        elif frame.name != COMPILE_FRAME:
+            stats = self.stats(frame.name)
+            stats.exclusive_ns[frame.mode] += elapsed - frame.children_ns
+            if all(f.name != frame.name for f in self._stack):
+                stats.inclusive_ns += elapsed
+        return elapsed
+
+    def finish(self):
+        """Close the module frame, once the program is done"""
+        root, = self._stack
+        elapsed = time.perf_counter_ns() - root.start_ns
+        self.stacks[(MODULE_FRAME,)] += elapsed - root.children_ns
+        stats = self.stats(MODULE_FRAME)
+        stats.calls += 1
+        stats.inclusive_ns += elapsed
+        stats.exclusive_ns["interpreted"] += elapsed - root.children_ns
+
+    def collapsed_stacks(self) -> str:
+        lines = [f"{';'.join(stack)} {ns // 1000}" for stack, ns in sorted(self.stacks.items()) if ns >= 1000]
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> str:
+        header = f"{'function':>20} {'calls':>8} {'inclusive (ms)':>15} {'exclusive (ms)':>15} " + " ".join(f"{mode + ' (ms)':>17}" for mode in MODES) + f" {'compile (ms)':>13}"
+        lines = [header]
+        for name, stats in sorted(self.functions.items(), key=lambda item: -item[1].inclusive_ns):
+            lines.append(
+                f"{name:>20} {stats.calls:>8} {stats.inclusive_ns / 1e6:>15.3f} {sum(stats.exclusive_ns.values()) / 1e6:>15.3f} "
+                + " ".join(f"{stats.exclusive_ns[mode] / 1e6:>17.3f}" for mode in MODES)
+                + f" {stats.compile_ns / 1e6:>13.3f}"
+            )
+        return "\n".join(lines)
+
+
+def label(frame: _Frame) -> str:
+    return f"{frame.name}_[j]" if frame.mode == "jit" else frame.name
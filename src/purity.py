@@ -0,0 +1,161 @@
+"""
+Purity analysis of functions, and memoization of the pure ones
+
+A function is pure when its result only depends on its arguments:
+- it does not call the `print` or `pdb` builtins
+- it does not read nor write variables of the enclosing scopes that are mutable, or not assigned yet
+- it only calls pure functions, held by immutable variables of the enclosing scopes (or itself)
+
+Immutable variables can still be declared again: the function values relying on them are recorded in their frame, and
+their caches are dropped when it happens (`Frame.rebind`).
+
+The analysis runs on the first call of a function value, with the frames it closes over. Functions taking only u64
+arguments, and returning a u64 or a struct, are memoized when they are pure: their results are kept in a `MemoCache` by
+arguments. `ASTFunctionDeclare.memoize` overrides the analysis, False never memoizes, True memoizes a function the
+analysis can not prove pure.
+
+Calls made by jitted code to other jitted functions are native calls, they do not go through the cache: the JIT
+does not compile the recursive calls of a memoized function.
+"""
+from collections import OrderedDict
+import weakref
+
+from src.ast_definition import ASTFunctionDeclare, ASTMut, ASTNoReturn, ASTUninitValue
+from src.compile import iter_calls, iter_identifiers
+from src.ir import IRError, layout_of
+from src.utils import UNBOUND
+
+IMPURE_BUILTINS = ("print", "pdb")
+# results kept by function
+MEMO_CACHE_SIZE = 1024
+MISSING = object()
+
+
+class MemoCache:
+    """Results of a function by arguments, the least recently used are evicted first"""
+    def __init__(self, maxsize=MEMO_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Result for `key`, MISSING if it is not cached"""
+        res = self.results.get(key, MISSING)
+        if res is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(key)
+        return res
+
+    def put(self, key, res):
+        self.results[key] = res
+        if len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    def call(self, key, compute):
+        """Cached result for `key`, or the result of `compute()`, then cached"""
+        res = self.get(key)
+        if res is MISSING:
+            res = compute()
+            self.put(key, res)
+        return res
+
+    def stats(self) -> dict:
+        return {"size": len(self.results), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# caches of the memoized functions still alive, for the summary of a run
+_MEMO_CACHES = weakref.WeakSet()
+# `outer_references` of the body of each function scope
+_OUTER_REFERENCES = weakref.WeakKeyDictionary()
+
+
+def outer_references(func: ASTFunctionDeclare) -> tuple[tuple, dict]:
+    """
+    Addresses of the variables of the enclosing scopes used by the body of `func`, and names of the called
+    functions by address, the same for all the function values of a declaration
+    """
+    refs = _OUTER_REFERENCES.get(func.scope)
+    if refs is None:
+        depth = func.scope.depth
+        variables = tuple(dict.fromkeys(ident.address for ident in iter_identifiers(func.body) if ident.address is None or ident.address[0] < depth))
+        calls = {call.func_name.address: call.func_name.value for call in iter_calls(func.body)}
+        refs = _OUTER_REFERENCES[func.scope] = (variables, calls)
+    return refs
+
+
+def is_pure(func: ASTFunctionDeclare, analyzing=()) -> bool:
+    """`analyzing` are the functions calling `func` whose analysis is in progress, they are assumed pure"""
+    if func.body is None:
+        # loaded from bytecode, the body is not known
+        return False
+    variables, calls = outer_references(func)
+    for address in variables:
+        if address is None:
+            return False
+        frame, slot = func.closure[address[0]], address[1]
+        value = frame.values[slot]
+        if isinstance(frame.types[slot], ASTMut) or value is UNBOUND or isinstance(value, ASTUninitValue):
+            return False
+        # an immutable variable can still be declared again, the cached results are then dropped
+        frame.add_dependent(slot, func)
+
+    analyzing = (*analyzing, func)
+    for address, name in calls.items():
+        if address is None or address[0] >= func.scope.depth:
+            # function of a local variable, not known before running
+            return False
+        frame, slot = func.closure[address[0]], address[1]
+        callee = frame.values[slot]
+        if isinstance(frame.types[slot], ASTMut):
+            return False
+        frame.add_dependent(slot, func)
+        if isinstance(callee, ASTFunctionDeclare):
+            if not any(callee is caller for caller in analyzing):
+                if not is_pure(callee, analyzing):
+                    return False
+                # its results depend on the variables the callee reads too
+                callee.add_dependent(func)
+        elif not callable(callee) or (address[0] == 0 and name in IMPURE_BUILTINS):
+            return False
+    return True
+
+
+def is_memoizable(func: ASTFunctionDeclare) -> bool:
+    """The u64 arguments are the key, and the result is a u64 or a struct value, both immutable"""
+    if isinstance(func.return_type, ASTNoReturn):
+        return False
+    try:
+        return all(layout_of(arg.ident_type, func.closure) == "u64" for arg in func.arguments) and layout_of(func.return_type, func.closure) is not None
+    except IRError:
+        return False
+
+
+def memo_cache(func: ASTFunctionDeclare) -> MemoCache | None:
+    """Cache of the results of `func`, None when it is not memoized, decided on the first call"""
+    if not func.memo_checked:
+        memoize = func.memoize if func.memoize is not None else is_pure(func)
+        if memoize and is_memoizable(func):
+            func.memo_cache = MemoCache()
+            _MEMO_CACHES.add(func.memo_cache)
+        func.memo_checked = True
+    return func.memo_cache
+
+
+def memo_key(func: ASTFunctionDeclare, arguments) -> tuple:
+    """Arguments cast to the types of the parameters, u64 literals and ints are the same key"""
+    return tuple(arg.ident_type.cast(value) for arg, value in zip(func.arguments, arguments))
+
+
+def memo_summary() -> dict:
+    caches = list(_MEMO_CACHES)
+    return {
+        "functions": len(caches),
+        "hits": sum(cache.hits for cache in caches),
+        "misses": sum(cache.misses for cache in caches),
+        "evictions": sum(cache.evictions for cache in caches),
+    }
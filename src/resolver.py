@@ -0,0 +1,209 @@
+"""
+Resolution of identifiers to (depth, slot) addresses, before running a module
+
+Each function call (and the module) gets a `Frame`, a fixed size array of slots. Block scopes are flattened in the
+frame of their function: a variable declared in an if block gets its own slot, only visible from that block. At
+runtime the frames that can be reached from a function form a display, a tuple indexed by depth (0 for the builtins,
+1 for the module, then one more per nested function), so any variable is accessed in O(1).
+
+Functions are closures, they see the variables of the functions they are declared in, not those of their caller.
+Inline code sees the variables declared before it, function bodies all the variables of the enclosing blocks as they
+run after them.
+
+The resolver annotates the syntax tree:
+- `ASTIdentifier.address`, `(depth, slot)` or None when the name is unknown
+- `ASTModule.scope` and `ASTFunctionDeclare.scope`, the `FunctionScope` used to create their frames
+- `ASTWhileStatement.bindings`, the addresses of the names visible in the loop, for on stack replacement
+- `ASTNumber.literal`, the value of the literal, shared by all its evaluations
+- `ASTStructValue.shape`, the field names of the literal and their index, shared by all its values
+"""
+from dataclasses import dataclass, field
+
+from src.ast_definition import *
+from src.runtime_values import Number
+
+
+@dataclass(eq=False)
+class FunctionScope:
+    depth: int
+    # name of the variable stored in each slot, a name can have several slots when shadowed in nested blocks
+    slot_names: list[str] = field(default_factory=list)
+    # slots of the top level block, to access the variables of a frame by name
+    names: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return len(self.slot_names)
+
+    def new_slot(self, name: str) -> int:
+        self.slot_names.append(name)
+        return len(self.slot_names) - 1
+
+    @classmethod
+    def from_names(cls, names, depth=0) -> "FunctionScope":
+        scope = cls(depth)
+        for name in names:
+            scope.names[name] = scope.new_slot(name)
+        return scope
+
+
+class _Block:
+    def __init__(self, scope: FunctionScope, declared_names) -> None:
+        # slots of all the names declared in the block, and the names declared so far
+        self.slots = {name: scope.new_slot(name) for name in declared_names}
+        self.active = set()
+
+
+def declared_names(block: ASTBlock):
+    """Names declared in a block scope, while loops do not start a new scope"""
+    for statement in block.value:
+        match statement.value:
+            case ASTVarDeclaration(ident, _, _):
+                yield ident.value
+            case ASTWhileStatement(_, body):
+                yield from declared_names(body)
+
+
+class Resolver:
+    def __init__(self, builtin_scope: FunctionScope) -> None:
+        self.builtin_scope = builtin_scope
+        # for each function being resolved, from the module to the innermost one, its scope and its open blocks
+        self.functions: list[tuple[FunctionScope, list[_Block]]] = []
+
+    @property
+    def scope(self) -> FunctionScope:
+        return self.functions[-1][0]
+
+    @property
+    def blocks(self) -> list[_Block]:
+        return self.functions[-1][1]
+
+    def lookup(self, name: str) -> tuple[int, int] | None:
+        scope, blocks = self.functions[-1]
+        for block in reversed(blocks):
+            if name in block.active:
+                return scope.depth, block.slots[name]
+        for scope, blocks in reversed(self.functions[:-1]):
+            for block in reversed(blocks):
+                if name in block.slots:
+                    return scope.depth, block.slots[name]
+        if name in self.builtin_scope.names:
+            return self.builtin_scope.depth, self.builtin_scope.names[name]
+        return None
+
+    def visible_bindings(self) -> dict[str, tuple[int, int]]:
+        bindings = {name: (self.builtin_scope.depth, slot) for name, slot in self.builtin_scope.names.items()}
+        for scope, blocks in self.functions[:-1]:
+            for block in blocks:
+                bindings.update((name, (scope.depth, slot)) for name, slot in block.slots.items())
+        for block in self.blocks:
+            bindings.update((name, (self.scope.depth, block.slots[name])) for name in block.active)
+        return bindings
+
+    def resolve_module(self, module: ASTModule):
+        scope = FunctionScope(self.builtin_scope.depth + 1)
+        block = _Block(scope, declared_names(module.value))
+        scope.names = block.slots
+        self.functions.append((scope, [block]))
+        self.resolve_statements(module.value)
+        self.functions.pop()
+        module.scope = scope
+
+    def resolve_function(self, func: ASTFunctionDeclare):
+        for arg in func.arguments:
+            self.resolve_typ(arg.ident_type)
+        self.resolve_typ(func.return_type)
+
+        scope = FunctionScope(self.scope.depth + 1)
+        # the arguments are in the same scope as the body
+        block = _Block(scope, [*(arg.ident.value for arg in func.arguments), *declared_names(func.body)])
+        scope.names = block.slots
+        self.functions.append((scope, [block]))
+        for arg in func.arguments:
+            self.declare(arg.ident)
+        self.resolve_statements(func.body)
+        self.functions.pop()
+        func.scope = scope
+
+    def resolve_block(self, block: ASTBlock):
+        self.blocks.append(_Block(self.scope, declared_names(block)))
+        self.resolve_statements(block)
+        self.blocks.pop()
+
+    def resolve_statements(self, block: ASTBlock):
+        for statement in block.value:
+            self.resolve_statement(statement)
+
+    def declare(self, ident: ASTIdentifier):
+        block = self.blocks[-1]
+        block.active.add(ident.value)
+        ident.address = (self.scope.depth, block.slots[ident.value])
+
+    def resolve_statement(self, node: ASTStatement):
+        match node.value:
+            case ASTExpression(value):
+                self.resolve_expression(value)
+            case ASTAssignment((lvalue, rvalue)):
+                self.resolve_expression(lvalue)
+                self.resolve_expression(rvalue)
+            case ASTVarDeclaration(ident, var_type, rvalue):
+                self.resolve_typ(var_type)
+                self.resolve_expression(rvalue)
+                self.declare(ident)
+            case ASTIfStatement(cond, if_block, else_block):
+                self.resolve_expression(cond)
+                self.resolve_block(if_block)
+                if else_block is not None:
+                    self.resolve_block(else_block)
+            case ASTWhileStatement(cond, block) as while_stmt:
+                # the variables declared by the loop body live in the enclosing block
+                bindings = self.visible_bindings()
+                bindings.update((name, (self.scope.depth, self.blocks[-1].slots[name])) for name in declared_names(block))
+                while_stmt.bindings = bindings
+                self.resolve_expression(cond)
+                self.resolve_statements(block)
+
+    def resolve_typ(self, node):
+        match node:
+            case ASTIdentifier(name):
+                node.address = self.lookup(name)
+            case ASTStructureType(fields):
+                for field in fields:
+                    self.resolve_typ(field.ident_type)
+            case ASTFunctionType(arg_types, ret_type):
+                for arg in arg_types:
+                    self.resolve_typ(arg)
+                self.resolve_typ(ret_type)
+            case ASTType(typ) | ASTMut(typ):
+                self.resolve_typ(typ)
+
+    def resolve_expression(self, node):
+        match node:
+            case ASTIdentifier(name):
+                node.address = self.lookup(name)
+            case ASTNumber(value):
+                # numbers are immutable
+                node.literal = Number(value)
+            case ASTExpression(value):
+                self.resolve_expression(value)
+            case ASTBinaryOp(a, _, b):
+                self.resolve_expression(a)
+                self.resolve_expression(b)
+            case ASTFunctionDeclare():
+                self.resolve_function(node)
+            case ASTFunctionCall(func_name, arguments):
+                for arg in arguments:
+                    self.resolve_expression(arg)
+                self.resolve_expression(func_name)
+            case ASTStructValue(fields):
+                node.shape = StructShape.of_literal(tuple(field.ident.value for field in fields))
+                for field in fields:
+                    self.resolve_expression(field.value)
+            case ASTFieldLookup(obj, _):
+                self.resolve_expression(obj)
+
+
+def resolve_module(module: ASTModule, builtin_scope: FunctionScope):
+    """Annotate `module` with addresses, it is only resolved once"""
+    if module.scope is None:
+        Resolver(builtin_scope).resolve_module(module)
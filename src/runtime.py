@@ -0,0 +1,183 @@
+"""
+Embedding of jil in python programs: load a module once, and call its functions from python
+
+    with Runtime() as runtime:
+        module = runtime.load_file("examples/fibo.jil")
+        fibo = module.function("fibo")
+        fibo(80)
+
+Python ints are passed as u64 values and dicts as struct values, results are converted back the same way. Each
+runtime owns its JIT engine, the functions of its modules are compiled once and their compiled code is reused by
+all the following calls.
+
+The tree walking interpreter runs with module level settings (`interpreter.JIT_ENGINE`, ...): a runtime installs
+its own while it loads a module or calls a function, the runtimes take turns, calls from several threads are
+serialized.
+"""
+import contextlib
+from pathlib import Path
+import threading
+
+from src import interpreter
+from src.ast_definition import ASTFunctionDeclare, ASTNoReturn, ASTStructureType, StructValue
+from src.compile import JITEngine, typ_without_mut
+from src.interpreter import build_builtin_env, interpret_func_call, interpret_module
+from src.lark_parser import AST_CACHE_DIR, parse_source
+from src.runtime_values import U64, U64_MASK, Number
+from src.utils import UNBOUND, Frame
+from src.verification import Verifier
+
+GRAMMAR_FILE = Path(__file__).absolute().parent / "grammar.lark"
+
+# held while a runtime has its settings installed in the interpreter
+_INTERPRETER_LOCK = threading.RLock()
+
+
+def to_jil(value, typ):
+    """Value of type `typ` for a python value: an int for u64, a dict of the fields for a struct"""
+    typ = typ_without_mut(typ)
+    if isinstance(value, Function):
+        value = value.func
+    match typ:
+        case U64():
+            if not isinstance(value, int) or not 0 <= value <= U64_MASK:
+                raise ValueError(f"Expected an int in [0, 2**64) for a u64, not {value!r}")
+            return value
+        case ASTStructureType():
+            if not isinstance(value, dict):
+                raise TypeError(f"Expected a dict for a struct, not {type(value)}")
+            shape = typ.shape
+            if set(value) != set(shape.names):
+                raise TypeError(f"Wrong struct fields, expected {set(shape.names)}, got {set(value)}")
+            return StructValue(shape, tuple(to_jil(value[name], field_typ) for name, field_typ in zip(shape.names, shape.types)))
+    # function values and types are already jil values
+    return typ.cast(value)
+
+
+class Runtime:
+    """
+    Settings of the interpreter and JIT engine shared by the modules it loads, the arguments have the defaults
+    of the command line of `src.interpreter`
+    """
+    def __init__(
+        self,
+        jit_compile=True,
+        jit_backend="native",
+        jit_workers=1,
+        compilation_dir=".jil_cache",
+        jit_call_threshold=interpreter.JIT_CALL_THRESHOLD,
+        jit_loop_threshold=interpreter.JIT_LOOP_THRESHOLD,
+        verify="sampled",
+        memoize=True,
+        ast_cache_dir: Path | None = AST_CACHE_DIR,
+    ) -> None:
+        self.jit_engine = JITEngine(compilation_dir, backend=jit_backend, workers=jit_workers)
+        self.verifier = Verifier(verify)
+        self.ast_cache_dir = ast_cache_dir
+        self._settings = {
+            "JIT_COMPILE": jit_compile,
+            "JIT_ENGINE": self.jit_engine,
+            "VERIFIER": self.verifier,
+            "JIT_CALL_THRESHOLD": jit_call_threshold,
+            "JIT_LOOP_THRESHOLD": jit_loop_threshold,
+            "MEMOIZE": memoize,
+            "MEMOIZE_OVERRIDES": {},
+            "PROFILER": None,
+        }
+
+    @contextlib.contextmanager
+    def installed(self):
+        """The interpreter runs with the settings of this runtime"""
+        with _INTERPRETER_LOCK:
+            saved = {name: getattr(interpreter, name) for name in self._settings}
+            for name, value in self._settings.items():
+                setattr(interpreter, name, value)
+            try:
+                yield
+            finally:
+                for name, value in saved.items():
+                    setattr(interpreter, name, value)
+
+    def load_source(self, source: str) -> "Module":
+        """Run a module, its top level statements are run once"""
+        ast = parse_source(source, GRAMMAR_FILE, self.ast_cache_dir)
+        with self.installed():
+            frame = interpret_module(ast, build_builtin_env())
+        return Module(self, frame)
+
+    def load_file(self, path) -> "Module":
+        return self.load_source(Path(path).read_text())
+
+    def to_python(self, value):
+        """Python value of a jil value: ints for numbers, dicts for structs, None when there is no value"""
+        if type(value) is int:
+            return value
+        if isinstance(value, Number):
+            return value.value
+        if isinstance(value, StructValue):
+            return {name: self.to_python(field_value) for name, field_value in value.items()}
+        if isinstance(value, ASTNoReturn):
+            return None
+        if isinstance(value, ASTFunctionDeclare):
+            return Function(self, value)
+        return value
+
+    def close(self):
+        """Wait for the compilations in progress"""
+        self.jit_engine.shutdown()
+
+    def __enter__(self) -> "Runtime":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Module:
+    """Variables of the top level block of a loaded module"""
+    def __init__(self, runtime: Runtime, frame: Frame) -> None:
+        self.runtime = runtime
+        self.frame = frame
+
+    def names(self) -> list[str]:
+        return [name for name in self.frame.scope.names if self.frame.values[self.frame.scope.names[name]] is not UNBOUND]
+
+    def get(self, name: str):
+        """Python value of the variable `name`"""
+        return self.runtime.to_python(self.frame.get(name))
+
+    def function(self, name: str) -> "Function":
+        func = self.frame.get(name)
+        if not isinstance(func, ASTFunctionDeclare):
+            raise TypeError(f"{name} is not a function, but a {type(func)}")
+        return Function(self.runtime, func, name)
+
+
+class Function:
+    """Handle calling a jil function with python values"""
+    def __init__(self, runtime: Runtime, func: ASTFunctionDeclare, name: str = "<function>") -> None:
+        self.runtime = runtime
+        self.func = func
+        self.name = name
+
+    def __call__(self, *args):
+        if len(args) != len(self.func.arguments):
+            raise TypeError(f"{self.name} takes {len(self.func.arguments)} arguments, got {len(args)}")
+        arguments = [to_jil(arg, param.ident_type) for arg, param in zip(args, self.func.arguments)]
+        with self.runtime.installed():
+            res = interpret_func_call(self.func, arguments, self.func.closure)
+        return self.runtime.to_python(res)
+
+    def compile(self):
+        """Compile the function now, instead of once it is hot"""
+        if self.func.jit_function_call is None:
+            with self.runtime.installed():
+                self.runtime.jit_engine.run_compile(self.runtime.jit_engine.compile_function, self.func)
+
+    def batch(self, *arrays, out):
+        """Call the function on arrays, see `JITFunctionCall.batch`, the function is compiled first"""
+        self.compile()
+        return self.func.jit_function_call.batch(*arrays, out=out)
+
+    def __repr__(self) -> str:
+        return f"Function({self.name}, jitted={self.func.jit_function_call is not None})"
@@ -1,5 +1,7 @@
 from abc import ABC, abstractclassmethod
-from src.ast_definition import ASTNumber, ASTStructValue, ASTStructureType, ASTTypedIdent
+from src.ast_definition import ASTIdentifier, ASTNumber, ASTStructureType, ASTTypedIdent, StructValue
+
+U64_MASK = 2**64 - 1
 
 class InternalObject(ABC):
     is_mutable = False
@@ -21,6 +23,18 @@ class Number(InternalObject):
     def cast(cls, obj):
         return cls(obj)
 
+    @classmethod
+    def from_unchecked(cls, value: int):
+        """Build from a python int already valid for the type, skipping the conversions of __init__"""
+        obj = cls.__new__(cls)
+        obj.value = value
+        return obj
+
+    @property
+    def _as_parameter_(self) -> int:
+        # lets ctypes convert numbers like ints
+        return self.value
+
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}({self.value!r})"
     
@@ -32,19 +46,50 @@ class Number(InternalObject):
         
 
 class U64(Number):
+    """
+    The u64 type, values of this type are unboxed: plain python ints in [0, 2**64)
+
+    Instances are the type itself (types are values), and are used to display u64 values.
+    """
     def __init__(self, value) -> None:
         if isinstance(value, float):
             value = int(value)
         super().__init__(value)
         self.value = int(self.value) % 2**64
-    
+
+    @classmethod
+    def cast(cls, obj) -> int:
+        if type(obj) is int:
+            return obj & U64_MASK
+        return cls(obj).value
+
+    @classmethod
+    def from_unchecked(cls, value: int) -> int:
+        return value
+
+
+def number_value(value) -> int:
+    """Python int of a u64 value or of a boxed number"""
+    return value if type(value) is int else value.value
+
+
+def display(value):
+    """Value as printed, u64 values are shown as U64(value)"""
+    if type(value) is int:
+        boxed = U64.__new__(U64)
+        boxed.value = value
+        return boxed
+    if isinstance(value, StructValue):
+        return StructValue(value.shape, tuple(display(field_value) for field_value in value.values))
+    return value
+
 
 class Struct(InternalObject):
     @staticmethod
     def cast(obj):
-        if not isinstance(obj, ASTStructValue):
+        if not isinstance(obj, StructValue):
             raise TypeError(f"Unexpected obj of type {obj}, expecting a structure")
         
         return ASTStructureType(
-            tuple(ASTTypedIdent(f.ident, f.value) for f in obj.fields)
+            tuple(ASTTypedIdent(ASTIdentifier(name), typ) for name, typ in obj.items())
         )
\ No newline at end of file
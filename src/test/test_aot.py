@@ -0,0 +1,70 @@
+import ctypes
+from pathlib import Path
+import subprocess
+import tempfile
+import unittest
+
+from src.aot import AOTError, build_executable, build_shared_library
+
+SOURCE = """
+twice: fn(u64) u64 = fn(int: u64) u64: int * 2
+fib: fn(u64) u64 = fn(n: u64) u64:
+    res: Mut(u64) = n
+    if n > 1:
+        res = fib(n - 1) + fib(n - 2)
+    twice(res)
+pair: struct = {left: u64, right: u64}
+first: fn(pair) u64 = fn(p: pair) u64: p.left
+traced: fn(u64) u64 = fn(x: u64) u64:
+    print(x)
+    x
+print(fib(3))
+"""
+
+
+class AheadOfTimeCompilation(unittest.TestCase):
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = Path(tmp_dir.name)
+        self.compilation_dir = self.tmp_dir / "cache"
+
+    def test_executable(self):
+        executable = self.tmp_dir / "fib"
+        build_executable(SOURCE, "fib", executable, self.compilation_dir)
+        res = subprocess.run([executable, "5"], capture_output=True, text=True, check=True)
+        self.assertEqual(res.stdout, "88\n")
+        res = subprocess.run([executable, "0x5"], capture_output=True, text=True, check=True)
+        self.assertEqual(res.stdout, "88\n")
+        # a leading 0 is decimal, not octal
+        res = subprocess.run([executable, "010"], capture_output=True, text=True, check=True)
+        self.assertEqual(res.stdout, subprocess.run([executable, "10"], capture_output=True, text=True, check=True).stdout)
+        res = subprocess.run([executable, "09"], capture_output=True, text=True, check=True)
+        self.assertEqual(res.stdout, subprocess.run([executable, "9"], capture_output=True, text=True, check=True).stdout)
+        for args in [[], ["abc"], ["5x"], ["-1"], [" -1"], ["0x"], ["0x-1"], ["0x0x5"], [str(2**64)], ["5", "6"]]:
+            with self.subTest(args=args):
+                res = subprocess.run([executable, *args], capture_output=True, text=True)
+                self.assertEqual(res.returncode, 2)
+                self.assertIn("usage", res.stderr)
+
+    def test_shared_library(self):
+        library = self.tmp_dir / "libjil.so"
+        header = build_shared_library(SOURCE, ["fib", "twice"], library, self.compilation_dir)
+        self.assertEqual(header, self.tmp_dir / "jil.h")
+        # parameters named after C keywords are renamed
+        self.assertIn("uint64_t fib(uint64_t n);\nuint64_t twice(uint64_t int_);", header.read_text())
+        lib = ctypes.CDLL(str(library))
+        for func in (lib.fib, lib.twice):
+            func.restype, func.argtypes = ctypes.c_uint64, [ctypes.c_uint64]
+        self.assertEqual((lib.fib(5), lib.twice(21)), (88, 42))
+
+    def test_unsupported_functions(self):
+        with self.assertRaisesRegex(NotImplementedError, "u64 arguments"):
+            build_executable(SOURCE, "first", self.tmp_dir / "first", self.compilation_dir)
+        with self.assertRaisesRegex(AOTError, "entrypoint traced"):
+            build_executable(SOURCE, "traced", self.tmp_dir / "traced", self.compilation_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
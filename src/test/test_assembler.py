@@ -0,0 +1,82 @@
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.assembler import AssemblerError, CodeArena, assemble
+from src.jit_builtins import BUILTIN_FUNC_ASM
+
+ASM_SAMPLE = """
+f:
+    pushq %rbp
+    movq %rsp, %rbp
+    subq $24, %rsp
+    movq %rdi, -8(%rbp)
+    movq -8(%rbp), %rax
+    movq $12345678901234, %rax
+    movq $18446744073709551615, %r10
+    movq %r12, -200(%rbp)
+    movq 16(%rsp), %r13
+    movq (%r12), %r8
+    movq $7, -16(%rbp)
+    addq $1, %r11
+    subq $1000, %rsp
+    cmpq -8(%rbp), %rax
+    cmp %rsi, %rdi
+    setb %r9b
+    setne %sil
+    movzbq %al, %rax
+    imulq -8(%rbp), %r14
+    divq %r9
+    cqo
+    idivq %rcx
+    leaq 8(%rsp), %rdi
+    sarq $2, %r15
+    pushq %r12
+    popq %r12
+    pushq -16(%rbp)
+    popq 8(%rsp)
+    callq f
+    movq %rbp, %rsp
+    popq %rbp
+    retq
+"""
+
+class Assembler(unittest.TestCase):
+
+    def gnu_assemble(self, asm_code):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src, obj, raw = (Path(tmp_dir) / name for name in ("a.s", "a.o", "a.bin"))
+            src.write_text(asm_code)
+            subprocess.run(["gcc", "-c", "-o", obj, src], check=True)
+            subprocess.run(["objcopy", "-O", "binary", "-j", ".text", obj, raw], check=True)
+            return raw.read_bytes()
+
+    def test_same_encoding_as_gnu_as(self):
+        for name, asm_code in (("sample", ASM_SAMPLE), ("builtins", "\n".join(BUILTIN_FUNC_ASM))):
+            with self.subTest(name):
+                code, _ = assemble(asm_code, 0, {})
+                self.assertEqual(code.hex(), self.gnu_assemble(asm_code).hex())
+
+    def test_external_symbols(self):
+        code, labels = assemble("g:\n    callq f\n", 0x1000, {"f": 0x1000})
+        self.assertEqual(labels, {"g": 0x1000})
+        self.assertEqual(code, b"\xe8\xfb\xff\xff\xff")
+        # calls through the PLT of gcc are direct calls
+        self.assertEqual(assemble("g:\n    callq f@PLT\n", 0x1000, {"f": 0x1000})[0], code)
+        # jumps are always encoded with a 32 bits displacement
+        code, _ = assemble("g:\n    jne g\n", 0, {})
+        self.assertEqual(code, b"\x0f\x85\xfa\xff\xff\xff")
+        with self.assertRaises(AssemblerError):
+            assemble("g:\n    callq unknown\n", 0, {})
+
+    def test_run_placed_code(self):
+        import ctypes
+        arena = CodeArena(size=4096)
+        symbols = arena.place("\n".join(BUILTIN_FUNC_ASM), {})
+        add = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64, ctypes.c_int64)(symbols["add"])
+        self.assertEqual(add(2, 40), 42)
+
+
+if __name__ == "__main__":
+    unittest.main()
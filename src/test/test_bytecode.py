@@ -0,0 +1,103 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src import bytecode, interpreter
+from src.interpreter import build_builtin_env, interpret_module
+from src.lark_parser import initialize_parser
+from src.runtime_values import *
+
+GRAMMAR_FILE = Path("grammar.lark")
+EXAMPLES_DIR = Path(__file__).absolute().parent.parent.parent / "examples"
+
+
+def run_capturing_output(run):
+    output = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            run()
+        except Exception as err:
+            error = (type(err), str(err))
+    return output.getvalue(), error
+
+
+class BytecodeVM(unittest.TestCase):
+
+    def setUp(self) -> None:
+        parser, _ = initialize_parser(GRAMMAR_FILE)
+        self.parser = parser
+        jit_disabled = mock.patch.object(interpreter, "JIT_COMPILE", False)
+        jit_disabled.start()
+        self.addCleanup(jit_disabled.stop)
+
+    def test_examples_match_tree_walker(self):
+        for example in sorted(EXAMPLES_DIR.glob("*.jil")):
+            with self.subTest(example=example.name):
+                module = self.parser.parse(example.read_text())
+                module_code = bytecode.compile_module(module)
+                expected = run_capturing_output(lambda: interpret_module(module, build_builtin_env()))
+                got = run_capturing_output(lambda: bytecode.VM().run(module_code, build_builtin_env()))
+                self.assertEqual(got, expected)
+
+    def test_block_value_and_scopes(self):
+        module_code = bytecode.compile_module(self.parser.parse(
+            "f: fn(u64) u64 = fn(x: u64) u64:\n"
+            "    if x > 2:\n"
+            "        y: u64 = x * 2\n"
+            "        y + 1\n"
+            "    else:\n"
+            "        x\n"
+            "a: u64 = f(5)\n"
+            "b: u64 = f(1)\n"
+        ))
+        env = bytecode.VM().run(module_code, build_builtin_env())
+        self.assertEqual(env.get("a"), 11)
+        self.assertEqual(env.get("b"), 1)
+        with self.assertRaises(RuntimeError):
+            env.get("y")
+
+    def test_save_and_load(self):
+        example = EXAMPLES_DIR / "struct.jil"
+        module_code = bytecode.compile_module(self.parser.parse(example.read_text()))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jbc_file = Path(tmp_dir) / "struct.jbc"
+            bytecode.save(module_code, jbc_file)
+            loaded = bytecode.load(jbc_file)
+
+            jbc_file.write_bytes(b"JBC\x00\xff\xff" + jbc_file.read_bytes()[6:])
+            with self.assertRaises(bytecode.BytecodeError):
+                bytecode.load(jbc_file)
+
+        self.assertEqual(bytecode.disassemble(loaded), bytecode.disassemble(module_code))
+        self.assertEqual(
+            run_capturing_output(lambda: bytecode.VM().run(loaded, build_builtin_env())),
+            run_capturing_output(lambda: bytecode.VM().run(module_code, build_builtin_env())),
+        )
+
+    def test_memoization(self):
+        module_code = bytecode.compile_module(self.parser.parse(
+            "fib: fn(u64) u64 = fn(n: u64) u64:\n"
+            "    r: Mut(u64) = n\n"
+            "    if n >= 2:\n"
+            "        r = fib(n - 1) + fib(n - 2)\n"
+            "    r\n"
+            "a: u64 = fib(60)\n"
+        ))
+        env = bytecode.VM(memoize=True).run(module_code, build_builtin_env())
+        self.assertEqual(env.get("a"), 1548008755920)
+        self.assertEqual(env.get("fib").memo_cache.stats()["misses"], 61)
+
+        # the cached results are dropped when a function they rely on is declared again
+        module_code = bytecode.compile_module(self.parser.parse(
+            "g: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+            "f: fn(u64) u64 = fn(x: u64) u64: g(x)\n"
+            "before: u64 = f(1) + f(1)\n"
+            "g: fn(u64) u64 = fn(x: u64) u64: x + 100\n"
+            "after: u64 = f(1)\n"
+        ))
+        env = bytecode.VM(memoize=True).run(module_code, build_builtin_env())
+        self.assertEqual((env.get("before"), env.get("after")), (4, 101))
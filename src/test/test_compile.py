@@ -0,0 +1,245 @@
+import array
+import ctypes
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src.compile import JITEngine
+from src.interpreter import build_builtin_env, interpret_func_call, interpret_module
+from src.lark_parser import initialize_parser
+from src.runtime_values import *
+
+GRAMMAR_FILE = Path("grammar.lark")
+
+FUNC_SOURCE = """
+f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:
+    c: Mut(u64) = a
+    while c < b:
+        c = c + 2
+    c
+"""
+
+class JITCompilation(unittest.TestCase):
+
+    def setUp(self) -> None:
+        parser, _ = initialize_parser(GRAMMAR_FILE)
+        self.parser = parser
+        self.env = build_builtin_env()
+        self.compilation_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.compilation_dir.cleanup()
+
+    def parse_function(self, source=FUNC_SOURCE):
+        module = self.parser.parse(source)
+        return interpret_module(module, self.env).get("f")
+
+    def test_compile_and_call(self):
+        for backend in JITEngine.backends:
+            with self.subTest(backend):
+                engine = JITEngine(self.compilation_dir.name, backend=backend)
+                func = self.parse_function()
+                engine.compile_function(func)
+                self.assertEqual(func.jit_function_call(1, 10), 11)
+
+    def test_inline_operations_are_unsigned(self):
+        source = (
+            "f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:\n"
+            "    res: Mut(u64) = a * 3 + b\n"
+            "    if a > b:\n"
+            "        res = res - b / 7\n"
+            "    res\n"
+        )
+        for backend in JITEngine.backends:
+            with self.subTest(backend):
+                engine = JITEngine(self.compilation_dir.name, backend=backend)
+                func = self.parse_function(source)
+                engine.compile_function(func)
+                self.assertEqual(func.jit_function_call(2**64 - 1, 100), 83)
+                self.assertEqual(func.jit_function_call(100, 2**64 - 1), 299)
+                self.assertEqual(func.jit_function_call(5, 3), 18)
+
+    def test_literal_operations_match_interpreter(self):
+        # the literals are not u64 values in the interpreter, their operations wrap around like in the compiled code
+        source = (
+            "f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:\n"
+            "    res: Mut(u64) = 0\n"
+            "    if 0 - 1 > a:\n"
+            "        res = 1\n"
+            "    if 3 - b < a:\n"
+            "        res = res + 10\n"
+            "    res + (2 - 5) / 2 + (0 - a) / 3\n"
+        )
+        for backend in JITEngine.backends:
+            with self.subTest(backend):
+                engine = JITEngine(self.compilation_dir.name, backend=backend)
+                func = self.parse_function(source)
+                engine.compile_function(func)
+                for args in [(5, 7), (2**64 - 1, 0), (0, 2**63)]:
+                    expected = interpret_func_call(func, args, func.closure, force_intepret=True)
+                    self.assertEqual(func.jit_function_call(*args), expected)
+
+        # more live variables than registers: some are spilled, callee saved registers are used and restored
+        count = 14
+        source = "f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:\n"
+        source += "".join(f"    v{i}: u64 = a + {i}\n" for i in range(count))
+        source += (
+            "    s: Mut(u64) = 0\n"
+            "    i: Mut(u64) = 0\n"
+            "    while i < b:\n"
+            f"        s = s + {' + '.join(f'v{i}' for i in range(count))}\n"
+            "        i = i + 1\n"
+            "    s\n"
+        )
+        for backend in JITEngine.backends:
+            with self.subTest(backend):
+                engine = JITEngine(self.compilation_dir.name, backend=backend)
+                func = self.parse_function(source)
+                engine.compile_function(func)
+                self.assertEqual(func.jit_function_call(5, 3), 3 * (count * 5 + sum(range(count))))
+
+    def test_direct_calls(self):
+        source = (
+            "square: fn(u64) u64 = fn(x: u64) u64:\n"
+            "    x * x\n"
+            "log: fn(u64) = fn(x: u64):\n"
+            "    x + 1\n"
+            "weighted: fn(u64, u64, u64, u64, u64, u64, u64, u64) u64 = fn(a: u64, b: u64, c: u64, d: u64, e: u64, g: u64, h: u64, i: u64) u64:\n"
+            "    a + 2 * b + 3 * c + 4 * d + 5 * e + 6 * g + 7 * h + 8 * i\n"
+            "f: fn(u64, u64) u64 = fn(n: u64, k: u64) u64:\n"
+            "    res: Mut(u64) = n\n"
+            "    if n > 1:\n"
+            "        log(n)\n"
+            "        res = f(n - 1, k) + f(n - 2, k) + weighted(n, k, 1, 2, 3, 4, square(n), k)\n"
+            "    res\n"
+        )
+        def expected(n, k):
+            if n <= 1:
+                return n
+            return expected(n - 1, k) + expected(n - 2, k) + n + 2 * k + 3 + 8 + 15 + 24 + 7 * n * n + 8 * k
+
+        for backend in JITEngine.backends:
+            with self.subTest(backend):
+                engine = JITEngine(self.compilation_dir.name, backend=backend)
+                module = interpret_module(self.parser.parse(source), self.env)
+                func = module.get("f")
+                engine.compile_function(func)
+                self.assertEqual(func.jit_function_call(15, 9), expected(15, 9))
+                # the called functions are compiled first, and callable on their own
+                self.assertEqual(module.get("weighted").jit_function_call(1, 1, 1, 1, 1, 1, 1, 2), 44)
+
+    def test_structs(self):
+        source = (
+            "pair: struct = {left: u64, right: u64}\n"
+            "triple: struct = {x: u64, y: u64, z: u64}\n"
+            # 16 bytes structs are passed and returned in registers, bigger ones in memory
+            "swap: fn(pair) pair = fn(p: pair) pair:\n"
+            "    {left: p.right, right: p.left}\n"
+            "scale: fn(triple, u64) triple = fn(t: triple, k: u64) triple:\n"
+            "    {z: t.z * k, x: t.x * k, y: t.y * k}\n"
+            # the pair does not fit in the registers left, it is passed on the stack
+            "weighted: fn(u64, u64, u64, u64, u64, pair, u64) u64 = fn(a: u64, b: u64, c: u64, d: u64, e: u64, p: pair, g: u64) u64:\n"
+            "    a + 2 * b + 3 * c + 4 * d + 5 * e + 6 * p.left + 7 * p.right + 8 * g\n"
+            "f: fn(pair, triple) {p: pair, t: triple, w: u64} = fn(p: pair, t: triple) {p: pair, t: triple, w: u64}:\n"
+            "    s: Mut({p: pair, t: triple}) = {t: t, p: p}\n"
+            "    i: Mut(u64) = 0\n"
+            "    while i < 3:\n"
+            "        s = {p: swap(s.p), t: scale(s.t, 2)}\n"
+            "        i = i + 1\n"
+            "    {w: weighted(1, 2, 3, 4, 5, s.p, s.t.x), p: s.p, t: s.t}\n"
+            "p0: pair = {right: 5, left: 3}\n"
+            "t0: triple = {x: 7, y: 11, z: 13}\n"
+        )
+        for backend in JITEngine.backends:
+            with self.subTest(backend):
+                engine = JITEngine(self.compilation_dir.name, backend=backend)
+                module = interpret_module(self.parser.parse(source), self.env)
+                func, p0, t0 = module.get("f"), module.get("p0"), module.get("t0")
+                expected = interpret_func_call(func, (p0, t0), func.closure, force_intepret=True)
+                engine.compile_function(func)
+                self.assertEqual(func.jit_function_call(p0, t0), expected)
+                self.assertEqual(display(expected.values[2]), U64(1 + 4 + 9 + 16 + 25 + 6 * 5 + 7 * 3 + 8 * 56))
+                # the called functions convert structs too
+                swapped = module.get("swap").jit_function_call(p0)
+                self.assertEqual(list(swapped.items()), [("left", 5), ("right", 3)])
+
+    def test_mutual_recursion_is_not_compiled(self):
+        source = (
+            "even: fn(u64) u64 = fn(n: u64) u64:\n"
+            "    res: Mut(u64) = 1\n"
+            "    if n > 0:\n"
+            "        res = f(n - 1)\n"
+            "    res\n"
+            "f: fn(u64) u64 = fn(n: u64) u64:\n"
+            "    res: Mut(u64) = 0\n"
+            "    if n > 0:\n"
+            "        res = even(n - 1)\n"
+            "    res\n"
+        )
+        engine = JITEngine(self.compilation_dir.name)
+        func = self.parse_function(source)
+        with self.assertRaisesRegex(NotImplementedError, "mutually recursive"):
+            engine.compile_function(func)
+
+    def test_batch_calls(self):
+        a = array.array("Q", [1, 5, 2**64 - 1, 7])
+        # signed arrays are taken as u64 values, read only arrays are copied
+        b = memoryview(bytes(array.array("q", [10, 5, -1, 0]))).cast("q")
+        for backend in JITEngine.backends:
+            with self.subTest(backend):
+                engine = JITEngine(self.compilation_dir.name, backend=backend)
+                func = self.parse_function()
+                engine.compile_function(func)
+                out = array.array("Q", bytes(8 * len(a)))
+                self.assertIs(func.jit_function_call.batch(a, b, out=out), out)
+                self.assertEqual(out.tolist(), [func.jit_function_call(x, y) for x, y in zip(a, b.cast("B").cast("Q"))])
+                with self.assertRaisesRegex(ValueError, "length"):
+                    func.jit_function_call.batch(a, a[:2], out=out)
+                with self.assertRaisesRegex(TypeError, "read only"):
+                    func.jit_function_call.batch(a, a, out=b)
+                with self.assertRaisesRegex(TypeError, "8 bytes integers"):
+                    func.jit_function_call.batch(a, array.array("i", range(4)), out=out)
+
+    def test_concurrent_compilations(self):
+        engine = JITEngine(self.compilation_dir.name, workers=2)
+        self.addCleanup(engine.shutdown)
+        funcs = [self.parse_function() for _ in range(4)]
+        with mock.patch.object(engine, "link", wraps=engine.link) as link:
+            for future in [engine.submit(engine.compile_function, func) for func in funcs]:
+                future.result()
+        # the same code, linked once
+        link.assert_called_once()
+        self.assertEqual(engine.cache_stats.hits, 3)
+        self.assertEqual(len({ctypes.cast(func.jit_function_call._compiled_func, ctypes.c_void_p).value for func in funcs}), 1)
+        # compilations run synchronously are not queued
+        engine.run_compile(engine.compile_function, self.parse_function())
+        self.assertEqual((engine.metrics.queue_depth, engine.metrics.completed), (0, 5))
+
+    def test_cache_reused_across_engines(self):
+        engine = JITEngine(self.compilation_dir.name, backend="gcc")
+        engine.compile_function(self.parse_function())
+        self.assertEqual(engine.cache_stats.misses, 2) # builtins + function
+
+        warm_engine = JITEngine(self.compilation_dir.name, backend="gcc")
+        func = self.parse_function()
+        warm_engine.compile_function(func)
+        self.assertEqual(warm_engine.cache_stats.misses, 0)
+        self.assertEqual(warm_engine.cache_stats.hits, 2)
+        self.assertEqual(func.jit_function_call(0, 3), 4)
+
+    def test_cache_eviction(self):
+        engine = JITEngine(self.compilation_dir.name, max_cache_size=0, backend="gcc")
+        engine.compile_function(self.parse_function())
+        engine.compile_function(self.parse_function(FUNC_SOURCE.replace("2", "3")))
+        # loaded libraries are never evicted by their own engine
+        self.assertEqual(engine.cache_stats.evictions, 0)
+
+        other_engine = JITEngine(self.compilation_dir.name, max_cache_size=0, backend="gcc")
+        other_engine.compile_function(self.parse_function(FUNC_SOURCE.replace("2", "4")))
+        self.assertEqual(other_engine.cache_stats.evictions, 2)
+        self.assertEqual(len(list(Path(self.compilation_dir.name).glob("*.so"))), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
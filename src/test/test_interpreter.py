@@ -1,9 +1,38 @@
+import contextlib
+import io
+import tempfile
 import unittest
+from pathlib import Path
+from unittest import mock
 
-from src.interpreter import build_builtin_env, interpret_expression
+from src import interpreter
+from src.compile import JITEngine
+from src.interpreter import build_builtin_env, interpret_expression, interpret_module
+from src.lark_parser import initialize_parser
+from src.profiler import Profiler
+from src.purity import MISSING, MemoCache
+from src.verification import Verifier
 from src.ast_definition import *
 from src.runtime_values import *
 
+GRAMMAR_FILE = Path("grammar.lark")
+# g and k are declared again, the functions reading them see the new values
+REDECLARATION_SOURCE = (
+    "g: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+    "f: fn(u64) u64 = fn(x: u64) u64: g(x)\n"
+    "k: u64 = 10\n"
+    "h: fn(u64) u64 = fn(x: u64) u64: x + k\n"
+    "c: Mut(u64) = 0\n"
+    "before: Mut(u64) = 0\n"
+    "while c < 5:\n"
+    "    before = f(1) + h(1)\n"
+    "    c = c + 1\n"
+    "g: fn(u64) u64 = fn(x: u64) u64: x + 100\n"
+    "k: u64 = 14\n"
+    "after: u64 = f(1) + h(1)\n"
+)
+
+
 class EvalResuts(unittest.TestCase):
 
     def test_operations(self):
@@ -13,6 +42,226 @@ class EvalResuts(unittest.TestCase):
         self.assertIsInstance(res, Number)
         self.assertEqual(res.value, 2)
 
+    def test_struct_values(self):
+        pair = ASTStructureType((ASTTypedIdent(ASTIdentifier("left"), U64(0)), ASTTypedIdent(ASTIdentifier("right"), U64(0))))
+        literal = StructValue(StructShape.of_literal(("right", "left")), (2, 1))
+        value = pair.cast(literal)
+        # the fields are stored in the order of the type, cast to the same type again without a copy
+        self.assertEqual(value.values, (1, 2))
+        self.assertIs(value.shape, pair.shape)
+        self.assertIs(pair.cast(value), value)
+        self.assertEqual(value, literal)
+        self.assertEqual(value.field("right"), 2)
+        with self.assertRaisesRegex(TypeError, "expected {'right'} unexpected {'other'}"):
+            pair.cast(StructValue(StructShape.of_literal(("left", "other")), (1, 2)))
+
+
+class TieredExecution(unittest.TestCase):
+
+    def setUp(self) -> None:
+        parser, _ = initialize_parser(GRAMMAR_FILE)
+        self.parser = parser
+        compilation_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(compilation_dir.cleanup)
+        jit_globals = mock.patch.multiple(
+            interpreter, JIT_COMPILE=True, VERIFIER=Verifier("off"), JIT_CALL_THRESHOLD=3, JIT_LOOP_THRESHOLD=10,
+            JIT_ENGINE=JITEngine(compilation_dir.name), create=True
+        )
+        jit_globals.start()
+        self.addCleanup(jit_globals.stop)
+
+    def run_module(self, source):
+        module = self.parser.parse(source)
+        env = interpret_module(module, build_builtin_env())
+        return module, env
+
+    def test_compile_hot_functions_only(self):
+        module, env = self.run_module(
+            "f: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+            "a: u64 = f(f(1))\n"
+        )
+        self.assertIsNone(env.get("f").jit_function_call)
+        self.assertEqual(env.get("f").call_count, 2)
+
+        module, env = self.run_module(
+            "f: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+            "a: u64 = f(f(f(f(1))))\n"
+        )
+        self.assertIsNotNone(env.get("f").jit_function_call)
+        self.assertEqual(env.get("a"), 5)
+
+    def test_background_compilation(self):
+        engine = JITEngine(interpreter.JIT_ENGINE.compilation_dir, workers=1)
+        with mock.patch.object(interpreter, "JIT_ENGINE", engine):
+            module, env = self.run_module(
+                "f: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+                "a: u64 = f(f(f(f(1))))\n"
+            )
+            engine.shutdown()
+        # interpreted while the compilation runs, then switched to the compiled code
+        self.assertEqual(env.get("a"), 5)
+        self.assertIsNotNone(env.get("f").jit_function_call)
+        self.assertEqual(engine.metrics.completed, 1)
+        self.assertEqual(engine.metrics.queue_depth, 0)
+        self.assertEqual(set(engine.metrics.summary()["phase_ns"]), {"codegen", "assemble"})
+
+    def test_compile_errors_fall_back(self):
+        # a bug of the compiler is logged, the function keeps being interpreted
+        with mock.patch.object(interpreter.JIT_ENGINE, "compile_function", side_effect=KeyError("phi")), self.assertLogs(interpreter.logger, "ERROR"):
+            module, env = self.run_module(
+                "f: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+                "a: u64 = f(f(f(f(1))))\n"
+            )
+        self.assertEqual(env.get("a"), 5)
+        self.assertTrue(env.get("f").jit_failed)
+        self.assertIsNone(env.get("f").jit_function_call)
+
+    def test_on_stack_replacement(self):
+        module, env = self.run_module(
+            "c: Mut(u64) = 0\n"
+            "s: Mut(u64) = 0\n"
+            "while c < 1000:\n"
+            "    tmp: u64 = c * 2\n"
+            "    s = s + tmp\n"
+            "    c = c + 1\n"
+        )
+        while_stmt = module.value.value[2].value
+        self.assertIsNotNone(while_stmt.jit_loop_call)
+        self.assertEqual(while_stmt.backedge_count, 10)
+        self.assertEqual(env.get("c"), 1000)
+        self.assertEqual(env.get("s"), 999000)
+        self.assertEqual(env.get("tmp"), 1998)
+
+    def test_redeclared_callee(self):
+        # the compiled code calls g directly, it is dropped when g is declared again
+        with mock.patch.object(interpreter, "MEMOIZE", False):
+            module, env = self.run_module(REDECLARATION_SOURCE)
+        self.assertEqual((env.get("before"), env.get("after")), (2 + 11, 101 + 15))
+        self.assertIsNone(env.get("f").jit_function_call)
+
+        completed = interpreter.JIT_ENGINE.metrics.completed
+        with mock.patch.object(interpreter, "MEMOIZE", False):
+            module, env = self.run_module(
+                "g: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+                "s: Mut(u64) = 0\n"
+                "n: Mut(u64) = 0\n"
+                "while n < 2:\n"
+                "    i: Mut(u64) = 0\n"
+                "    while i < 20:\n"
+                "        s = s + g(i)\n"
+                "        i = i + 1\n"
+                "    g: fn(u64) u64 = fn(x: u64) u64: x * 100\n"
+                "    n = n + 1\n"
+            )
+        # the inner loop is compiled again with the new g
+        self.assertEqual(env.get("s"), 210 + 19000)
+        # g and the loop, twice
+        self.assertEqual(interpreter.JIT_ENGINE.metrics.completed - completed, 4)
+
+    def test_sampled_verification(self):
+        verifier = Verifier("sampled", sample_rate=3)
+        first, second = object(), object()
+        calls = [first, first, first, second, first, first, first]
+        # the first call of each function, then 1 in 3 calls
+        self.assertEqual([verifier.should_verify(call) for call in calls], [True, False, True, True, False, True, False])
+        self.assertFalse(Verifier("off").should_verify(first))
+        self.assertTrue(Verifier("sampled", time_budget=0).should_verify(first))
+        self.assertTrue(all(Verifier("full").should_verify(first) for _ in range(3)))
+
+    def test_verification_mismatch(self):
+        verifier = Verifier("full")
+        with mock.patch.object(interpreter, "VERIFIER", verifier):
+            module, env = self.run_module(
+                "f: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+                "a: u64 = f(f(f(1)))\n"
+            )
+            func = env.get("f")
+            jit_call = mock.Mock(return_value=0, function_label="func_f")
+            func.jit_function_call = jit_call
+            # the interpreted result is kept, and the function is not jitted anymore
+            self.assertEqual(interpreter.interpret_func_call(func, [5], func.closure), 6)
+            self.assertEqual(interpreter.interpret_func_call(func, [5], func.closure), 6)
+        jit_call.assert_called_once_with(5)
+        self.assertTrue(func.jit_failed)
+        report = verifier.report()
+        self.assertEqual((report["jit_calls"], report["verified_calls"], report["mismatch_count"]), (2, 2, 1))
+        self.assertEqual(report["mismatches"], [{"function": "func_f", "arguments": ["U64(5)"], "jit_result": "U64(0)", "interpreted_result": "U64(6)"}])
+
+    def test_profile(self):
+        profiler = Profiler()
+        with mock.patch.object(interpreter, "PROFILER", profiler):
+            self.run_module(
+                "inc: fn(u64) u64 = fn(x: u64) u64: x + 1\n"
+                "twice: fn(u64) u64 = fn(x: u64) u64: inc(inc(x))\n"
+                "c: Mut(u64) = 0\n"
+                "while c < 100:\n"
+                "    c = twice(c)\n"
+            )
+        profiler.finish()
+        twice, inc = profiler.functions["twice"], profiler.functions["inc"]
+        # twice is compiled on its 3rd call, and inc with it, the loop runs compiled after 10 iterations
+        self.assertEqual((twice.calls, inc.calls), (10, 4))
+        self.assertEqual((twice.compilations, inc.compilations), (1, 1))
+        self.assertGreater(twice.exclusive_ns["jit"], 0)
+        self.assertGreater(inc.exclusive_ns["interpreted"], 0)
+        self.assertGreaterEqual(twice.inclusive_ns, sum(twice.exclusive_ns.values()) + inc.inclusive_ns)
+        stacks = {line.rpartition(" ")[0] for line in profiler.collapsed_stacks().splitlines()}
+        self.assertLessEqual({"<module>;twice;inc", "<module>;twice_[j]", "<module>;[osr loop]_[j]", "<module>;twice;[jit compile]"}, stacks)
+
+    def test_memoization(self):
+        source = (
+            "fib: fn(u64) u64 = fn(n: u64) u64:\n"
+            "    r: Mut(u64) = n\n"
+            "    if n >= 2:\n"
+            "        r = fib(n - 1) + fib(n - 2)\n"
+            "    r\n"
+            "offset: Mut(u64) = 1\n"
+            "shifted: fn(u64) u64 = fn(x: u64) u64: x + offset\n"
+            "traced: fn(u64) u64 = fn(x: u64) u64:\n"
+            "    print(x)\n"
+            "    x\n"
+            "double: fn(u64) u64 = fn(x: u64) u64: x * 2\n"
+            "both: fn(u64) u64 = fn(x: u64) u64: fib(x) + double(x)\n"
+            "a: u64 = both(40)\n"
+            "b: u64 = shifted(1)\n"
+            "c: u64 = traced(1)\n"
+        )
+        with mock.patch.object(interpreter, "MEMOIZE", True), contextlib.redirect_stdout(io.StringIO()) as output:
+            module, env = self.run_module(source)
+        self.assertEqual(output.getvalue(), "U64(1)\n")
+        self.assertEqual(env.get("a"), 102334155 + 80)
+        fib = env.get("fib")
+        self.assertEqual(fib.memo_cache.stats(), {"size": 41, "hits": 38, "misses": 41, "evictions": 0})
+        # the native recursive calls would not go through the cache
+        self.assertTrue(fib.jit_failed)
+        self.assertIsNotNone(env.get("both").memo_cache)
+        # reads a mutable variable, prints
+        self.assertIsNone(env.get("shifted").memo_cache)
+        self.assertIsNone(env.get("traced").memo_cache)
+
+        with mock.patch.multiple(interpreter, MEMOIZE=True, MEMOIZE_OVERRIDES={"double": False, "shifted": True}), contextlib.redirect_stdout(io.StringIO()):
+            module, env = self.run_module(source.replace("fib(n - 1) + fib(n - 2)", "n"))
+        self.assertIsNone(env.get("double").memo_cache)
+        self.assertIsNotNone(env.get("shifted").memo_cache)
+
+    def test_memoization_after_redeclaration(self):
+        with mock.patch.multiple(interpreter, MEMOIZE=True, JIT_COMPILE=False):
+            module, env = self.run_module(REDECLARATION_SOURCE)
+        # the cached results of f and h relied on the previous g and k
+        self.assertEqual((env.get("before"), env.get("after")), (2 + 11, 101 + 15))
+        self.assertEqual(env.get("f").memo_cache.stats()["misses"], 1)
+
+    def test_memo_cache_eviction(self):
+        cache = MemoCache(maxsize=2)
+        cache.put((1,), 1)
+        cache.put((2,), 2)
+        self.assertEqual(cache.get((1,)), 1)
+        cache.put((3,), 3)
+        # the least recently used result is evicted
+        self.assertIs(cache.get((2,)), MISSING)
+        self.assertEqual(cache.call((3,), lambda: self.fail("cached")), 3)
+        self.assertEqual(cache.stats(), {"size": 2, "hits": 2, "misses": 1, "evictions": 1})
+
 
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
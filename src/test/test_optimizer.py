@@ -0,0 +1,210 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src import interpreter
+from src.compile import JITEngine, iter_calls
+from src.interpreter import build_builtin_env, interpret_func_call, interpret_module
+from src.ir import Branch, CallTarget, build_function
+from src.lark_parser import initialize_parser
+from src.optimizer import DEFAULT_PASSES, PASSES, optimize
+from src.verification import Verifier
+
+GRAMMAR_FILE = Path("grammar.lark")
+EXAMPLES_DIR = Path(__file__).absolute().parent.parent.parent / "examples"
+
+LOOP_SOURCE = """
+f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:
+    i: Mut(u64) = 0
+    s: Mut(u64) = 0
+    while i < b:
+        s = s + i * 3 + a * b + (b * a) / 4
+        i = i + 1
+    s
+"""
+
+SWAP_SOURCE = """
+f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:
+    x: Mut(u64) = a
+    y: Mut(u64) = 1
+    n: Mut(u64) = b
+    while n != 0:
+        tmp: u64 = x
+        x = y
+        y = tmp
+        n = n - 1
+    x * 10 + y
+"""
+
+BRANCH_SOURCE = """
+f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:
+    c: u64 = 2 * 3
+    res: Mut(u64) = 0
+    if c > 5:
+        res = a + b
+    else:
+        res = a - b
+    if a > b:
+        res = res + (a + b) * (b + a)
+    res
+"""
+
+# the phis of x in the loop become trivial once the loop is sealed, the phi of b at its exit refers to one of them
+TRIVIAL_PHIS_SOURCE = """
+f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:
+    x: Mut(u64) = a
+    y: Mut(u64) = b
+    i: Mut(u64) = 0
+    while i < 12:
+        x = y
+        if i:
+            x = x
+        i = i + 1
+    if b:
+        x = b
+    x
+"""
+
+# without dead code elimination, the constant of the branch never taken is left unused
+DEAD_CONSTANT_SOURCE = """
+f: fn(u64) u64 = fn(c: u64) u64:
+    x: Mut(u64) = c - 4294967296
+    if 0 > 1:
+        x = x + 4294967296 * 3
+    x
+"""
+
+# without constant propagation, the branch is on a constant
+CONSTANT_BRANCH_SOURCE = """
+f: fn(u64) u64 = fn(a: u64) u64:
+    res: Mut(u64) = a
+    if 1:
+        res = res + 2
+    res
+"""
+
+PASS_CONFIGURATIONS = [(), *((name,) for name in PASSES), DEFAULT_PASSES]
+
+
+class Optimizer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        parser, _ = initialize_parser(GRAMMAR_FILE)
+        self.parser = parser
+        self.env = build_builtin_env()
+        jit_disabled = mock.patch.object(interpreter, "JIT_COMPILE", False)
+        jit_disabled.start()
+        self.addCleanup(jit_disabled.stop)
+
+    def parse_function(self, source):
+        return interpret_module(self.parser.parse(source), self.env).get("f")
+
+    def build(self, source, passes):
+        return optimize(build_function(self.parse_function(source), "f"), passes)
+
+    def test_constant_propagation(self):
+        function = self.build(BRANCH_SOURCE, ["constant_propagation", "dead_code_elimination"])
+        ops = [instruction.op for instruction in function.instructions()]
+        # the first if is always taken, only the branch on a > b is left
+        self.assertEqual(sum(isinstance(block.terminator, Branch) for block in function.blocks), 1)
+        self.assertNotIn("-", ops)
+        self.assertNotIn(2 * 3, [instruction.value for instruction in function.instructions() if instruction.op == "const"])
+
+    def test_common_subexpression_elimination(self):
+        function = self.build(BRANCH_SOURCE, ["common_subexpression_elimination", "dead_code_elimination"])
+        ops = [instruction.op for instruction in function.instructions()]
+        # a + b is computed once, in the entry block it dominates the if blocks
+        self.assertEqual(ops.count("+"), 3)
+
+    def test_loop_invariant_code_motion(self):
+        function = self.build(LOOP_SOURCE, ["common_subexpression_elimination", "loop_invariant_code_motion"])
+        (header, body), = function.loops()
+        loop_ops = [instruction.op for block in body for instruction in block.instructions]
+        # a * b is moved out of the loop, the division stays in it as the loop may not run
+        self.assertEqual(loop_ops.count("*"), 1)
+        self.assertIn("/", loop_ops)
+
+    def test_strength_reduction(self):
+        function = self.build(LOOP_SOURCE, ["loop_invariant_code_motion", "strength_reduction", "dead_code_elimination"])
+        (header, body), = function.loops()
+        loop_ops = [instruction.op for block in body for instruction in block.instructions]
+        # i * 3 is a variable incremented by 3, the division by 4 a shift
+        self.assertNotIn("*", loop_ops)
+        self.assertNotIn("/", loop_ops)
+        self.assertIn(">>", loop_ops)
+
+    def test_calls_are_kept(self):
+        source = (
+            "g: fn(u64) u64 = fn(a: u64) u64:\n"
+            "    a + 1\n"
+            "f: fn(u64, u64) u64 = fn(a: u64, b: u64) u64:\n"
+            "    unused: u64 = g(a)\n"
+            "    i: Mut(u64) = 0\n"
+            "    while i < b:\n"
+            "        g(a)\n"
+            "        i = i + 1\n"
+            "    g(a) + g(a)\n"
+        )
+        func = self.parse_function(source)
+        call, *_ = iter_calls(func.body)
+        function = optimize(build_function(func, "f", {call.func_name.address: CallTarget("g", ("u64",), "u64")}), DEFAULT_PASSES)
+        (header, body), = function.loops()
+        calls = [instruction for instruction in function.instructions() if instruction.op == "call"]
+        # calls are neither removed when their value is unused, nor merged, nor moved out of loops
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(sum(call.block in body for call in calls), 1)
+
+    def test_unknown_pass(self):
+        with self.assertRaisesRegex(ValueError, "Unknown optimization pass"):
+            self.build(LOOP_SOURCE, ["inline"])
+
+    def test_passes_keep_results(self):
+        cases = [
+            (LOOP_SOURCE, [(5, 7), (2**40 + 1, 3), (3, 0)]),
+            (SWAP_SOURCE, [(7, 3), (7, 4)]),
+            (BRANCH_SOURCE, [(5, 3), (3, 5), (2**64 - 1, 2)]),
+            (TRIVIAL_PHIS_SOURCE, [(1, 2), (1, 0)]),
+            (DEAD_CONSTANT_SOURCE, [(100,), (2**33,)]),
+            (CONSTANT_BRANCH_SOURCE, [(5,)]),
+        ]
+        with tempfile.TemporaryDirectory() as compilation_dir:
+            for passes in PASS_CONFIGURATIONS:
+                engine = JITEngine(compilation_dir, passes=passes)
+                for source, calls in cases:
+                    func = self.parse_function(source)
+                    engine.compile_function(func)
+                    for args in calls:
+                        with self.subTest(passes=passes, args=args):
+                            expected = interpret_func_call(func, args, func.closure, force_intepret=True)
+                            self.assertEqual(func.jit_function_call(*args), expected)
+
+    def test_examples_under_each_pass_set(self):
+        def run(module):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                interpret_module(module, build_builtin_env())
+            return output.getvalue()
+
+        with tempfile.TemporaryDirectory() as compilation_dir:
+            for example in sorted(EXAMPLES_DIR.glob("*.jil")):
+                module = self.parser.parse(example.read_text())
+                try:
+                    expected = run(module)
+                except Exception:
+                    continue
+                for passes in PASS_CONFIGURATIONS:
+                    with self.subTest(example=example.name, passes=passes), mock.patch.multiple(
+                        interpreter, JIT_COMPILE=True, VERIFIER=Verifier("off"), JIT_CALL_THRESHOLD=1, JIT_LOOP_THRESHOLD=2,
+                        JIT_ENGINE=JITEngine(compilation_dir, passes=passes), create=True
+                    ), mock.patch.object(interpreter.logger, "error") as log_error:
+                        self.assertEqual(run(self.parser.parse(example.read_text())), expected)
+                        # only the code using features the JIT does not support is left to the interpreter
+                        for (err, *_), _ in log_error.call_args_list:
+                            self.assertIsInstance(err, NotImplementedError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
+import tempfile
 import unittest
 from pathlib import Path
+from unittest import mock
 
-from src.lark_parser import initialize_parser
+from src import lark_parser
+from src.lark_parser import initialize_parser, parse_source, parser_cache_file
 
 from src.ast_definition import *
 
@@ -47,6 +50,36 @@ class Parseing(unittest.TestCase):
         self.assertIsInstance(stmt.value.var_type.value, ASTType)
         self.assertIsInstance(stmt.value.var_type.value.value, ASTIdentifier)
 
+    def test_parser_cache(self):
+        source = "f: fn(u64) u64 = fn(a: u64) u64:\n    a + 1\n# comment\nb: u64 = f(2)\n"
+        expected = repr(initialize_parser(GRAMMAR_FILE, cache_dir=None)[0].parse(source))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # built and saved, then loaded
+            for _ in range(2):
+                parser, ast_builder = initialize_parser(GRAMMAR_FILE, cache_dir=cache_dir)
+                self.assertEqual(repr(parser.parse(source)), expected)
+                self.assertEqual(len(ast_builder.comments), 1)
+            self.assertEqual(list(Path(cache_dir).iterdir()), [parser_cache_file(Path("src") / GRAMMAR_FILE, cache_dir)])
+
+
+    def test_ast_cache(self):
+        source = "a: Mut(u64) = 1\nwhile a < 10:\n    a = a * 2\n"
+        expected = repr(self.parser.parse(source))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.assertEqual(repr(parse_source(source, GRAMMAR_FILE, cache_dir)), expected)
+            cached, = Path(cache_dir).iterdir()
+            # loaded without parsing
+            with mock.patch.object(lark_parser, "_parser") as parser:
+                self.assertEqual(repr(parse_source(source, GRAMMAR_FILE, cache_dir)), expected)
+                parser.assert_not_called()
+            # a file that can not be loaded is replaced
+            cached.write_bytes(b"not a syntax tree")
+            self.assertEqual(repr(parse_source(source, GRAMMAR_FILE, cache_dir)), expected)
+            self.assertEqual(repr(parse_source(source, GRAMMAR_FILE, cache_dir)), expected)
+            self.assertNotEqual(cached.read_bytes(), b"not a syntax tree")
+            with mock.patch.object(lark_parser, "AST_CACHE_VERSION", lark_parser.AST_CACHE_VERSION + 1):
+                parse_source(source, GRAMMAR_FILE, cache_dir)
+            self.assertEqual(len(list(Path(cache_dir).iterdir())), 2)
 
 
 if __name__ == "__main__":
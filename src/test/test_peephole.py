@@ -0,0 +1,92 @@
+import unittest
+
+from src.compile import CompilationContext, Label, Register
+from src.peephole import peephole
+
+
+class Peephole(unittest.TestCase):
+
+    def test_redundant_moves(self):
+        code, removed = peephole([
+            "movq %rax, -8(%rbp)",
+            "movq -8(%rbp), %rax",
+            "movq %rbx, %rbx",
+            "movq %rcx, -16(%rbp)",
+            "movq -16(%rbp), %rdx",
+        ])
+        self.assertEqual(code, ["movq %rax, -8(%rbp)", "movq %rcx, -16(%rbp)", "movq %rcx, %rdx"])
+        self.assertEqual(removed, 2)
+
+    def test_dependent_moves_are_kept(self):
+        code = ["movq 8(%rcx), %rcx", "movq 8(%rcx), %rcx", "movq 0(%rax), %rax", "movq %rax, 0(%rax)"]
+        self.assertEqual(peephole(code), (code, 0))
+
+    def test_jumps(self):
+        code, removed = peephole([
+            "cmpq %rsi, %rdi",
+            "jb f_if_true_1",
+            "jmp f_if_false_2",
+            Label("f_if_true_1:"),
+            "movq $1, %rax",
+            "jmp f_end_if_3",
+            "movq $3, %rax",
+            Label("f_if_false_2:"),
+            "movq $2, %rax",
+            "jmp f_end_if_3",
+            Label("f_end_if_3:"),
+            "retq",
+        ])
+        self.assertEqual([str(line) for line in code], [
+            "cmpq %rsi, %rdi",
+            "jae f_if_false_2",
+            "movq $1, %rax",
+            "jmp f_end_if_3",
+            "f_if_false_2:",
+            "movq $2, %rax",
+            "f_end_if_3:",
+            "retq",
+        ])
+        self.assertEqual(removed, 3)
+
+    def test_jump_to_jump(self):
+        code, _ = peephole([
+            "je f_edge_1",
+            "movq $1, %rax",
+            "retq",
+            Label("f_edge_1:"),
+            "jmp f_end_2",
+            Label("f_end_2:"),
+            "retq",
+        ])
+        self.assertEqual(code[0], "je f_end_2")
+
+    def test_set_condition_and_branch(self):
+        code, removed = peephole([
+            "cmpq %rsi, %rdi",
+            "seta %al",
+            "movzbq %al, %rax",
+            "movq %rax, %r8",
+            "cmpq $0, %r8",
+            "je f_else_1",
+        ])
+        # the flags of the first comparison are used, the value stays available in %r8
+        self.assertEqual(code, ["cmpq %rsi, %rdi", "seta %al", "movzbq %al, %rax", "movq %rax, %r8", "jbe f_else_1"])
+        self.assertEqual(removed, 1)
+
+    def test_overwritten_set_condition(self):
+        code = ["seta %al", "movzbq %al, %rax", "movq %rdi, %rax", "cmpq $0, %rax", "jne f_1", Label("f_1:")]
+        self.assertEqual(peephole(code)[0][:4], code[:4])
+
+    def test_compilation_context(self):
+        ctx = CompilationContext(block_label="f", export_func=True)
+        ctx.emit_prelude()
+        slot = ctx.reserve_stack(8)
+        ctx.emit_move(source=Register.RDI, destination=slot)
+        ctx.emit_move(source=slot, destination=Register.RDI)
+        ctx.emit_epilogue()
+        self.assertEqual(ctx.peephole(), 1)
+        self.assertNotIn("movq -8(%rbp), %rdi", str(ctx))
+
+
+if __name__ == "__main__":
+    unittest.main()
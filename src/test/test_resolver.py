@@ -0,0 +1,73 @@
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src import interpreter
+from src.interpreter import BUILTIN_SCOPE, build_builtin_env, interpret_module
+from src.lark_parser import initialize_parser
+from src.resolver import resolve_module
+from src.ast_definition import *
+from src.runtime_values import *
+
+GRAMMAR_FILE = Path("grammar.lark")
+
+
+class SlotResolution(unittest.TestCase):
+
+    def setUp(self) -> None:
+        parser, _ = initialize_parser(GRAMMAR_FILE)
+        self.parser = parser
+        jit_disabled = mock.patch.object(interpreter, "JIT_COMPILE", False)
+        jit_disabled.start()
+        self.addCleanup(jit_disabled.stop)
+
+    def test_addresses(self):
+        module = self.parser.parse(
+            "a: Mut(u64) = 1\n"
+            "if a:\n"
+            "    a: u64 = 2\n"
+            "    b: u64 = a\n"
+            "a = 3\n"
+        )
+        resolve_module(module, BUILTIN_SCOPE)
+        decl, if_stmt, assign = (statement.value for statement in module.value.value)
+        module_depth = BUILTIN_SCOPE.depth + 1
+        self.assertEqual(decl.ident.address, (module_depth, 0))
+        self.assertEqual(decl.var_type.value.value.address, (BUILTIN_SCOPE.depth, BUILTIN_SCOPE.names["u64"]))
+        # the variables of the if block have their own slots in the module frame
+        shadowing, read = (statement.value for statement in if_stmt.if_block.value)
+        self.assertEqual(if_stmt.cond.value.address, (module_depth, 0))
+        self.assertEqual(shadowing.ident.address, (module_depth, 1))
+        self.assertEqual(read.value.value.address, (module_depth, 1))
+        self.assertEqual(assign.value[0].address, (module_depth, 0))
+        self.assertEqual(module.scope.size, 3)
+
+    def test_closures_see_declaration_frames(self):
+        env = interpret_module(self.parser.parse(
+            "x: u64 = 10\n"
+            "get_x: fn() u64 = fn() u64: x\n"
+            "f: fn(u64) u64 = fn(x: u64) u64:\n"
+            "    get_x() + x\n"
+            "a: u64 = f(1)\n"
+        ), build_builtin_env())
+        self.assertEqual(env.get("a"), 11)
+
+    def test_recursion_uses_a_frame_per_call(self):
+        env = interpret_module(self.parser.parse(
+            "fact: fn(u64) u64 = fn(n: u64) u64:\n"
+            "    res: Mut(u64) = 1\n"
+            "    if n > 1:\n"
+            "        res = n * fact(n - 1)\n"
+            "    res\n"
+            "a: u64 = fact(10)\n"
+        ), build_builtin_env())
+        self.assertEqual(env.get("a"), 3628800)
+
+    def test_unknown_name(self):
+        module = self.parser.parse("a: u64 = b\n")
+        with self.assertRaisesRegex(RuntimeError, "Unknown b"):
+            interpret_module(module, build_builtin_env())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import array
+import contextlib
+import io
+import tempfile
+import unittest
+
+from src import interpreter
+from src.runtime import Runtime
+
+SOURCE = """
+pair: struct = {left: u64, right: u64}
+swap: fn(pair) pair = fn(p: pair) pair: {left: p.right, right: p.left}
+add: fn(u64, u64) u64 = fn(a: u64, b: u64) u64: a + b
+limit: u64 = 10
+print(limit)
+"""
+
+
+class EmbeddedRuntime(unittest.TestCase):
+
+    def setUp(self) -> None:
+        compilation_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(compilation_dir.cleanup)
+        self.runtime = Runtime(jit_workers=0, jit_call_threshold=2, verify="off", compilation_dir=compilation_dir.name, ast_cache_dir=None)
+        self.addCleanup(self.runtime.close)
+
+    def test_call_functions(self):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            module = self.runtime.load_source(SOURCE)
+        # the top level statements run once, when the module is loaded
+        self.assertEqual(output.getvalue(), "U64(10)\n")
+        self.assertEqual(set(module.names()), {"pair", "swap", "add", "limit"})
+        self.assertEqual(module.get("limit"), 10)
+
+        add = module.function("add")
+        self.assertEqual([add(i, 2**64 - 1) for i in range(4)], [2**64 - 1, 0, 1, 2])
+        # compiled by the engine of the runtime, once hot
+        self.assertIsNotNone(add.func.jit_function_call)
+        self.assertIs(add.func.jit_function_call.jit_engine, self.runtime.jit_engine)
+        self.assertEqual(module.function("swap")({"left": 1, "right": 2}), {"left": 2, "right": 1})
+
+        with self.assertRaisesRegex(TypeError, "takes 2 arguments"):
+            add(1)
+        with self.assertRaisesRegex(ValueError, "for a u64"):
+            add(-1, 0)
+        with self.assertRaisesRegex(TypeError, "Wrong struct fields"):
+            module.function("swap")({"left": 1})
+        with self.assertRaisesRegex(TypeError, "not a function"):
+            module.function("limit")
+
+    def test_settings_are_restored(self):
+        engine = interpreter.JIT_ENGINE
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = self.runtime.load_source(SOURCE)
+        module.function("add")(1, 2)
+        self.assertIs(interpreter.JIT_ENGINE, engine)
+
+    def test_batch(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            add = self.runtime.load_source(SOURCE).function("add")
+        out = array.array("Q", bytes(8 * 3))
+        add.batch(array.array("Q", [1, 2, 3]), array.array("Q", [10, 20, 30]), out=out)
+        self.assertEqual(out.tolist(), [11, 22, 33])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 from typing import Any
 from dataclasses import dataclass
+import weakref
 
 @dataclass
 class TypedVar:
@@ -7,42 +8,57 @@ class TypedVar:
     typ: Any
 
 
-class Environment:
-    def __init__(self, parent=None, env=None) -> None:
-        self.parent = parent
-        self._env = env if env is not None else {}
-
-    def get(self, val):
-        if val in self._env:
-            return self._env[val].value
-        
-        if self.parent is not None:
-            return self.parent.get(val)
-        
-        raise RuntimeError(f"Unknown {val} in env")
-
-    def get_typ(self, val):
-        if val in self._env:
-            return self._env[val].typ
-        
-        if self.parent is not None:
-            return self.parent.get_typ(val)
-        
-        raise RuntimeError(f"Unknown {val} in env")
+class _Unbound:
+    def __repr__(self) -> str:
+        return "UNBOUND"
+
+# value of the slots of variables that are not declared yet
+UNBOUND = _Unbound()
+
+
+class Frame:
+    """Variables of a function call, or of the module, stored in the slots assigned by the resolver"""
+    __slots__ = ("scope", "values", "types", "dependents")
+
+    def __init__(self, scope) -> None:
+        self.scope = scope
+        self.values = [UNBOUND] * scope.size
+        self.types = [None] * scope.size
+        # weak references to the functions and loops relying on the values of immutable slots, by slot
+        self.dependents = None
+
+    def add_dependent(self, slot, node):
+        """`node` (a function value or a loop) caches results or compiled code assuming the value of `slot` does not change"""
+        if self.dependents is None:
+            self.dependents = {}
+        self.dependents.setdefault(slot, []).append(weakref.ref(node))
+
+    def rebind(self, slot):
+        """The variable of `slot` is declared again, even immutable, the nodes relying on its value are invalidated"""
+        for ref in self.dependents.pop(slot, ()):
+            node = ref()
+            if node is not None:
+                node.invalidate()
+
+    def _slot(self, var) -> int:
+        slot = self.scope.names.get(var)
+        if slot is None or self.values[slot] is UNBOUND:
+            raise RuntimeError(f"Unknown {var} in env")
+        return slot
+
+    # access by name to the variables of the top level block, the interpreters use the slots directly
+    def get(self, var):
+        return self.values[self._slot(var)]
+
+    def get_typ(self, var):
+        return self.types[self._slot(var)]
 
     def update(self, var, val):
-        if var in self._env:
-            self._env[var].value = val
-        else:
-            if self.parent is None:
-                raise RuntimeError(f"Assigning to undeclared var {var}")
-            else:
-                self.parent.update(var, val)
-
-    # systematicaly shadow parent env
-    def set(self, var, val, typ):
-        # also shadow var in the same environement, the shadowed var is not accessible anymore after this
-        if val is None:
-            raise ValueError(f"Unexpected None")
-        self._env[var] = TypedVar(val, typ)
+        self.values[self._slot(var)] = val
 
+    def set(self, var, val, typ):
+        if var not in self.scope.names:
+            raise RuntimeError(f"No slot for {var} in frame")
+        slot = self.scope.names[var]
+        self.values[slot] = val
+        self.types[slot] = typ
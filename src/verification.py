@@ -0,0 +1,104 @@
+"""
+Differential verification of jitted calls: the call is also interpreted and both results are compared
+
+Modes:
+- off: jitted calls are trusted
+- sampled: the first call of each compiled function is verified, then 1 in `sample_rate` jitted calls. With a
+  `time_budget`, calls are only verified while verifying took less than this fraction of the time since the start
+- full: every jitted call is verified, the jitted code is never faster than the interpreter
+
+On a mismatch the interpreted result is used, and the function is interpreted from then on. The mismatches are
+recorded in the report of the verifier.
+"""
+from dataclasses import asdict, dataclass, field
+import threading
+import time
+
+from src.runtime_values import display
+
+VERIFY_MODES = ("off", "sampled", "full")
+# mismatches kept in the report, the following ones are only counted
+MAX_RECORDED_MISMATCHES = 100
+
+
+@dataclass
+class Mismatch:
+    function: str
+    arguments: list[str]
+    jit_result: str
+    interpreted_result: str
+
+
+@dataclass
+class Verifier:
+    mode: str = "sampled"
+    sample_rate: int = 100
+    # fraction of the run time that can be spent verifying, None for no limit
+    time_budget: float | None = None
+
+    jit_calls: int = 0
+    verified_calls: int = 0
+    verify_ns: int = 0
+    mismatch_count: int = 0
+    mismatches: list[Mismatch] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.mode not in VERIFY_MODES:
+            raise ValueError(f"Unknown verification mode {self.mode}, expected one of {VERIFY_MODES}")
+        if self.sample_rate < 1:
+            raise ValueError(f"The sample rate should be at least 1, not {self.sample_rate}")
+        self._countdown = self.sample_rate
+        # compiled functions called at least once
+        self._seen = set()
+        self._start_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def should_verify(self, jit_call) -> bool:
+        """Whether to verify this call of the compiled function `jit_call`"""
+        self.jit_calls += 1
+        if self.mode == "full":
+            return True
+        if self.mode == "off":
+            return False
+        self._countdown -= 1
+        if self._countdown and jit_call in self._seen:
+            return False
+        if not self._countdown:
+            self._countdown = self.sample_rate
+        self._seen.add(jit_call)
+        if self.time_budget is not None:
+            return self.verify_ns <= self.time_budget * (time.perf_counter_ns() - self._start_ns)
+        return True
+
+    def verify(self, jit_call, arguments, interpret):
+        """
+        Result of `jit_call(*arguments)`, checked against `interpret()`
+
+        Returns the interpreted result and False when they differ.
+        """
+        t = time.perf_counter_ns()
+        interpreted = interpret()
+        self.verify_ns += time.perf_counter_ns() - t
+        self.verified_calls += 1
+        jitted = jit_call(*arguments)
+        if jitted == interpreted:
+            return jitted, True
+        with self._lock:
+            self.mismatch_count += 1
+            if len(self.mismatches) < MAX_RECORDED_MISMATCHES:
+                self.mismatches.append(Mismatch(
+                    jit_call.function_label, [repr(display(arg)) for arg in arguments], repr(display(jitted)), repr(display(interpreted))
+                ))
+        return interpreted, False
+
+    def report(self) -> dict:
+        return {
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "time_budget": self.time_budget,
+            "jit_calls": self.jit_calls,
+            "verified_calls": self.verified_calls,
+            "verify_ns": self.verify_ns,
+            "mismatch_count": self.mismatch_count,
+            "mismatches": [asdict(mismatch) for mismatch in self.mismatches],
+        }